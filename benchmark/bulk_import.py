@@ -0,0 +1,64 @@
+# Records/sec of POST /api/resumes:bulk, the body is generated and streamed as it is sent.
+#
+# Start the server against a local Postgres and run the benchmark against it:
+#   uvicorn source.main:app --port 8080
+#   python benchmark/bulk_import.py --url http://localhost:8080 --records 100000
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+import httpx
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk resume import benchmark")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--skills", type=int, default=1000, help="distinct skills and keywords across the records")
+    return parser.parse_args()
+
+async def create_user(client: httpx.AsyncClient):
+    user = await client.post("/api/signup", json={
+        "email": f"bench_{uuid.uuid4().hex}@example.com",
+        "password": "benchmark",
+        "first_name": "Bench",
+        "last_name": "Mark",
+    })
+    user.raise_for_status()
+
+    return user.json()["id"]
+
+async def records(user_id: int, count: int, skills: int):
+    for i in range(count):
+        yield (json.dumps({
+            "user_id": user_id,
+            "title": f"Imported resume {i}",
+            "description": "Resume written by the bulk import benchmark",
+            "educations": [{"institution": f"University {i % 50}", "degree": "Master"}],
+            "conferences": [{"name": f"Conference {i % 20}", "year": 2000 + i % 20}],
+            "skills": [{"type": "Programming language", "name": f"Language {(i + j) % skills}"} for j in range(5)],
+            "keywords": [{"name": f"Keyword {(i + j) % skills}"} for j in range(5)],
+        }) + "\n").encode()
+
+async def main():
+    args = parse_args()
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+        user_id = await create_user(client)
+
+        start = time.perf_counter()
+        response = await client.post("/api/resumes:bulk", content=records(user_id, args.records, args.skills))
+        response.raise_for_status()
+        elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for line in response.text.splitlines():
+        status = json.loads(line)["status"]
+        statuses[status] = statuses.get(status, 0) + 1
+
+    print(f"records: {args.records} in {elapsed:.1f} s, results by status: {statuses}")
+    print(f"throughput: {args.records / elapsed:.1f} records/sec")
+
+if __name__ == "__main__":
+    asyncio.run(main())
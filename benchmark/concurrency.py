@@ -0,0 +1,69 @@
+# Requests per second of GET /api/resumes/{id} with many concurrent clients.
+#
+# Start the server against a local Postgres once per mode and run the benchmark against it:
+#   DATABASE_ASYNC=false uvicorn source.main:app --port 8080
+#   DATABASE_ASYNC=true uvicorn source.main:app --port 8080
+#   python benchmark/concurrency.py --url http://localhost:8080 --clients 500
+
+import argparse
+import asyncio
+import time
+import uuid
+import httpx
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Concurrent GET /api/resumes/{id} benchmark")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    return parser.parse_args()
+
+async def create_resume(client: httpx.AsyncClient):
+    user = await client.post("/api/signup", json={
+        "email": f"bench_{uuid.uuid4().hex}@example.com",
+        "password": "benchmark",
+        "first_name": "Bench",
+        "last_name": "Mark",
+    })
+    user.raise_for_status()
+
+    resume = await client.post("/api/resumes", json={
+        "user_id": user.json()["id"],
+        "title": "Benchmark resume",
+        "description": "Resume used by the concurrency benchmark",
+        "educations": [{"institution": f"University {i}", "degree": "Master"} for i in range(5)],
+        "conferences": [{"name": f"Conference {i}", "year": 2000 + i} for i in range(5)],
+        "skills": [{"type": "Programming language", "name": f"Language {i}"} for i in range(10)],
+        "keywords": [{"name": f"Keyword {i}"} for i in range(10)],
+    })
+    resume.raise_for_status()
+
+    return resume.json()["id"]
+
+async def worker(client: httpx.AsyncClient, resume_id: int, deadline: float, results: dict):
+    while time.perf_counter() < deadline:
+        try:
+            response = await client.get(f"/api/resumes/{resume_id}")
+            results["ok" if response.status_code == 200 else "failed"] += 1
+        except httpx.HTTPError:
+            results["failed"] += 1
+
+async def main():
+    args = parse_args()
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60.0) as client:
+        resume_id = await create_resume(client)
+        results = {"ok": 0, "failed": 0}
+
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(worker(client, resume_id, deadline, results) for _ in range(args.clients)))
+        elapsed = time.perf_counter() - start
+
+    print(f"clients: {args.clients}")
+    print(f"requests: {results['ok']} ok, {results['failed']} failed in {elapsed:.1f} s")
+    print(f"throughput: {results['ok'] / elapsed:.1f} requests/sec")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+# Records/sec of GET /api/resumes:export, the dump is read as it is streamed.
+#
+# Start the server against a local Postgres (benchmark/bulk_import.py fills it quickly) and
+# run the benchmark against it:
+#   uvicorn source.main:app --port 8080
+#   python benchmark/export.py --url http://localhost:8080 --format csv
+
+import argparse
+import asyncio
+import time
+import httpx
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Streaming resume export benchmark")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    return parser.parse_args()
+
+async def main():
+    args = parse_args()
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+        lines = 0
+        size = 0
+        start = time.perf_counter()
+        first_byte = None
+        async with client.stream("GET", "/api/resumes:export", params={"format": args.format}) as response:
+            response.raise_for_status()
+            async for data in response.aiter_bytes():
+                if first_byte == None:
+                    first_byte = time.perf_counter() - start
+                lines += data.count(b"\n")
+                size += len(data)
+        elapsed = time.perf_counter() - start
+
+    # the CSV header is not a record (CSV fields with line breaks are counted as several lines)
+    records = lines - 1 if args.format == "csv" else lines
+    print(f"records: {records} ({size / 2 ** 20:.1f} MiB) in {elapsed:.1f} s, first byte after {(first_byte or 0) * 1000:.0f} ms")
+    print(f"throughput: {records / elapsed:.1f} records/sec")
+
+if __name__ == "__main__":
+    asyncio.run(main())
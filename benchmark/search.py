@@ -0,0 +1,47 @@
+# Latency percentiles of GET /api/resumes/search with concurrent clients.
+#
+# Fill a local Postgres with benchmark/bulk_import.py (the target is p95 < 50 ms on 1M
+# resumes), start the server and run the benchmark against it:
+#   uvicorn source.main:app --port 8080
+#   python benchmark/search.py --url http://localhost:8080 --query "resume 42" --query benchmark
+
+import argparse
+import asyncio
+import itertools
+import time
+import httpx
+from signin_storm import percentile
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resume search latency benchmark")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--query", action="append", help="search text, may be repeated")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    return parser.parse_args()
+
+async def worker(client: httpx.AsyncClient, queries, deadline: float, latencies: list, failed: list):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get("/api/resumes/search", params={"q": next(queries)})
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            failed.append(response.status_code)
+
+async def main():
+    args = parse_args()
+    queries = itertools.cycle(args.query or ["benchmark", "imported resume", "resume 42"])
+    latencies = []
+    failed = []
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=60.0) as client:
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(*(worker(client, queries, deadline, latencies, failed) for _ in range(args.clients)))
+
+    print(f"searches: {len(latencies)} ok, {len(failed)} failed, {len(latencies) / args.duration:.1f} searches/sec")
+    if latencies != []:
+        print(f"latency: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p95 {percentile(latencies, 0.95) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
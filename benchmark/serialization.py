@@ -0,0 +1,60 @@
+# Microbenchmark of rendering one resume with 100 children of each kind to JSON, in process:
+# the response_model path (validated models, validated again and encoded by FastAPI) against
+# the document of crud.resume_document validated into the model and rendered by its compiled
+# serializer, and the document rendered as it is by crud.render_document (every resume response).
+#
+# Run from the project directory:
+#   python -m benchmark.serialization --children 100
+
+import argparse
+import datetime
+import timeit
+from fastapi.responses import JSONResponse
+from source import crud, models, schemas
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resume response serialization microbenchmark")
+    parser.add_argument("--children", type=int, default=100)
+    parser.add_argument("--number", type=int, default=1000, help="renders per measurement")
+    return parser.parse_args()
+
+# a loaded resume, without a database
+def make_resume(children: int):
+    resume = models.Resume(id=1, user_id=1, date=datetime.datetime.now(datetime.timezone.utc), title="Benchmark resume", description="Resume of a cool developer", version=1)
+    resume.educations = [models.Education(id=i, institution=f"University {i}", degree="Master") for i in range(children)]
+    resume.conferences = [models.Conference(id=i, name=f"Conference {i}", year=2000 + i % 20) for i in range(children)]
+    resume.skills = [models.ResumeSkillAssociation(skills=models.Skill(id=i, type="Programming language", name=f"Language {i}")) for i in range(children)]
+    resume.keywords = [models.ResumeKeywordAssociation(keyword=models.Keyword(id=i, name=f"Keyword {i}")) for i in range(children)]
+
+    return resume
+
+def response_model_json(resume: models.Resume):
+    resume_response = schemas.ResumeResponse(
+        id=resume.id, user_id=resume.user_id, date=resume.date, title=resume.title, description=resume.description,
+        educations=[schemas.EducationResponse(id=education.id, institution=education.institution, degree=education.degree) for education in resume.educations],
+        conferences=[schemas.ConferenceResponse(id=conference.id, name=conference.name, year=conference.year) for conference in resume.conferences],
+        skills=[schemas.SkillResponse(id=association.skills.id, type=association.skills.type, name=association.skills.name) for association in resume.skills],
+        keywords=[schemas.KeywordResponse(id=association.keyword.id, name=association.keyword.name) for association in resume.keywords],
+    )
+    # FastAPI validates the returned value against the response_model before encoding it
+    validated = schemas.ResumeResponse.model_validate(resume_response.model_dump())
+    return JSONResponse(content=validated.model_dump(mode="json")).body
+
+def compiled_json(resume: models.Resume):
+    resume_response = schemas.ResumeResponse.model_validate(crud.resume_document(resume))
+    return resume_response.__pydantic_serializer__.to_json(resume_response)
+
+def document_json(resume: models.Resume):
+    return crud.render_document(crud.resume_document(resume))
+
+def main():
+    args = parse_args()
+    resume = make_resume(args.children)
+    assert response_model_json(resume) == compiled_json(resume) == document_json(resume)
+
+    for name, render in [("response_model", response_model_json), ("compiled", compiled_json), ("document", document_json)]:
+        seconds = min(timeit.repeat(lambda: render(resume), number=args.number, repeat=5)) / args.number
+        print(f"{name}: {seconds * 1e6:.0f} us per resume, {len(render(resume))} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Latency of GET /api/resumes/{id} while a storm of /api/signin requests hashes passwords.
+#
+# Start the server against a local Postgres and run the benchmark against it:
+#   uvicorn source.main:app --port 8080
+#   python benchmark/signin_storm.py --url http://localhost:8080 --signins 200
+
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+from concurrency import create_resume
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resume read latency during a sign in storm")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--signins", type=int, default=200, help="concurrent sign in clients")
+    parser.add_argument("--readers", type=int, default=10, help="concurrent resume readers")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of each phase")
+    return parser.parse_args()
+
+def percentile(values: list, p: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+async def reader(client: httpx.AsyncClient, resume_id: int, deadline: float, latencies: list):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get(f"/api/resumes/{resume_id}")
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+
+async def signer(client: httpx.AsyncClient, credentials: dict, deadline: float, statuses: dict):
+    while time.perf_counter() < deadline:
+        response = await client.post("/api/signin", json=credentials)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+async def measure(client, resume_id, readers, deadline, background=()):
+    latencies = []
+    await asyncio.gather(*(reader(client, resume_id, deadline, latencies) for _ in range(readers)), *background)
+    return latencies
+
+def report(name: str, latencies: list):
+    print(f"{name}: {len(latencies)} reads, p50 {statistics.median(latencies) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+async def main():
+    args = parse_args()
+    limits = httpx.Limits(max_connections=args.signins + args.readers)
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60.0) as client:
+        resume_id = await create_resume(client)
+        email = f"storm_{resume_id}@example.com"
+        user = await client.post("/api/signup", json={"email": email, "password": "benchmark", "first_name": "Sign", "last_name": "In"})
+        user.raise_for_status()
+        credentials = {"email": email, "password": "benchmark"}
+
+        baseline = await measure(client, resume_id, args.readers, time.perf_counter() + args.duration)
+
+        statuses = {}
+        deadline = time.perf_counter() + args.duration
+        storm = await measure(client, resume_id, args.readers, deadline,
+                              [signer(client, credentials, deadline, statuses) for _ in range(args.signins)])
+
+    report("idle", baseline)
+    report("sign in storm", storm)
+    print(f"sign in responses: {statuses}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
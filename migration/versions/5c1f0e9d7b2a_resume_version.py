@@ -0,0 +1,24 @@
+"""resume version
+
+Revision ID: 5c1f0e9d7b2a
+Revises: a30704f3fd75
+Create Date: 2026-10-16 10:12:41.503217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1f0e9d7b2a'
+down_revision = 'a30704f3fd75'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('resumes', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('resumes', 'version')
@@ -0,0 +1,58 @@
+"""lookup indexes
+
+Revision ID: 9e4b7a61c3d8
+Revises: 5c1f0e9d7b2a
+Create Date: 2026-10-16 11:04:27.118903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b7a61c3d8'
+down_revision = '5c1f0e9d7b2a'
+branch_labels = None
+depends_on = None
+
+
+# merges rows that would violate the new unique constraints into the row with the lowest id
+def merge_duplicates(table: str, columns: str, association_table: str, association_column: str) -> None:
+    duplicates = f"""
+        SELECT id, keep_id FROM (
+            SELECT id, min(id) OVER (PARTITION BY {columns}) AS keep_id FROM {table}
+        ) AS ranked WHERE id <> keep_id
+    """
+    op.execute(f"""
+        INSERT INTO {association_table} (resume_id, {association_column})
+        SELECT DISTINCT a.resume_id, d.keep_id
+        FROM {association_table} a JOIN ({duplicates}) d ON a.{association_column} = d.id
+        ON CONFLICT DO NOTHING
+    """)
+    op.execute(f"DELETE FROM {association_table} WHERE {association_column} IN (SELECT id FROM ({duplicates}) d)")
+    op.execute(f"DELETE FROM {table} WHERE id IN (SELECT id FROM ({duplicates}) d)")
+
+
+def upgrade() -> None:
+    merge_duplicates('skills', 'type, name', 'resume_skill_associations', 'skill_id')
+    merge_duplicates('keywords', 'name', 'resume_keyword_associations', 'keyword_id')
+    op.create_unique_constraint('uq_skills_type_name', 'skills', ['type', 'name'])
+    op.create_unique_constraint('uq_keywords_name', 'keywords', ['name'])
+
+    op.create_index(op.f('ix_resumes_user_id'), 'resumes', ['user_id'], unique=False)
+    op.create_index('ix_resumes_date_id', 'resumes', ['date', 'id'], unique=False)
+    op.create_index(op.f('ix_educations_resume_id'), 'educations', ['resume_id'], unique=False)
+    op.create_index(op.f('ix_conferences_resume_id'), 'conferences', ['resume_id'], unique=False)
+    op.create_index(op.f('ix_resume_skill_associations_skill_id'), 'resume_skill_associations', ['skill_id'], unique=False)
+    op.create_index(op.f('ix_resume_keyword_associations_keyword_id'), 'resume_keyword_associations', ['keyword_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_resume_keyword_associations_keyword_id'), table_name='resume_keyword_associations')
+    op.drop_index(op.f('ix_resume_skill_associations_skill_id'), table_name='resume_skill_associations')
+    op.drop_index(op.f('ix_conferences_resume_id'), table_name='conferences')
+    op.drop_index(op.f('ix_educations_resume_id'), table_name='educations')
+    op.drop_index('ix_resumes_date_id', table_name='resumes')
+    op.drop_index(op.f('ix_resumes_user_id'), table_name='resumes')
+    op.drop_constraint('uq_keywords_name', 'keywords', type_='unique')
+    op.drop_constraint('uq_skills_type_name', 'skills', type_='unique')
@@ -0,0 +1,26 @@
+"""resume search vector
+
+Revision ID: b7d2c4e8f1a3
+Revises: 9e4b7a61c3d8
+Create Date: 2026-10-16 15:38:52.440261
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2c4e8f1a3'
+down_revision = '9e4b7a61c3d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE resumes ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', title || ' ' || description)) STORED")
+    op.execute("CREATE INDEX ix_resumes_search_vector ON resumes USING gin (search_vector)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX ix_resumes_search_vector")
+    op.execute("ALTER TABLE resumes DROP COLUMN search_vector")
@@ -0,0 +1,30 @@
+"""resume snapshots
+
+Revision ID: c4e1f7a9b2d6
+Revises: b7d2c4e8f1a3
+Create Date: 2026-10-16 23:41:07.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e1f7a9b2d6'
+down_revision = 'b7d2c4e8f1a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('resume_snapshots',
+    sa.Column('resume_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('document', sa.JSON(), nullable=False),
+    sa.ForeignKeyConstraint(['resume_id'], ['resumes.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('resume_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('resume_snapshots')
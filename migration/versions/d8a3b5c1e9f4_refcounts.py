@@ -0,0 +1,33 @@
+"""skill and keyword refcounts
+
+Revision ID: d8a3b5c1e9f4
+Revises: c4e1f7a9b2d6
+Create Date: 2026-10-17 00:12:45.903117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8a3b5c1e9f4'
+down_revision = 'c4e1f7a9b2d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('skills', sa.Column('refcount', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('keywords', sa.Column('refcount', sa.Integer(), server_default='0', nullable=False))
+    # the counters start from the associations that exist
+    op.execute("UPDATE skills SET refcount = (SELECT count(*) FROM resume_skill_associations WHERE resume_skill_associations.skill_id = skills.id)")
+    op.execute("UPDATE keywords SET refcount = (SELECT count(*) FROM resume_keyword_associations WHERE resume_keyword_associations.keyword_id = keywords.id)")
+    op.create_index('ix_skills_refcount', 'skills', ['refcount', 'id'], unique=False)
+    op.create_index('ix_keywords_refcount', 'keywords', ['refcount', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_keywords_refcount', table_name='keywords')
+    op.drop_index('ix_skills_refcount', table_name='skills')
+    op.drop_column('keywords', 'refcount')
+    op.drop_column('skills', 'refcount')
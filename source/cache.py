@@ -0,0 +1,200 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from . import metrics
+
+# in-process caches; every server process keeps its own copy
+
+class TTLCache:
+    # bounded mapping with least recently used eviction, every entry expires at its own deadline
+
+    def __init__(self, maxsize: int, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at: float):
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                if self.on_evict != None:
+                    self.on_evict()
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    # removes the entries whose value matches, it walks the whole cache so it is meant for rare events
+    def delete_matching(self, predicate):
+        with self.lock:
+            for key in [key for key, (value, _) in self.entries.items() if predicate(value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+# response caches store finished response bodies behind a pluggable backend: the in-process
+# LRU backend, or a shared backend that all server processes see
+
+cache_requests = metrics.Counter("response_cache_requests_total", "Response cache lookups", ("cache", "result"))
+cache_evictions = metrics.Counter("response_cache_evictions_total", "Response cache entries evicted by the size limit", ("cache",))
+cache_invalidations = metrics.Counter("response_cache_invalidations_total", "Response cache entries invalidated by writes", ("cache",))
+
+# a reader takes a lease on the key before it reads what it renders the entry from, and the entry
+# is filled only with the last lease taken on the key and only if the key was not deleted since:
+# a response rendered concurrently with a write is never stored after the write's invalidation
+
+class CacheBackend:
+    def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def lease(self, key: str):
+        raise NotImplementedError
+
+    def fill(self, key: str, value: bytes, lease):
+        raise NotImplementedError
+
+class NullCacheBackend(CacheBackend):
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value: bytes):
+        pass
+
+    def delete(self, key: str):
+        pass
+
+    def lease(self, key: str):
+        return None
+
+    def fill(self, key: str, value: bytes, lease):
+        pass
+
+class LRUCacheBackend(CacheBackend):
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.ttl = ttl
+        self.entries = TTLCache(maxsize=maxsize, on_evict=lambda: cache_evictions.inc(name))
+        # an evicted lease only makes its fill a no-op
+        self.leases = TTLCache(maxsize=maxsize)
+        self.lease_ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def set(self, key: str, value: bytes):
+        self.entries.set(key, value, expires_at=time.time() + self.ttl)
+
+    def delete(self, key: str):
+        with self.lock:
+            self.leases.delete(key)
+            self.entries.delete(key)
+
+    def lease(self, key: str):
+        lease = next(self.lease_ids)
+        self.leases.set(key, lease, expires_at=time.time() + self.ttl)
+        return lease
+
+    def fill(self, key: str, value: bytes, lease):
+        with self.lock:
+            if self.leases.get(key) != lease:
+                return
+            self.leases.delete(key)
+            self.set(key, value)
+
+class RedisCacheBackend(CacheBackend):
+    # the lease check and the write are one step on the server
+    fill_script = """
+if redis.call("GET", KEYS[2]) == ARGV[2] then
+    redis.call("DEL", KEYS[2])
+    redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[3])
+end
+"""
+
+    def __init__(self, url: str, ttl: float):
+        import redis # optional dependency, needed only for the shared backend
+
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(url)
+        self.fill_entry = self.client.register_script(self.fill_script)
+
+    def lease_key(self, key: str):
+        return f"lease:{key}"
+
+    def get(self, key: str):
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes):
+        self.client.set(key, value, ex=int(self.ttl))
+
+    def delete(self, key: str):
+        self.client.delete(key, self.lease_key(key))
+
+    def lease(self, key: str):
+        lease = uuid.uuid4().hex
+        self.client.set(self.lease_key(key), lease, ex=int(self.ttl))
+        return lease
+
+    def fill(self, key: str, value: bytes, lease):
+        self.fill_entry(keys=[key, self.lease_key(key)], args=[value, lease, int(self.ttl)])
+
+class ResponseCache:
+    def __init__(self, name: str, backend: CacheBackend):
+        self.name = name
+        self.backend = backend
+
+    def get(self, key: str):
+        value = self.backend.get(key)
+        cache_requests.inc(self.name, "miss" if value == None else "hit")
+        return value
+
+    def set(self, key: str, value: bytes):
+        self.backend.set(key, value)
+
+    def lease(self, key: str):
+        return self.backend.lease(key)
+
+    def fill(self, key: str, value: bytes, lease):
+        self.backend.fill(key, value, lease)
+
+    def invalidate(self, key: str):
+        cache_invalidations.inc(self.name)
+        self.backend.delete(key)
+
+# entries also expire after the ttl
+def create_response_cache(name: str, backend: str, maxsize: int, ttl: float, url: str):
+    if backend == "memory":
+        return ResponseCache(name, LRUCacheBackend(name=name, maxsize=maxsize, ttl=ttl))
+    if backend == "redis":
+        return ResponseCache(name, RedisCacheBackend(url=url, ttl=ttl))
+
+    return ResponseCache(name, NullCacheBackend())
@@ -1,20 +1,28 @@
-from sqlalchemy.orm import Session
+import base64
+import functools
+import hashlib
+import io
+from sqlalchemy import Date, bindparam, cast, delete, func, inspect, literal_column, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import Session, selectinload, make_transient_to_detached
+from sqlalchemy.orm.exc import StaleDataError
+from typing import List
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from fastapi.security import HTTPAuthorizationCredentials
-from . import models, schemas
+import pydantic_core
+from . import jobs, models, schemas
+from .cache import TTLCache, cache_requests, create_response_cache
+from .search import InvertedIndex
 from .secret_variables import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from .settings import DICTIONARY_CACHE_SIZE, TOKEN_CACHE_SIZE, RESUME_CACHE_BACKEND, RESUME_CACHE_SIZE, RESUME_CACHE_TTL, RESUME_CACHE_URL, RESUME_BULK_COPY, RESUME_SEARCH_FACETS, RESUME_SEARCH_FACET_RESUMES, RESUME_SNAPSHOTS, RESUME_WRITE_ATTEMPTS, JOB_QUEUE
 
 # authentification functions
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# passwords are hashed and verified in the process pool of passwords.py
 
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def hash_password(password: str):
-    return pwd_context.hash(password)
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE)
 
 def find_user_email(db: Session, user_email: str):
     return db.query(models.User).filter(models.User.email == user_email).first()
@@ -27,17 +35,18 @@ def create_access_token(token_data: schemas.TokenCreate):
 
     return schemas.TokenResponse(access_token=encoded_jwt)
 
-def authenticate_user(db: Session, user: schemas.UserAuth):
-    db_user = find_user_email(db=db, user_email=user.email)
+# tokens are keyed by their digest; a cached token was valid and its user existed when it
+# was verified, so it is trusted until its exp claim or until the user is deleted (the cache is
+# off with several worker processes, see TOKEN_CACHE_SIZE)
 
-    if db_user == None:
-        return None
-    if not verify_password(user.password, db_user.password):
-        return None
-    
-    return schemas.TokenCreate(email=db_user.email)
+def token_digest(token: str):
+    return hashlib.sha256(token.encode()).digest()
 
 def is_token_authorized(db: Session, token: HTTPAuthorizationCredentials):
+    digest = token_digest(token.credentials)
+    if token_cache.get(digest) != None:
+        return True
+
     # expiration check works
     try:
         payload = jwt.decode(token.credentials, SECRET_KEY, algorithms=[ALGORITHM])
@@ -48,46 +57,68 @@ def is_token_authorized(db: Session, token: HTTPAuthorizationCredentials):
     if db_user == None:
         return False
     
+    if TOKEN_CACHE_SIZE > 0:
+        token_cache.set(digest, payload, expires_at=payload["exp"])
     return True
     
 # create responses functions
 
-def find_user_resumes(db: Session, user_id: int):
-    return db.query(models.Resume).filter(models.Resume.user_id == user_id).all()
+def find_user_resume_ids(db: Session, user_id: int):
+    return db.scalars(select(models.Resume.id).filter(models.Resume.user_id == user_id).order_by(models.Resume.id)).all()
 
 def create_user_response(db: Session, user: models.User):
     user_response = schemas.UserResponse(id=user.id, email=user.email, first_name=user.first_name, last_name=user.last_name)
-    for resume in find_user_resumes(db=db, user_id=user.id):
-        user_response.resume_ids.append(resume.id)
+    for resume_id in find_user_resume_ids(db=db, user_id=user.id):
+        user_response.resume_ids.append(resume_id)
 
     return user_response
 
-def create_resume_response(db: Session, resume_id: int):
-    resume = find_resume_id(db=db, resume_id=resume_id)
-    resume_response = schemas.ResumeResponse(id=resume.id, user_id=resume.user_id, date=resume.date, title=resume.title, description=resume.description)
-
-    for education in find_resume_educations(db=db, resume_id=resume_id):
-        resume_response.educations.append(schemas.EducationResponse(id=education.id, institution=education.institution, degree=education.degree))
-
-    for conference in find_resume_conferences(db=db, resume_id=resume_id):
-        resume_response.conferences.append(schemas.ConferenceResponse(id=conference.id, name=conference.name, year=conference.year))
+# resumes are rendered from plain documents in the field order of schemas.ResumeResponse, and
+# pages from documents in the field order of their schema: pydantic_core serializes them to the
+# same bytes FastAPI renders for the response model, without building and validating the models
+# first; the rows they come from were validated on their way in
+#
+# the children of every response are in id order, the order find_resume_documents reads them
+# in, so a version of a resume has one body whether it comes from a write, the ORM or the tables,
+# never the order of the request
+
+def resume_document(resume: models.Resume):
+    educations = sorted(resume.educations, key=lambda education: education.id)
+    conferences = sorted(resume.conferences, key=lambda conference: conference.id)
+    skills = sorted((resume_skill.skills for resume_skill in resume.skills), key=lambda skill: skill.id)
+    keywords = sorted((resume_keyword.keyword for resume_keyword in resume.keywords), key=lambda keyword: keyword.id)
+    return {
+        "id": resume.id,
+        "user_id": resume.user_id,
+        "date": resume.date,
+        "title": resume.title,
+        "description": resume.description,
+        "educations": [{"institution": education.institution, "degree": education.degree, "id": education.id} for education in educations],
+        "conferences": [{"name": conference.name, "year": conference.year, "id": conference.id} for conference in conferences],
+        "skills": [{"type": skill.type, "name": skill.name, "id": skill.id} for skill in skills],
+        "keywords": [{"name": keyword.name, "id": keyword.id} for keyword in keywords],
+    }
+
+def render_document(document: dict):
+    return pydantic_core.to_json(document)
 
-    for skill in find_resume_skills(db=db, resume_id=resume_id):
-        resume_response.skills.append(schemas.SkillResponse(id=skill.id, type=skill.type, name=skill.name))
-
-    for keyword in find_resume_keywords(db=db, resume_id=resume_id):
-        resume_response.keywords.append(schemas.KeywordResponse(id=keyword.id, name=keyword.name))
+# find by entity functions
 
-    return resume_response
+def find_skills(db: Session, skills: List[schemas.Skill]):
+    keys = {(skill.type, skill.name) for skill in skills}
+    if keys == set():
+        return {}
 
-# find by entity functions
+    db_skills = db.query(models.Skill).filter(tuple_(models.Skill.type, models.Skill.name).in_(keys)).all()
+    return {(skill.type, skill.name): skill for skill in db_skills}
 
-def find_skill(db: Session, skill: schemas.Skill):
-    return db.query(models.Skill).filter(models.Skill.type == skill.type, models.Skill.name == skill.name).first()
+def find_keywords(db: Session, keywords: List[schemas.Keyword]):
+    names = {keyword.name for keyword in keywords}
+    if names == set():
+        return {}
 
-def find_keyword(db: Session, keyword: schemas.Keyword):
-    keyword = db.query(models.Keyword).filter(models.Keyword.name == keyword.name).first()
-    return keyword
+    db_keywords = db.query(models.Keyword).filter(models.Keyword.name.in_(names)).all()
+    return {keyword.name: keyword for keyword in db_keywords}
 
 # find entity by id functions
 
@@ -97,57 +128,496 @@ def find_user_id(db: Session, user_id: int):
 def find_resume_id(db: Session, resume_id: int):
     return db.query(models.Resume).filter(models.Resume.id == resume_id).first()
 
+# loads the resume together with all of its children: one statement for the resume
+# and one per child collection, no matter how many children the resume has
+resume_children_options = (
+    selectinload(models.Resume.educations),
+    selectinload(models.Resume.conferences),
+    selectinload(models.Resume.skills).joinedload(models.ResumeSkillAssociation.skills),
+    selectinload(models.Resume.keywords).joinedload(models.ResumeKeywordAssociation.keyword),
+)
+
+def find_resume_full(db: Session, resume_id: int):
+    return db.query(models.Resume).options(*resume_children_options).filter(models.Resume.id == resume_id).first()
+
 def find_skill_id(db: Session, skill_id: int):
     return db.query(models.Skill).filter(models.Skill.id == skill_id).first()
 
 def find_keyword_id(db: Session, keyword_id: int):
     return db.query(models.Keyword).filter(models.Keyword.id == keyword_id).first()
 
-# find associations by entity id functions
-
-def find_skill_associations_id(db: Session, skill_id: int):
-    return db.query(models.ResumeSkillAssociation).filter(models.ResumeSkillAssociation.skill_id == skill_id).all()
-
-def find_keyword_associations_id(db: Session, keyword_id: int):
-    return db.query(models.ResumeKeywordAssociation).filter(models.ResumeKeywordAssociation.keyword_id == keyword_id).all()
-
-# find resume children by resume id functions
+# resume listing: keyset pagination on (date, id), newest first; the cursor is the
+# (date, id) of the last resume of the previous page
 
-def find_resume_educations(db: Session, resume_id: int):
-    return db.query(models.Education).filter(models.Education.resume_id == resume_id).all()
+class InvalidCursor(Exception):
+    pass
 
-def find_resume_conferences(db: Session, resume_id: int):
-    return db.query(models.Conference).filter(models.Conference.resume_id == resume_id).all()
+def encode_cursor(resume: models.Resume):
+    return base64.urlsafe_b64encode(f"{resume.date.isoformat()}|{resume.id}".encode()).decode()
 
-def find_resume_skill_associations(db: Session, resume_id: int):
-    return db.query(models.ResumeSkillAssociation).filter(models.ResumeSkillAssociation.resume_id == resume_id).all()
-
-def find_resume_skills(db: Session, resume_id: int):
-    skills = []
-    for resume_skill in find_resume_skill_associations(db=db, resume_id=resume_id):
-        skills.append(find_skill_id(db=db, skill_id=resume_skill.skill_id))
-
-    return skills
-
-def find_resume_keyword_associations(db: Session, resume_id: int):
-    return db.query(models.ResumeKeywordAssociation).filter(models.ResumeKeywordAssociation.resume_id == resume_id).all()
-
-def find_resume_keywords(db: Session, resume_id: int):
-    keywords = []
-    for resume_keyword in find_resume_keyword_associations(db=db, resume_id=resume_id):
-        keywords.append(find_keyword_id(db=db, keyword_id=resume_keyword.keyword_id))
-
-    return keywords
+def decode_cursor(cursor: str):
+    try:
+        date, resume_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(date), int(resume_id)
+    except ValueError:
+        raise InvalidCursor()
+
+def resume_filters(db: Session, user_id: int | None = None, skill: str | None = None, keyword: str | None = None, text: str | None = None):
+    filters = []
+    if user_id != None:
+        filters.append(models.Resume.user_id == user_id)
+    if skill != None:
+        filters.append(models.Resume.skills.any(models.ResumeSkillAssociation.skills.has(models.Skill.name == skill)))
+    if keyword != None:
+        filters.append(models.Resume.keywords.any(models.ResumeKeywordAssociation.keyword.has(models.Keyword.name == keyword)))
+    if text != None:
+        filters.append(search_filter(db=db, text=text))
+
+    return filters
+
+# one statement for the page and one per child collection, whatever the page size
+def find_resumes_page(db: Session, limit: int, cursor: str | None = None, user_id: int | None = None, skill: str | None = None, keyword: str | None = None, text: str | None = None):
+    query = db.query(models.Resume).options(*resume_children_options)
+    query = query.filter(*resume_filters(db=db, user_id=user_id, skill=skill, keyword=keyword, text=text))
+    if cursor != None:
+        query = query.filter(tuple_(models.Resume.date, models.Resume.id) < tuple_(*decode_cursor(cursor)))
+
+    # one extra row tells whether there is a next page
+    resumes = query.order_by(models.Resume.date.desc(), models.Resume.id.desc()).limit(limit + 1).all()
+    return resumes[:limit], len(resumes) > limit
+
+def get_resumes_page(db: Session, limit: int, cursor: str | None = None, user_id: int | None = None, skill: str | None = None, keyword: str | None = None):
+    resumes, has_next = find_resumes_page(db=db, limit=limit, cursor=cursor, user_id=user_id, skill=skill, keyword=keyword)
+
+    # a schemas.ResumePage
+    return {
+        "items": [resume_document(resume) for resume in resumes],
+        "next_cursor": encode_cursor(resumes[-1]) if has_next else None,
+    }
+
+# export: every resume with its children in chunks of chunk_size, ordered by id; the resumes
+# are read through a server side cursor (yield_per) and the children of each chunk with one
+# statement per collection, so memory depends on the chunk size and not on the table size
+def iter_resume_chunks(db: Session, chunk_size: int):
+    query = db.query(models.Resume).options(*resume_children_options).order_by(models.Resume.id).yield_per(chunk_size)
+
+    chunk = []
+    for resume in query:
+        chunk.append(resume_document(resume))
+        if len(chunk) == chunk_size:
+            # only the rendered chunk is kept, the identity map holds the unmodified objects
+            # behind it weakly, so they are released with the chunk
+            yield chunk
+            chunk = []
+    if chunk != []:
+        yield chunk
+
+# search: full-text matching of the title and description, the listing filters and order,
+# and facets with the most used skills and keywords among the newest RESUME_SEARCH_FACET_RESUMES
+# matches; they read a range of ix_resumes_date_id and the associations of those resumes only,
+# so a search without q does not count every association of the table
+
+search_index = InvertedIndex()
+
+def uses_search_vector(db: Session):
+    return db.get_bind().dialect.name == "postgresql"
+
+# the resume is a models.Resume or a row of its columns
+def resume_search_document(resume):
+    return resume.id, f"{resume.title} {resume.description}"
+
+def load_search_index(db: Session):
+    rows = db.query(models.Resume.id, models.Resume.title, models.Resume.description).yield_per(1000)
+    search_index.load(resume_search_document(row) for row in rows)
+
+# loaded by the warm-up, so the first search does not wait for it
+def warm_search_index(db: Session):
+    if not uses_search_vector(db) and not search_index.loaded:
+        load_search_index(db=db)
+
+def search_filter(db: Session, text: str):
+    if uses_search_vector(db):
+        return literal_column("resumes.search_vector").op("@@")(func.websearch_to_tsquery("english", text))
+
+    if not search_index.loaded:
+        load_search_index(db=db)
+    return models.Resume.id.in_(search_index.search(text))
+
+# the in-process index follows the committed writes once it is loaded, PostgreSQL maintains
+# its own; the documents are (id, text) pairs of resume_search_document
+def index_resumes(documents: list):
+    if search_index.loaded:
+        for resume_id, text in documents:
+            search_index.add(resume_id, text)
+
+def unindex_resumes(resume_ids: List[int]):
+    if search_index.loaded:
+        for resume_id in resume_ids:
+            search_index.remove(resume_id)
+
+def find_search_facets(db: Session, filters: list, limit: int, resumes: int):
+    matches = select(models.Resume.id).where(*filters).order_by(models.Resume.date.desc(), models.Resume.id.desc()).limit(resumes)
+    count = func.count().label("count")
+
+    skills = (
+        db.query(models.Skill.type, models.Skill.name, count)
+        .join(models.ResumeSkillAssociation, models.ResumeSkillAssociation.skill_id == models.Skill.id)
+        .filter(models.ResumeSkillAssociation.resume_id.in_(matches))
+        .group_by(models.Skill.id, models.Skill.type, models.Skill.name)
+        .order_by(count.desc(), models.Skill.name)
+        .limit(limit)
+    )
+    keywords = (
+        db.query(models.Keyword.name, count)
+        .join(models.ResumeKeywordAssociation, models.ResumeKeywordAssociation.keyword_id == models.Keyword.id)
+        .filter(models.ResumeKeywordAssociation.resume_id.in_(matches))
+        .group_by(models.Keyword.id, models.Keyword.name)
+        .order_by(count.desc(), models.Keyword.name)
+        .limit(limit)
+    )
+
+    return (
+        [{"type": type, "name": name, "count": count} for type, name, count in skills],
+        [{"name": name, "count": count} for name, count in keywords],
+    )
+
+def search_resumes(db: Session, text: str | None, limit: int, cursor: str | None = None, user_id: int | None = None, skill: str | None = None, keyword: str | None = None):
+    resumes, has_next = find_resumes_page(db=db, limit=limit, cursor=cursor, user_id=user_id, skill=skill, keyword=keyword, text=text)
+    filters = resume_filters(db=db, user_id=user_id, skill=skill, keyword=keyword, text=text)
+    skill_facets, keyword_facets = find_search_facets(db=db, filters=filters, limit=RESUME_SEARCH_FACETS, resumes=RESUME_SEARCH_FACET_RESUMES)
+
+    # a schemas.ResumeSearchPage
+    return {
+        "items": [resume_document(resume) for resume in resumes],
+        "next_cursor": encode_cursor(resumes[-1]) if has_next else None,
+        "skills": skill_facets,
+        "keywords": keyword_facets,
+    }
+
+# analytics: the most used skills and keywords come from their refcounts in the order of the
+# refcount index, without counting associations; the trends count the resumes per period of
+# Resume.date for the most used skills or keywords of the date range, which the caller bounds
+# (ANALYTICS_TREND_MAX_DAYS) so they read a range of ix_resumes_date_id
+
+# the first day of the period of the resume date, weeks start on monday
+def date_bucket(db: Session, bucket: str):
+    if db.get_bind().dialect.name == "sqlite":
+        if bucket == "week":
+            return func.date(models.Resume.date, "weekday 0", "-6 days")
+        return func.strftime({"day": "%Y-%m-%d", "month": "%Y-%m-01", "year": "%Y-01-01"}[bucket], models.Resume.date)
+    return cast(func.date_trunc(bucket, models.Resume.date), Date)
+
+def date_range_filters(since: datetime, until: datetime):
+    return [models.Resume.date >= since, models.Resume.date < until]
+
+def get_top_skills(db: Session, limit: int):
+    rows = db.execute(
+        select(models.Skill.type, models.Skill.name, models.Skill.refcount)
+        .where(models.Skill.refcount > 0).order_by(models.Skill.refcount.desc(), models.Skill.id.desc()).limit(limit)
+    )
+    return [schemas.SkillFacet(type=type, name=name, count=count) for type, name, count in rows]
+
+def get_top_keywords(db: Session, limit: int):
+    rows = db.execute(
+        select(models.Keyword.name, models.Keyword.refcount)
+        .where(models.Keyword.refcount > 0).order_by(models.Keyword.refcount.desc(), models.Keyword.id.desc()).limit(limit)
+    )
+    return [schemas.KeywordFacet(name=name, count=count) for name, count in rows]
+
+def get_skill_trend(db: Session, bucket: str, limit: int, since: datetime, until: datetime):
+    association = models.ResumeSkillAssociation
+    period = date_range_filters(since=since, until=until)
+    top = (
+        select(association.skill_id).join(models.Resume, models.Resume.id == association.resume_id).where(*period)
+        .group_by(association.skill_id).order_by(func.count().desc(), association.skill_id).limit(limit)
+    )
+    period_start = date_bucket(db=db, bucket=bucket).label("bucket")
+    count = func.count().label("count")
+
+    rows = db.execute(
+        select(period_start, models.Skill.type, models.Skill.name, count)
+        .select_from(association)
+        .join(models.Resume, models.Resume.id == association.resume_id)
+        .join(models.Skill, models.Skill.id == association.skill_id)
+        .where(*period, association.skill_id.in_(top))
+        .group_by(period_start, models.Skill.id, models.Skill.type, models.Skill.name)
+        .order_by(period_start, count.desc(), models.Skill.name)
+    )
+    return [schemas.SkillTrend(bucket=bucket, type=type, name=name, count=count) for bucket, type, name, count in rows]
+
+def get_keyword_trend(db: Session, bucket: str, limit: int, since: datetime, until: datetime):
+    association = models.ResumeKeywordAssociation
+    period = date_range_filters(since=since, until=until)
+    top = (
+        select(association.keyword_id).join(models.Resume, models.Resume.id == association.resume_id).where(*period)
+        .group_by(association.keyword_id).order_by(func.count().desc(), association.keyword_id).limit(limit)
+    )
+    period_start = date_bucket(db=db, bucket=bucket).label("bucket")
+    count = func.count().label("count")
+
+    rows = db.execute(
+        select(period_start, models.Keyword.name, count)
+        .select_from(association)
+        .join(models.Resume, models.Resume.id == association.resume_id)
+        .join(models.Keyword, models.Keyword.id == association.keyword_id)
+        .where(*period, association.keyword_id.in_(top))
+        .group_by(period_start, models.Keyword.id, models.Keyword.name)
+        .order_by(period_start, count.desc(), models.Keyword.name)
+    )
+    return [schemas.KeywordTrend(bucket=bucket, name=name, count=count) for bucket, name, count in rows]
 
 # get entity functions
 
 def get_resume(db: Session, resume_id: int):
-    return create_resume_response(db=db, resume_id=resume_id)
+    resume = find_resume_full(db=db, resume_id=resume_id)
+    if resume == None:
+        return None
+
+    return resume_document(resume)
+
+# conditional requests: the strong ETag of a resume changes with its version
+
+class PreconditionFailed(Exception):
+    pass
+
+def resume_etag(resume_id: int, version: int):
+    return f'"{resume_id}.{version}"'
+
+# If-None-Match uses the weak comparison (W/ prefixes are ignored), If-Match the strong one
+def etag_matches(header: str, etag: str, weak: bool):
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if weak and tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+
+    return False
+
+def check_if_match(resume: models.Resume, if_match: str | None):
+    if if_match != None and not etag_matches(if_match, resume_etag(resume.id, resume.version), weak=False):
+        raise PreconditionFailed()
+
+# the flush fails with StaleDataError when another request changed the resume after it was
+# read; that fails the precondition of a write sent with If-Match, a write without one is made
+# again on the resume as the other request left it, RESUME_WRITE_ATTEMPTS times at most
+
+class ResumeWriteConflict(Exception):
+    pass
+
+def retry_on_concurrent_write(function):
+    @functools.wraps(function)
+    def wrapper(db: Session, if_match: str | None = None, **kwargs):
+        for _ in range(RESUME_WRITE_ATTEMPTS):
+            try:
+                return function(db=db, if_match=if_match, **kwargs)
+            except StaleDataError:
+                db.rollback()
+                if if_match != None:
+                    raise PreconditionFailed()
+        raise ResumeWriteConflict()
+
+    return wrapper
+
+# the read path of GET /api/resumes/{id} and POST /api/resumes:batchGet: the documents of the
+# resumes straight from row tuples, with one statement for the resumes and one per child table
+# whatever the number of ids; returns {id: (document, version)} for the resumes that exist
+def find_resume_documents(db: Session, resume_ids: list):
+    resumes = db.execute(
+        select(models.Resume.id, models.Resume.user_id, models.Resume.date, models.Resume.title, models.Resume.description, models.Resume.version)
+        .where(models.Resume.id.in_(resume_ids))
+    ).all()
+    if resumes == []:
+        return {}
+
+    documents = {}
+    for resume in resumes:
+        document = resume._asdict()
+        version = document.pop("version")
+        document.update(educations=[], conferences=[], skills=[], keywords=[])
+        documents[resume.id] = (document, version)
+    found_ids = list(documents)
+
+    educations = db.execute(
+        select(models.Education.resume_id, models.Education.institution, models.Education.degree, models.Education.id)
+        .where(models.Education.resume_id.in_(found_ids)).order_by(models.Education.id)
+    )
+    conferences = db.execute(
+        select(models.Conference.resume_id, models.Conference.name, models.Conference.year, models.Conference.id)
+        .where(models.Conference.resume_id.in_(found_ids)).order_by(models.Conference.id)
+    )
+    skills = db.execute(
+        select(models.ResumeSkillAssociation.resume_id, models.Skill.type, models.Skill.name, models.Skill.id)
+        .join(models.ResumeSkillAssociation, models.ResumeSkillAssociation.skill_id == models.Skill.id)
+        .where(models.ResumeSkillAssociation.resume_id.in_(found_ids)).order_by(models.Skill.id)
+    )
+    keywords = db.execute(
+        select(models.ResumeKeywordAssociation.resume_id, models.Keyword.name, models.Keyword.id)
+        .join(models.ResumeKeywordAssociation, models.ResumeKeywordAssociation.keyword_id == models.Keyword.id)
+        .where(models.ResumeKeywordAssociation.resume_id.in_(found_ids)).order_by(models.Keyword.id)
+    )
+
+    for key, rows in [("educations", educations), ("conferences", conferences), ("skills", skills), ("keywords", keywords)]:
+        for row in rows:
+            child = row._asdict()
+            documents[child.pop("resume_id")][0][key].append(child)
+
+    return documents
+
+# materialized documents (RESUME_SNAPSHOTS): the writes store the document of the resume in
+# resume_snapshots together with its version, in their own transaction; a snapshot is read only
+# while its version is the resume's, so one missed by a write made with the mode off is never
+# served and the resume is assembled from the tables instead
+
+def find_resume_snapshots(db: Session, resume_ids: list):
+    rows = db.execute(
+        select(models.ResumeSnapshot.resume_id, models.ResumeSnapshot.document, models.ResumeSnapshot.version)
+        .join(models.Resume, (models.Resume.id == models.ResumeSnapshot.resume_id) & (models.Resume.version == models.ResumeSnapshot.version))
+        .where(models.ResumeSnapshot.resume_id.in_(resume_ids))
+    )
+    return {row.resume_id: (row.document, row.version) for row in rows}
+
+# documents is {id: (document, version)} as find_resume_documents returns it
+def upsert_snapshots(db: Session, documents: dict):
+    if documents == {}:
+        return
+
+    rows = [{"resume_id": resume_id, "version": version, "document": pydantic_core.to_jsonable_python(document)} for resume_id, (document, version) in documents.items()]
+    insert_snapshots = dialect_insert(db, models.ResumeSnapshot).values(rows)
+    db.execute(insert_snapshots.on_conflict_do_update(
+        index_elements=["resume_id"],
+        set_={"version": insert_snapshots.excluded.version, "document": insert_snapshots.excluded.document},
+    ))
+
+def write_snapshots(db: Session, resumes: List[models.Resume]):
+    if RESUME_SNAPSHOTS:
+        upsert_snapshots(db=db, documents={resume.id: (resume_document(resume), resume.version) for resume in resumes})
+
+# the snapshots first when they are kept, the tables for the resumes they do not cover
+def load_resume_documents(db: Session, resume_ids: list):
+    documents = find_resume_snapshots(db=db, resume_ids=resume_ids) if RESUME_SNAPSHOTS else {}
+    missing_ids = [resume_id for resume_id in resume_ids if resume_id not in documents]
+    if missing_ids != []:
+        documents.update(find_resume_documents(db=db, resume_ids=missing_ids))
+
+    return documents
+
+def find_resume_document(db: Session, resume_id: int):
+    return load_resume_documents(db=db, resume_ids=[resume_id]).get(resume_id)
+
+def find_resume_version(db: Session, resume_id: int):
+    return db.query(models.Resume.version).filter(models.Resume.id == resume_id).scalar()
+
+# rendered resumes are cached by id together with their ETag ("<etag>\n<json>");
+# every write to a resume invalidates its entry after the commit, and a read fills the entry
+# with the lease it took before reading the resume, so a resume read before a write commits is
+# not stored once the write has invalidated it
+
+resume_cache = create_response_cache("resume", backend=RESUME_CACHE_BACKEND, maxsize=RESUME_CACHE_SIZE, ttl=RESUME_CACHE_TTL, url=RESUME_CACHE_URL)
+
+def resume_cache_key(resume_id: int):
+    return f"resume:{resume_id}"
+
+# returns the body and the ETag of the resume, the body is None when if_none_match matches
+def get_resume_json(db: Session, resume_id: int, if_none_match: str | None = None):
+    key = resume_cache_key(resume_id)
+    cached = resume_cache.get(key)
+    if cached != None:
+        etag, _, content = cached.partition(b"\n")
+        etag = etag.decode()
+        if if_none_match != None and etag_matches(if_none_match, etag, weak=True):
+            return None, etag
+        return content, etag
+    lease = resume_cache.lease(key)
+
+    # a version lookup is enough to answer a conditional request for an unchanged resume
+    if if_none_match != None:
+        version = find_resume_version(db=db, resume_id=resume_id)
+        if version == None:
+            return None
+        if etag_matches(if_none_match, resume_etag(resume_id, version), weak=True):
+            return None, resume_etag(resume_id, version)
+
+    result = find_resume_document(db=db, resume_id=resume_id)
+    if result == None:
+        return None
+
+    document, version = result
+    etag = resume_etag(resume_id, version)
+    content = render_document(document)
+    resume_cache.fill(key, etag.encode() + b"\n" + content, lease)
+    return content, etag
+
+# POST /api/resumes:batchGet: the body of {"items": [...]} with one item per requested id, in the
+# order of the ids; the cached resumes are used as they are and the others are loaded together
+# by load_resume_documents and cached
+def get_resumes_json(db: Session, resume_ids: list):
+    contents = {}
+    for resume_id in set(resume_ids):
+        cached = resume_cache.get(resume_cache_key(resume_id))
+        if cached != None:
+            contents[resume_id] = cached.partition(b"\n")[2]
+
+    missing_ids = [resume_id for resume_id in set(resume_ids) if resume_id not in contents]
+    if missing_ids != []:
+        leases = {resume_id: resume_cache.lease(resume_cache_key(resume_id)) for resume_id in missing_ids}
+        for resume_id, (document, version) in load_resume_documents(db=db, resume_ids=missing_ids).items():
+            contents[resume_id] = render_document(document)
+            resume_cache.fill(resume_cache_key(resume_id), resume_etag(resume_id, version).encode() + b"\n" + contents[resume_id], leases[resume_id])
+
+    items = []
+    for resume_id in resume_ids:
+        if resume_id in contents:
+            items.append(b'{"id":%d,"status":200,"resume":%s}' % (resume_id, contents[resume_id]))
+        else:
+            items.append(b'{"id":%d,"status":404,"resume":null}' % resume_id)
+    return b'{"items":[' + b",".join(items) + b"]}"
+
+# skill and keyword dictionary: (type, name) -> skill id and name -> keyword id of the process,
+# warmed at startup and filled on misses; entries do not expire, they are deleted when the
+# orphan cleanup removes their row. Another process can still remove a row behind a cached id:
+# the insert of its association then fails on the foreign key and the write is retried once
+# with the dictionary emptied (retry_on_stale_dictionary)
+
+skill_cache = TTLCache(maxsize=DICTIONARY_CACHE_SIZE)
+keyword_cache = TTLCache(maxsize=DICTIONARY_CACHE_SIZE)
+
+def cache_dictionary(skills: List[models.Skill] = [], keywords: List[models.Keyword] = []):
+    for skill in skills:
+        skill_cache.set((skill.type, skill.name), skill.id, expires_at=float("inf"))
+    for keyword in keywords:
+        keyword_cache.set(keyword.name, keyword.id, expires_at=float("inf"))
+
+def warm_dictionary_cache(db: Session):
+    cache_dictionary(
+        skills=db.query(models.Skill).limit(DICTIONARY_CACHE_SIZE).all(),
+        keywords=db.query(models.Keyword).limit(DICTIONARY_CACHE_SIZE).all(),
+    )
+
+# a cached row is attached to the session as it is, without a statement
+def cached_instance(db: Session, instance):
+    make_transient_to_detached(instance)
+    return db.merge(instance, load=False)
+
+def retry_on_stale_dictionary(function):
+    @functools.wraps(function)
+    def wrapper(db: Session, **kwargs):
+        try:
+            return function(db=db, **kwargs)
+        except IntegrityError:
+            db.rollback()
+            skill_cache.clear()
+            keyword_cache.clear()
+            return function(db=db, **kwargs)
+
+    return wrapper
 
 # create entity functions
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = hash_password(user.password)
+# the password is hashed by the caller, outside of the database session
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
     # **user.dict() can be used
     db_user = models.User(email = user.email, password = hashed_password, first_name = user.first_name, last_name = user.last_name)
     db.add(db_user)
@@ -157,178 +627,544 @@ def create_user(db: Session, user: schemas.UserCreate):
     
     return create_user_response(db=db, user=db_user)
 
+def update_user_password(db: Session, user_id: int, hashed_password: str):
+    db.query(models.User).filter(models.User.id == user_id).update({models.User.password: hashed_password})
+    db.commit()
+
+# the write path is a single unit of work: children are attached to the resume in memory,
+# one flush sends them as batched inserts (one statement per table), the response is built
+# from the flushed objects and the request commits exactly once
+
+@retry_on_stale_dictionary
 def create_resume(db: Session, resume: schemas.ResumeCreate):
     db_resume = models.Resume(title=resume.title, description=resume.description, user_id=resume.user_id)
-    db.add(db_resume)
-    db.commit()
-    db.refresh(db_resume)
 
     for education in resume.educations:
-        create_education(db=db, education=education, resume_id=db_resume.id)
+        create_education(resume=db_resume, education=education)
     for conference in resume.conferences:
-        create_conference(db=db, conference=conference, resume_id=db_resume.id)
-    for skill in resume.skills:
-        create_skill(db=db, skill=skill, resume_id=db_resume.id)
-    for keyword in resume.keywords:
-        create_keyword(db=db, keyword=keyword, resume_id=db_resume.id)
-
-    return create_resume_response(db=db, resume_id=db_resume.id)
+        create_conference(resume=db_resume, conference=conference)
+    create_skills(db=db, resume=db_resume, skills=resume.skills)
+    create_keywords(db=db, resume=db_resume, keywords=resume.keywords)
 
-def create_education(db: Session, education: schemas.Education, resume_id: int):
-    db_education = models.Education(institution=education.institution, degree=education.degree, resume_id=resume_id)
-    db.add(db_education)
-    db.commit()
-    db.refresh(db_education)
-
-def create_conference(db: Session, conference: schemas.Conference, resume_id: int):
-    db_conference = models.Conference(name=conference.name, year=conference.year, resume_id=resume_id)
-    db.add(db_conference)
+    db.add(db_resume)
+    count_references(db=db, resumes=[db_resume])
+    db.flush()
+    write_snapshots(db=db, resumes=[db_resume])
+    document = resume_document(db_resume)
+    search_documents = [resume_search_document(db_resume)]
     db.commit()
-    db.refresh(db_conference)
-
-def create_skill(db: Session, skill: schemas.Skill, resume_id: int):
-    db_skill = find_skill(db=db, skill=skill)
-
-    if db_skill == None:
-        db_skill = models.Skill(type=skill.type, name=skill.name)
-        db.add(db_skill)
-        db.commit()
-        db.refresh(db_skill)
-
-    db_resume_skill = models.ResumeSkillAssociation(resume_id=resume_id, skill_id=db_skill.id)
-    db.add(db_resume_skill)
+    index_resumes(search_documents)
+
+    return document
+
+def create_education(resume: models.Resume, education: schemas.Education):
+    resume.educations.append(models.Education(institution=education.institution, degree=education.degree))
+
+def create_conference(resume: models.Resume, conference: schemas.Conference):
+    resume.conferences.append(models.Conference(name=conference.name, year=conference.year))
+
+# skills and keywords missing from the dictionary are resolved as a set: one SELECT for the
+# known ones and one INSERT ... ON CONFLICT DO NOTHING RETURNING for the new ones; rows inserted
+# by a concurrent request between the two statements are not returned and are read again. The
+# VALUES are sorted, so requests inserting the same new rows lock their keys in the same order
+# and do not deadlock
+
+def dialect_insert(db: Session, model):
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+def upsert_skills(db: Session, skills: List[schemas.Skill]):
+    keys = {(skill.type, skill.name) for skill in skills}
+    db_skills = {}
+    for type, name in keys:
+        skill_id = skill_cache.get((type, name))
+        if skill_id != None:
+            db_skills[(type, name)] = cached_instance(db, models.Skill(id=skill_id, type=type, name=name))
+    cache_requests.inc("skills", "hit", value=len(db_skills))
+    cache_requests.inc("skills", "miss", value=len(keys) - len(db_skills))
+
+    missing = keys - db_skills.keys()
+    if missing == set():
+        return db_skills
+
+    found = find_skills(db=db, skills=[schemas.Skill(type=type, name=name) for type, name in missing])
+    missing = missing - found.keys()
+    if missing != set():
+        insert_skills = dialect_insert(db, models.Skill).values([{"type": type, "name": name} for type, name in sorted(missing)])
+        insert_skills = insert_skills.on_conflict_do_nothing(index_elements=["type", "name"]).returning(models.Skill)
+        for skill in db.scalars(insert_skills).all():
+            found[(skill.type, skill.name)] = skill
+
+    if not missing <= found.keys():
+        found.update(find_skills(db=db, skills=[schemas.Skill(type=type, name=name) for type, name in missing - found.keys()]))
+    cache_dictionary(skills=found.values())
+    db_skills.update(found)
+    return db_skills
+
+def upsert_keywords(db: Session, keywords: List[schemas.Keyword]):
+    names = {keyword.name for keyword in keywords}
+    db_keywords = {}
+    for name in names:
+        keyword_id = keyword_cache.get(name)
+        if keyword_id != None:
+            db_keywords[name] = cached_instance(db, models.Keyword(id=keyword_id, name=name))
+    cache_requests.inc("keywords", "hit", value=len(db_keywords))
+    cache_requests.inc("keywords", "miss", value=len(names) - len(db_keywords))
+
+    missing = names - db_keywords.keys()
+    if missing == set():
+        return db_keywords
+
+    found = find_keywords(db=db, keywords=[schemas.Keyword(name=name) for name in missing])
+    missing = missing - found.keys()
+    if missing != set():
+        insert_keywords = dialect_insert(db, models.Keyword).values([{"name": name} for name in sorted(missing)])
+        insert_keywords = insert_keywords.on_conflict_do_nothing(index_elements=["name"]).returning(models.Keyword)
+        for keyword in db.scalars(insert_keywords).all():
+            found[keyword.name] = keyword
+
+    if not missing <= found.keys():
+        found.update(find_keywords(db=db, keywords=[schemas.Keyword(name=name) for name in missing - found.keys()]))
+    cache_dictionary(keywords=found.values())
+    db_keywords.update(found)
+    return db_keywords
+
+def attach_skills(resume: models.Resume, skills: List[schemas.Skill], db_skills: dict):
+    attached = set()
+
+    for skill in skills:
+        key = (skill.type, skill.name)
+        if key in attached:
+            continue
+
+        resume.skills.append(models.ResumeSkillAssociation(skills=db_skills[key]))
+        attached.add(key)
+
+def attach_keywords(resume: models.Resume, keywords: List[schemas.Keyword], db_keywords: dict):
+    attached = set()
+
+    for keyword in keywords:
+        if keyword.name in attached:
+            continue
+
+        resume.keywords.append(models.ResumeKeywordAssociation(keyword=db_keywords[keyword.name]))
+        attached.add(keyword.name)
+
+# reference counters: a write that adds or removes associations changes the refcount of their
+# skills and keywords in its own transaction, with one UPDATE per table; the changes are taken
+# from the history of the collections, so they are counted before the flush
+
+def update_refcounts(db: Session, model, deltas: dict):
+    deltas = {row_id: delta for row_id, delta in deltas.items() if delta != 0}
+    if deltas == {}:
+        return
+
+    # the rows are locked until the commit, always in id order so that two writes sharing
+    # skills in different orders wait for each other instead of deadlocking
+    table = model.__table__
+    db.execute(
+        table.update().where(table.c.id == bindparam("row_id")).values(refcount=table.c.refcount + bindparam("delta")),
+        [{"row_id": row_id, "delta": delta} for row_id, delta in sorted(deltas.items())],
+    )
+
+def count_references(db: Session, resumes: List[models.Resume]):
+    skill_deltas = {}
+    keyword_deltas = {}
+    for resume in resumes:
+        skills = inspect(resume).attrs.skills.history
+        for resume_skill in skills.added:
+            skill_deltas[resume_skill.skills.id] = skill_deltas.get(resume_skill.skills.id, 0) + 1
+        for resume_skill in skills.deleted:
+            skill_deltas[resume_skill.skill_id] = skill_deltas.get(resume_skill.skill_id, 0) - 1
+
+        keywords = inspect(resume).attrs.keywords.history
+        for resume_keyword in keywords.added:
+            keyword_deltas[resume_keyword.keyword.id] = keyword_deltas.get(resume_keyword.keyword.id, 0) + 1
+        for resume_keyword in keywords.deleted:
+            keyword_deltas[resume_keyword.keyword_id] = keyword_deltas.get(resume_keyword.keyword_id, 0) - 1
+
+    update_refcounts(db=db, model=models.Skill, deltas=skill_deltas)
+    update_refcounts(db=db, model=models.Keyword, deltas=keyword_deltas)
+
+def create_skills(db: Session, resume: models.Resume, skills: List[schemas.Skill]):
+    attach_skills(resume=resume, skills=skills, db_skills=upsert_skills(db=db, skills=skills))
+
+def create_keywords(db: Session, resume: models.Resume, keywords: List[schemas.Keyword]):
+    attach_keywords(resume=resume, keywords=keywords, db_keywords=upsert_keywords(db=db, keywords=keywords))
+
+# bulk import: a batch of resumes is written in one transaction; the users are checked with
+# one statement, the skills and keywords of the whole batch are upserted once, and the flush
+# sends the resumes and each child table as batched multi-row inserts, or with RESUME_BULK_COPY
+# on psycopg2 one COPY per table (copy_resumes).
+# Returns the id of every created resume, None where the user does not exist
+
+def find_user_ids(db: Session, user_ids: set):
+    return set(db.scalars(select(models.User.id).where(models.User.id.in_(user_ids))))
+
+# COPY into the tables themselves: the ids are taken from the sequences up front and the date
+# is the transaction's now(), the value the server default gives, so the objects of the batch
+# hold what the database holds for the refcounts, the snapshots and the search index without
+# being flushed
+
+def uses_copy(db: Session):
+    return RESUME_BULK_COPY and db.get_bind().dialect.driver == "psycopg2"
+
+def next_ids(db: Session, model, count: int):
+    if count == 0:
+        return []
+
+    sequence = func.pg_get_serial_sequence(model.__tablename__, "id")
+    return list(db.scalars(select(func.nextval(sequence)).select_from(func.generate_series(1, count))))
+
+# a field of the COPY text format
+def copy_value(value):
+    if value == None:
+        return "\\N"
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def copy_rows(db: Session, table: str, columns: List[str], rows: list):
+    if rows == []:
+        return
+
+    data = io.StringIO("".join("\t".join(copy_value(value) for value in row) + "\n" for row in rows))
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    dbapi = db.get_bind().dialect.loaded_dbapi
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(statement, data)
+    except dbapi.Error as exc:
+        # wrapped as SQLAlchemy wraps the errors of statements, retry_on_stale_dictionary
+        # catches the IntegrityError of a stale dictionary id
+        raise DBAPIError.instance(statement, None, exc, dbapi.Error) from exc
+    finally:
+        cursor.close()
+
+def copy_resumes(db: Session, resumes: List[models.Resume]):
+    date = db.scalar(select(func.now()))
+    educations = [education for resume in resumes for education in resume.educations]
+    conferences = [conference for resume in resumes for conference in resume.conferences]
+    for resume, resume_id in zip(resumes, next_ids(db=db, model=models.Resume, count=len(resumes))):
+        resume.id, resume.date, resume.version = resume_id, date, 1
+        for child in resume.educations + resume.conferences:
+            child.resume_id = resume_id
+    for education, education_id in zip(educations, next_ids(db=db, model=models.Education, count=len(educations))):
+        education.id = education_id
+    for conference, conference_id in zip(conferences, next_ids(db=db, model=models.Conference, count=len(conferences))):
+        conference.id = conference_id
+
+    skill_deltas = {}
+    keyword_deltas = {}
+    for resume in resumes:
+        for resume_skill in resume.skills:
+            skill_deltas[resume_skill.skills.id] = skill_deltas.get(resume_skill.skills.id, 0) + 1
+        for resume_keyword in resume.keywords:
+            keyword_deltas[resume_keyword.keyword.id] = keyword_deltas.get(resume_keyword.keyword.id, 0) + 1
+    update_refcounts(db=db, model=models.Skill, deltas=skill_deltas)
+    update_refcounts(db=db, model=models.Keyword, deltas=keyword_deltas)
+
+    copy_rows(db, "resumes", ["id", "date", "title", "description", "user_id", "version"],
+        [(resume.id, resume.date, resume.title, resume.description, resume.user_id, resume.version) for resume in resumes])
+    copy_rows(db, "educations", ["id", "institution", "degree", "resume_id"],
+        [(education.id, education.institution, education.degree, education.resume_id) for education in educations])
+    copy_rows(db, "conferences", ["id", "name", "year", "resume_id"],
+        [(conference.id, conference.name, conference.year, conference.resume_id) for conference in conferences])
+    copy_rows(db, "resume_skill_associations", ["resume_id", "skill_id"],
+        [(resume.id, resume_skill.skills.id) for resume in resumes for resume_skill in resume.skills])
+    copy_rows(db, "resume_keyword_associations", ["resume_id", "keyword_id"],
+        [(resume.id, resume_keyword.keyword.id) for resume in resumes for resume_keyword in resume.keywords])
+
+@retry_on_stale_dictionary
+def create_resumes(db: Session, resumes: List[schemas.ResumeCreate]):
+    user_ids = find_user_ids(db=db, user_ids={resume.user_id for resume in resumes})
+    resumes = [resume if resume.user_id in user_ids else None for resume in resumes]
+
+    db_skills = upsert_skills(db=db, skills=[skill for resume in resumes if resume != None for skill in resume.skills])
+    db_keywords = upsert_keywords(db=db, keywords=[keyword for resume in resumes if resume != None for keyword in resume.keywords])
+
+    db_resumes = []
+    for resume in resumes:
+        if resume == None:
+            db_resumes.append(None)
+            continue
+
+        db_resume = models.Resume(title=resume.title, description=resume.description, user_id=resume.user_id)
+        for education in resume.educations:
+            create_education(resume=db_resume, education=education)
+        for conference in resume.conferences:
+            create_conference(resume=db_resume, conference=conference)
+        attach_skills(resume=db_resume, skills=resume.skills, db_skills=db_skills)
+        attach_keywords(resume=db_resume, keywords=resume.keywords, db_keywords=db_keywords)
+        db_resumes.append(db_resume)
+
+    written = [db_resume for db_resume in db_resumes if db_resume != None]
+    if uses_copy(db):
+        copy_resumes(db=db, resumes=written)
+    else:
+        db.add_all(written)
+        count_references(db=db, resumes=written)
+        db.flush()
+    write_snapshots(db=db, resumes=written)
+    resume_ids = [db_resume.id if db_resume != None else None for db_resume in db_resumes]
+    documents = [resume_search_document(db_resume) for db_resume in db_resumes if db_resume != None]
     db.commit()
-    db.refresh(db_resume_skill)
-
-def create_keyword(db: Session, keyword: schemas.Keyword, resume_id: int):
-    db_keyword = find_keyword(db=db, keyword=keyword)
+    index_resumes(documents)
+    # the session is reused by the next batch, the written objects are not needed anymore
+    db.expunge_all()
 
-    if db_keyword == None:
-        db_keyword = models.Keyword(name=keyword.name)
-        db.add(db_keyword)
-        db.commit()
-        db.refresh(db_keyword)
-
-    db_resume_keyword = models.ResumeKeywordAssociation(resume_id=resume_id, keyword=db_keyword)
-    db.add(db_resume_keyword)
-    db.commit()
-    db.refresh(db_resume_keyword)
+    return resume_ids
 
 # update entity functions
 
-def update_resume_educations(db: Session, resume_id: int, resume: schemas.ResumeUpdate):
-    delete_resume_educations(db=db, resume_id=resume_id)
-    for education in resume.educations:
-        create_education(db=db, education=education, resume_id=resume_id)
-
-def update_resume_conferences(db: Session, resume_id: int, resume: schemas.ResumeUpdate):
-    delete_resume_conferences(db=db, resume_id=resume_id)
-    for conference in resume.conferences:
-        create_conference(db=db, conference=conference, resume_id=resume_id)
-
-def update_resume_skills(db: Session, resume_id: int, resume: schemas.ResumeUpdate):
-    delete_resume_skills(db=db, resume_id=resume_id)
-    for skill in resume.skills:
-        create_skill(db=db, skill=skill, resume_id=resume_id)
-
-def update_resume_keywords(db: Session, resume_id: int, resume: schemas.ResumeUpdate):
-    delete_resume_keywords(db=db, resume_id=resume_id)
-    for keyword in resume.keywords:
-        create_keyword(db=db, keyword=keyword, resume_id=resume_id)
+# the updates diff the stored children against the request: unchanged rows are kept as
+# they are, removed ones are deleted on flush by the delete-orphan cascade and only the new
+# ones are inserted, so an edit writes as many rows as it changes; the responses list the
+# children in id order, whatever the order of the request (resume_document)
+
+def merge_children(stored: list, incoming: list, stored_key, incoming_key, create):
+    unused = {}
+    for child in stored:
+        unused.setdefault(stored_key(child), []).append(child)
+
+    merged = []
+    for item in incoming:
+        same = unused.get(incoming_key(item))
+        merged.append(same.pop(0) if same else create(item))
+
+    return merged
+
+def update_resume_educations(resume: models.Resume, educations: List[schemas.Education]):
+    resume.educations = merge_children(
+        resume.educations, educations,
+        stored_key=lambda education: (education.institution, education.degree),
+        incoming_key=lambda education: (education.institution, education.degree),
+        create=lambda education: models.Education(institution=education.institution, degree=education.degree),
+    )
+
+def update_resume_conferences(resume: models.Resume, conferences: List[schemas.Conference]):
+    resume.conferences = merge_children(
+        resume.conferences, conferences,
+        stored_key=lambda conference: (conference.name, conference.year),
+        incoming_key=lambda conference: (conference.name, conference.year),
+        create=lambda conference: models.Conference(name=conference.name, year=conference.year),
+    )
+
+# skills and keywords are upserted only when they are new to the resume; the ids of the
+# detached ones are returned for delete_orphan_skills and delete_orphan_keywords
+
+def update_resume_skills(db: Session, resume: models.Resume, skills: List[schemas.Skill]):
+    skills = list({(skill.type, skill.name): skill for skill in skills}.values())
+    stored_keys = {(resume_skill.skills.type, resume_skill.skills.name) for resume_skill in resume.skills}
+    db_skills = upsert_skills(db=db, skills=[skill for skill in skills if (skill.type, skill.name) not in stored_keys])
+
+    merged = merge_children(
+        resume.skills, skills,
+        stored_key=lambda resume_skill: (resume_skill.skills.type, resume_skill.skills.name),
+        incoming_key=lambda skill: (skill.type, skill.name),
+        create=lambda skill: models.ResumeSkillAssociation(skills=db_skills[(skill.type, skill.name)]),
+    )
+    detached = {resume_skill.skill_id for resume_skill in resume.skills if resume_skill not in merged}
+    resume.skills = merged
+
+    return detached
+
+def update_resume_keywords(db: Session, resume: models.Resume, keywords: List[schemas.Keyword]):
+    keywords = list({keyword.name: keyword for keyword in keywords}.values())
+    stored_keys = {resume_keyword.keyword.name for resume_keyword in resume.keywords}
+    db_keywords = upsert_keywords(db=db, keywords=[keyword for keyword in keywords if keyword.name not in stored_keys])
+
+    merged = merge_children(
+        resume.keywords, keywords,
+        stored_key=lambda resume_keyword: resume_keyword.keyword.name,
+        incoming_key=lambda keyword: keyword.name,
+        create=lambda keyword: models.ResumeKeywordAssociation(keyword=db_keywords[keyword.name]),
+    )
+    detached = {resume_keyword.keyword_id for resume_keyword in resume.keywords if resume_keyword not in merged}
+    resume.keywords = merged
+
+    return detached
+
+# the version, and with it the ETag and the snapshot, changes only when the request changed
+# something; the orphans are looked for once the detached associations are deleted, by a job
+# keyed by the new version
+def flush_resume_update(db: Session, resume: models.Resume, skill_ids: set, keyword_ids: set):
+    modified = db.is_modified(resume)
+    if modified:
+        resume.version = resume.version + 1
+    count_references(db=db, resumes=[resume])
+    db.flush()
+    if modified:
+        write_snapshots(db=db, resumes=[resume])
+
+    clean_up_orphans(db=db, skill_ids=skill_ids, keyword_ids=keyword_ids, key=f"orphans:resume:{resume.id}:{resume.version}")
+
+# the update functions return the document and the new ETag of the resume
+
+@retry_on_stale_dictionary
+@retry_on_concurrent_write
+def update_resume(db: Session, resume_id: int, resume: schemas.ResumeUpdate, if_match: str | None = None):
+    db_resume = find_resume_full(db=db, resume_id=resume_id)
+    if db_resume == None:
+        return None
+    check_if_match(resume=db_resume, if_match=if_match)
 
-def update_resume(db: Session, resume_id: int, resume: schemas.ResumeUpdate):
-    db_resume = find_resume_id(db=db, resume_id=resume_id)
     updatable_keys = ["title", "description"]
     resume_data = resume.model_dump(exclude_unset=False)
     
     for key, value in resume_data.items():
             if key in updatable_keys:
                 setattr(db_resume, key, value)
+
+    update_resume_educations(resume=db_resume, educations=resume.educations)
+    update_resume_conferences(resume=db_resume, conferences=resume.conferences)
+    skill_ids = update_resume_skills(db=db, resume=db_resume, skills=resume.skills)
+    keyword_ids = update_resume_keywords(db=db, resume=db_resume, keywords=resume.keywords)
+
+    flush_resume_update(db=db, resume=db_resume, skill_ids=skill_ids, keyword_ids=keyword_ids)
+    document = resume_document(db_resume)
+    etag = resume_etag(resume_id, db_resume.version)
+    search_documents = [resume_search_document(db_resume)]
     db.commit()
-    db.refresh(db_resume)
-    
-    update_resume_educations(db=db, resume_id=resume_id, resume=resume)
-    update_resume_conferences(db=db, resume_id=resume_id, resume=resume)
-    update_resume_skills(db=db, resume_id=resume_id, resume=resume)
-    update_resume_keywords(db=db, resume_id=resume_id, resume=resume)
+    resume_cache.invalidate(resume_cache_key(resume_id))
+    index_resumes(search_documents)
+
+    return document, etag
 
-    return create_resume_response(db=db, resume_id=db_resume.id)
+@retry_on_stale_dictionary
+@retry_on_concurrent_write
+def partial_update_resume(db: Session, resume_id: int, resume: schemas.ResumeUpdate, if_match: str | None = None):
+    db_resume = find_resume_full(db=db, resume_id=resume_id)
+    if db_resume == None:
+        return None
+    check_if_match(resume=db_resume, if_match=if_match)
 
-def partial_update_resume(db: Session, resume_id: int, resume: schemas.ResumeUpdate):
-    db_resume = find_resume_id(db=db, resume_id=resume_id)
     updatable_keys = ["title", "description"]
     resume_data = resume.model_dump(exclude_unset=True)
 
     for key, value in resume_data.items():
             if key in updatable_keys:
                 setattr(db_resume, key, value)
-    db.commit()
-    db.refresh(db_resume)
 
+    skill_ids = set()
+    keyword_ids = set()
     if resume.educations != []:
-        update_resume_educations(db=db, resume_id=resume_id, resume=resume)
+        update_resume_educations(resume=db_resume, educations=resume.educations)
     if resume.conferences != []:
-        update_resume_conferences(db=db, resume_id=resume_id, resume=resume)
+        update_resume_conferences(resume=db_resume, conferences=resume.conferences)
     if resume.skills != []:
-        update_resume_skills(db=db, resume_id=resume_id, resume=resume)
+        skill_ids = update_resume_skills(db=db, resume=db_resume, skills=resume.skills)
     if resume.keywords != []:
-        update_resume_keywords(db=db, resume_id=resume_id, resume=resume)
-
-    return create_resume_response(db=db, resume_id=db_resume.id)
-
-# delete entity functions
-
-def delete_resume_educations(db: Session, resume_id: int):
-    for education in find_resume_educations(db=db, resume_id=resume_id):
-        db.delete(education)
-        db.commit()
-
-def delete_resume_conferences(db: Session, resume_id: int):
-    for conference in find_resume_conferences(db=db, resume_id=resume_id):
-        db.delete(conference)
-        db.commit()
-
-def delete_resume_skills(db: Session, resume_id: int):
-    resume_skills = find_resume_skill_associations(db=db, resume_id=resume_id)
-    for resume_skill in resume_skills:
-        db.delete(resume_skill)
-        db.commit()
-        if find_skill_associations_id(db=db, skill_id=resume_skill.skill_id) == []:
-            skill = find_skill_id(db=db, skill_id=resume_skill.skill_id) # skill
-            db.delete(skill)
-            db.commit()
-
-def delete_resume_keywords(db: Session, resume_id: int):
-    resume_keywords = find_resume_keyword_associations(db=db, resume_id=resume_id) # assocs
-    for resume_keyword in resume_keywords:
-        db.delete(resume_keyword)
-        db.commit()
-        if find_keyword_associations_id(db=db, keyword_id=resume_keyword.keyword_id) == []:
-            keyword = find_keyword_id(db=db, keyword_id=resume_keyword.keyword_id) # keyword
-            db.delete(keyword)
-            db.commit()
-
-def delete_resume(db: Session, resume_id: int):
-    resume_response = create_resume_response(db=db, resume_id=resume_id)
-
-    delete_resume_educations(db=db, resume_id=resume_id)
-    delete_resume_conferences(db=db, resume_id=resume_id)
-    delete_resume_skills(db=db, resume_id=resume_id)
-    delete_resume_keywords(db=db, resume_id=resume_id)
-
-    db_resume = find_resume_id(db=db, resume_id=resume_id)
-    db.delete(db_resume)
+        keyword_ids = update_resume_keywords(db=db, resume=db_resume, keywords=resume.keywords)
+
+    flush_resume_update(db=db, resume=db_resume, skill_ids=skill_ids, keyword_ids=keyword_ids)
+    document = resume_document(db_resume)
+    etag = resume_etag(resume_id, db_resume.version)
+    search_documents = [resume_search_document(db_resume)]
     db.commit()
+    resume_cache.invalidate(resume_cache_key(resume_id))
+    index_resumes(search_documents)
+
+    return document, etag
+
+# delete entity functions (the caller commits)
+
+# one DELETE per table and request, restricted to the skills and keywords the request detached
+# and no resume uses anymore by their refcount, so the cost does not depend on how many resumes
+# share a skill; the DELETE re-checks the refcount of a row a concurrent write has just
+# incremented once that write commits
+
+def delete_orphan_skills(db: Session, skill_ids: set):
+    if skill_ids == set():
+        return
+
+    deleted = db.execute(
+        delete(models.Skill).where(models.Skill.id.in_(skill_ids), models.Skill.refcount <= 0).returning(models.Skill.type, models.Skill.name),
+        execution_options={"synchronize_session": "fetch"},
+    )
+    for type, name in deleted:
+        skill_cache.delete((type, name))
+
+def delete_orphan_keywords(db: Session, keyword_ids: set):
+    if keyword_ids == set():
+        return
+
+    deleted = db.execute(
+        delete(models.Keyword).where(models.Keyword.id.in_(keyword_ids), models.Keyword.refcount <= 0).returning(models.Keyword.name),
+        execution_options={"synchronize_session": "fetch"},
+    )
+    for name, in deleted:
+        keyword_cache.delete(name)
+
+@jobs.handler("delete_orphans")
+def delete_orphans(db: Session, skill_ids: list, keyword_ids: list):
+    delete_orphan_skills(db=db, skill_ids=set(skill_ids))
+    delete_orphan_keywords(db=db, keyword_ids=set(keyword_ids))
+
+# with JOB_QUEUE the cleanup is a job committed with the write, which then covers only the rows
+# of the resume; until the job runs an orphan stays in the dictionary and a write that uses it
+# again increments its refcount, so the job keeps it
+def clean_up_orphans(db: Session, skill_ids: set, keyword_ids: set, key: str):
+    if skill_ids == set() and keyword_ids == set():
+        return
+    if JOB_QUEUE:
+        jobs.enqueue(db=db, kind="delete_orphans", payload={"skill_ids": sorted(skill_ids), "keyword_ids": sorted(keyword_ids)}, key=key)
+    else:
+        delete_orphans(db=db, skill_ids=skill_ids, keyword_ids=keyword_ids)
+
+def delete_resume_rows(db: Session, resumes: List[models.Resume]):
+    skill_deltas = {}
+    keyword_deltas = {}
+    for resume in resumes:
+        for resume_skill in resume.skills:
+            skill_deltas[resume_skill.skill_id] = skill_deltas.get(resume_skill.skill_id, 0) - 1
+        for resume_keyword in resume.keywords:
+            keyword_deltas[resume_keyword.keyword_id] = keyword_deltas.get(resume_keyword.keyword_id, 0) - 1
+        # children and associations go with the resume through the cascade
+        db.delete(resume)
+    update_refcounts(db=db, model=models.Skill, deltas=skill_deltas)
+    update_refcounts(db=db, model=models.Keyword, deltas=keyword_deltas)
+    # the foreign key cascade deletes the snapshots on PostgreSQL only
+    if RESUME_SNAPSHOTS:
+        db.execute(delete(models.ResumeSnapshot).where(models.ResumeSnapshot.resume_id.in_([resume.id for resume in resumes])))
+    db.flush()
+
+    # a resume is deleted once, so the first id keys the cleanup
+    if resumes != []:
+        clean_up_orphans(db=db, skill_ids=set(skill_deltas), keyword_ids=set(keyword_deltas), key=f"orphans:deleted:{resumes[0].id}")
+
+@retry_on_concurrent_write
+def delete_resume(db: Session, resume_id: int, if_match: str | None = None):
+    db_resume = find_resume_full(db=db, resume_id=resume_id)
+    if db_resume == None:
+        return None
+    check_if_match(resume=db_resume, if_match=if_match)
 
-    return resume_response
+    document = resume_document(db_resume)
+    delete_resume_rows(db=db, resumes=[db_resume])
+    db.commit()
+    resume_cache.invalidate(resume_cache_key(resume_id))
+    unindex_resumes([resume_id])
+
+    return document
 
 # function to delete user for testing only
 
 def delete_user(db: Session, user_id: int):
     db_user = find_user_id(db=db, user_id=user_id)
 
-    for resume in db_user.resumes:
-        delete_resume(db=db, resume_id=resume.id)
-    
+    resumes = db.query(models.Resume).options(*resume_children_options).filter(models.Resume.user_id == user_id).all()
+    resume_ids = [resume.id for resume in resumes]
+    delete_resume_rows(db=db, resumes=resumes)
+
+    email = db_user.email
     db.delete(db_user)
-    db.commit()
\ No newline at end of file
+    db.commit()
+
+    for resume_id in resume_ids:
+        resume_cache.invalidate(resume_cache_key(resume_id))
+    unindex_resumes(resume_ids)
+
+    # other processes keep trusting the user's tokens until they expire (ACCESS_TOKEN_EXPIRE_MINUTES)
+    token_cache.delete_matching(lambda claims: claims["email"] == email)
@@ -0,0 +1,65 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import pydantic_core
+from sqlalchemy.orm import Session
+from . import crud
+from .database import SessionLocal
+from .settings import RESUME_EXPORT_CHUNK_SIZE
+
+# dump of every resume with its children, served by GET /api/resumes:export and runnable as
+#   python -m source.export --format csv --output resumes.csv
+# the output is produced chunk by chunk, nothing holds more than one chunk of resumes
+
+formats = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# the children are kept as JSON in their CSV columns, so the dump can be loaded back
+csv_columns = ["id", "user_id", "date", "title", "description", "educations", "conferences", "skills", "keywords"]
+
+def render_ndjson(chunks):
+    for chunk in chunks:
+        yield b"".join(crud.render_document(resume) + b"\n" for resume in chunk)
+
+def render_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(csv_columns)
+    yield buffer.getvalue().encode()
+
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        for resume in chunk:
+            row = pydantic_core.to_jsonable_python(resume)
+            writer.writerow([row[column] if isinstance(row[column], (str, int)) else json.dumps(row[column], ensure_ascii=False) for column in csv_columns])
+        yield buffer.getvalue().encode()
+
+def export_resumes(db: Session, format: str, chunk_size: int = RESUME_EXPORT_CHUNK_SIZE):
+    chunks = crud.iter_resume_chunks(db=db, chunk_size=chunk_size)
+    if format == "csv":
+        return render_csv(chunks)
+    return render_ndjson(chunks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export every resume with its children")
+    parser.add_argument("--format", choices=list(formats), default="ndjson")
+    parser.add_argument("--output", help="file to write, standard output by default")
+    parser.add_argument("--chunk-size", type=int, default=RESUME_EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    with SessionLocal() as db:
+        try:
+            for data in export_resumes(db=db, format=args.format, chunk_size=args.chunk_size):
+                output.write(data)
+        finally:
+            if args.output:
+                output.close()
+
+if __name__ == "__main__":
+    main()
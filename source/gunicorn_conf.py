@@ -0,0 +1,32 @@
+import os
+
+# production server: a gunicorn master forks WEB_CONCURRENCY uvicorn workers that share the port,
+# so bcrypt and the JSON rendering of every request use all the cores of the container
+#   gunicorn -c source/gunicorn_conf.py source.main:app
+#
+# read from the environment only: the workers import the application (and source.settings)
+# after the fork, with the environment set here
+
+bind = os.getenv("BIND", "0.0.0.0:8080")
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# one worker per core unless set; the workers size their connection pools from it
+# (DATABASE_MAX_CONNECTIONS in source/settings.py), each starts its own PASSWORD_HASHING_WORKERS
+# hashing processes
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# a worker is replaced after this many requests (plus a random jitter, so they do not restart
+# together) to cap the memory a long running process accumulates, 0 disables it
+max_requests = int(os.getenv("WORKER_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "1000"))
+
+# on SIGTERM the workers stop accepting connections and get this many seconds to finish the
+# requests in flight and run the shutdown of the application before they are killed
+graceful_timeout = int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+# a worker that does not report to the master for this many seconds is restarted
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("WORKER_KEEPALIVE", "5"))
+
+# access logs are left to the proxy in front of the server
+accesslog = os.getenv("ACCESS_LOG") or None
@@ -0,0 +1,129 @@
+import logging
+import threading
+from contextvars import ContextVar
+from time import perf_counter
+from sqlalchemy import event
+from . import metrics
+from .settings import DATABASE_SLOW_QUERY_SECONDS, SERVER_TIMING
+
+# SQL of each request: the middleware puts a QueryStats in request_queries, the hooks of the
+# engines add every statement to it; the endpoints run crud in the threadpool or in a greenlet
+# of run_sync, both of which see the context of the request
+
+logger = logging.getLogger(__name__)
+
+class QueryStats:
+    def __init__(self, scope: dict | None = None):
+        self.lock = threading.Lock()
+        self.scope = scope or {}
+        self.statements = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.pool_wait_seconds = 0.0
+
+    # the router sets the matched route in the scope before the endpoint runs
+    @property
+    def route(self):
+        route = self.scope.get("route")
+        return route.path if route != None else "unmatched"
+
+    def add_statement(self, seconds: float, rows: int):
+        with self.lock:
+            self.statements += 1
+            self.seconds += seconds
+            self.rows += rows
+
+    def add_pool_wait(self, seconds: float):
+        with self.lock:
+            self.pool_wait_seconds += seconds
+
+request_queries: ContextVar[QueryStats | None] = ContextVar("request_queries", default=None)
+
+request_seconds = metrics.Histogram("http_request_seconds", "Time until the response starts", ("method", "route"))
+request_statements = metrics.Histogram("db_request_statements", "SQL statements per request", ("method", "route"), buckets=(1, 2, 5, 10, 20, 50, 100, 500))
+request_db_seconds = metrics.Histogram("db_request_seconds", "Time spent executing SQL per request", ("method", "route"))
+request_rows = metrics.Histogram("db_request_rows", "Rows returned or changed per request", ("method", "route"), buckets=(1, 10, 100, 1000, 10000))
+request_pool_wait_seconds = metrics.Histogram("db_request_pool_wait_seconds", "Time spent waiting for pooled connections per request", ("method", "route"))
+slow_queries = metrics.Counter("db_slow_queries_total", "Statements slower than DATABASE_SLOW_QUERY_SECONDS", ("route",))
+
+def record_pool_wait(seconds: float):
+    stats = request_queries.get()
+    if stats != None:
+        stats.add_pool_wait(seconds)
+
+# parameters are logged by their type only, they hold emails, password hashes and resume texts
+def redact_parameters(parameters, executemany: bool = False):
+    if executemany:
+        return f"<{len(parameters)} parameter sets>"
+    if isinstance(parameters, dict):
+        return {name: f"<{type(value).__name__}>" for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [f"<{type(value).__name__}>" for value in parameters]
+    return f"<{type(parameters).__name__}>"
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = perf_counter() - conn.info["query_start"].pop()
+    stats = request_queries.get()
+    # rowcount is what the driver reports: psycopg2 and asyncpg give the rows of a SELECT as well,
+    # sqlite3 only the rows changed by a write
+    if stats != None:
+        stats.add_statement(seconds, max(cursor.rowcount, 0))
+
+    if DATABASE_SLOW_QUERY_SECONDS > 0 and seconds >= DATABASE_SLOW_QUERY_SECONDS:
+        route = stats.route if stats != None else "none"
+        slow_queries.inc(route)
+        logger.warning("slow query (%.3fs, route %s): %s parameters %s", seconds, route, statement, redact_parameters(parameters, executemany))
+
+def handle_error(exception_context):
+    # a failed statement never reaches after_cursor_execute
+    start = exception_context.connection.info.get("query_start") if exception_context.connection != None else None
+    if start:
+        start.pop()
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+def server_timing(stats: QueryStats):
+    return (
+        f'db;dur={stats.seconds * 1000:.2f};desc="{stats.statements} statements, {stats.rows} rows", '
+        f"db-pool;dur={stats.pool_wait_seconds * 1000:.2f}"
+    )
+
+# ASGI middleware: counts the SQL of each HTTP request under its route template (the path with
+# {resume_id}, so the labels stay few), adds a Server-Timing header with the SQL time and
+# observes the histograms once the response starts; statements of a streamed body run after
+# that and are not included
+
+class SQLInstrumentationMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats(scope)
+        token = request_queries.set(stats)
+        start = perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                method, route = scope["method"], stats.route
+                request_seconds.observe(method, route, value=perf_counter() - start)
+                request_statements.observe(method, route, value=stats.statements)
+                request_db_seconds.observe(method, route, value=stats.seconds)
+                request_rows.observe(method, route, value=stats.rows)
+                request_pool_wait_seconds.observe(method, route, value=stats.pool_wait_seconds)
+                if SERVER_TIMING:
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", server_timing(stats).encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_queries.reset(token)
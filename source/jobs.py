@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from . import metrics, models
+from .settings import JOB_BATCH_SIZE, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_POLL_SECONDS, JOB_WORKERS
+
+# durable background queue in the jobs table: a write enqueues its deferred work in its own
+# transaction, so the job exists exactly when the write is committed, and workers running in
+# every server process claim the due jobs and run them
+#
+# claiming is SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL, so concurrent workers take
+# different jobs without waiting for each other; SQLite has no row locks and ignores it, there
+# the UPDATE that marks the jobs running re-checks that they are still due and only the worker
+# whose UPDATE changed a row runs it. A job runs its handler and is deleted in one transaction:
+# the work of a job that failed or whose worker died is rolled back and the job is claimed
+# again, so the handlers only need to be safe to run again after a rollback
+
+logger = logging.getLogger(__name__)
+
+jobs_processed = metrics.Counter("jobs_processed_total", "Background jobs run, by result (done, retried or failed)", ("kind", "result"))
+
+# kind -> function(db, **payload), registered with @handler by the modules owning the work
+handlers = {}
+
+def handler(kind: str):
+    def register(function):
+        handlers[kind] = function
+        return function
+
+    return register
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+# added to the transaction of the caller, which commits; a job whose key is already in the
+# table is not enqueued again
+def enqueue(db: Session, kind: str, payload: dict, key: str | None = None):
+    insert = sqlite.insert(models.Job) if db.get_bind().dialect.name == "sqlite" else postgresql.insert(models.Job)
+    db.execute(
+        insert.values(kind=kind, payload=payload, idempotency_key=key, status="pending", attempts=0, run_after=utcnow())
+        .on_conflict_do_nothing(index_elements=["idempotency_key"])
+    )
+    db.info["jobs_enqueued"] = True
+
+# the workers of the process are woken once the jobs are committed
+@event.listens_for(Session, "after_commit")
+def notify_after_commit(session: Session):
+    if session.info.pop("jobs_enqueued", False):
+        notify()
+
+@event.listens_for(Session, "after_rollback")
+def forget_after_rollback(session: Session):
+    session.info.pop("jobs_enqueued", None)
+
+def due_filter(now: datetime):
+    return models.Job.status.in_(["pending", "running"]), models.Job.run_after <= now
+
+# marks up to limit due jobs running for JOB_LEASE_SECONDS and returns them
+def claim_jobs(db: Session, limit: int, now: datetime):
+    job_ids = list(db.scalars(
+        select(models.Job.id).where(*due_filter(now)).order_by(models.Job.run_after, models.Job.id).limit(limit)
+        .with_for_update(skip_locked=True)
+    ))
+    if job_ids == []:
+        db.rollback()
+        return []
+
+    claimed = db.execute(
+        update(models.Job).where(models.Job.id.in_(job_ids), *due_filter(now))
+        .values(status="running", attempts=models.Job.attempts + 1, run_after=now + timedelta(seconds=JOB_LEASE_SECONDS))
+        .returning(models.Job.id, models.Job.kind, models.Job.payload, models.Job.attempts),
+        execution_options={"synchronize_session": False},
+    ).all()
+    db.commit()
+    return claimed
+
+def run_job(db: Session, job, now: datetime):
+    try:
+        handlers[job.kind](db=db, **job.payload)
+        db.execute(delete(models.Job).where(models.Job.id == job.id))
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        logger.exception("job %s (%s) failed on attempt %s", job.id, job.kind, job.attempts)
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            values = {"status": "failed"}
+            jobs_processed.inc(job.kind, "failed")
+        else:
+            values = {"status": "pending", "run_after": now + timedelta(seconds=2 ** job.attempts)}
+            jobs_processed.inc(job.kind, "retried")
+        db.execute(update(models.Job).where(models.Job.id == job.id).values(last_error=repr(exc), **values))
+        db.commit()
+        return
+
+    jobs_processed.inc(job.kind, "done")
+
+# claims and runs a batch of due jobs, returns how many there were
+def run_due_jobs(db: Session, limit: int = JOB_BATCH_SIZE, now: datetime | None = None):
+    now = now or utcnow()
+    claimed = claim_jobs(db=db, limit=limit, now=now)
+    for job in claimed:
+        run_job(db=db, job=job, now=now)
+    return len(claimed)
+
+# JOB_WORKERS tasks on the event loop of the server, the jobs run in the threadpool with sessions
+# of their own; an idle worker sleeps JOB_POLL_SECONDS or until the process enqueues a job
+class JobWorkers:
+    def __init__(self, session_factory, workers: int = JOB_WORKERS, poll_seconds: float = JOB_POLL_SECONDS):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.loop = None
+        self.wakeup = None
+        self.tasks = []
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+
+    def run_batch(self):
+        with self.session_factory() as db:
+            return run_due_jobs(db=db)
+
+    async def run(self):
+        while True:
+            try:
+                ran = await run_in_threadpool(self.run_batch)
+            except Exception:
+                logger.exception("claiming jobs failed, retrying in %s seconds", self.poll_seconds)
+                ran = 0
+            if ran == 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    # may be called from any thread
+    def notify(self):
+        if self.loop != None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    # a job running in the threadpool finishes; the ones left in the table are run by the next process
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.loop = None
+
+workers = None
+
+def start(session_factory):
+    global workers
+    workers = JobWorkers(session_factory)
+    workers.start()
+
+async def stop():
+    global workers
+    if workers != None:
+        await workers.stop()
+        workers = None
+
+def notify():
+    if workers != None:
+        workers.notify()
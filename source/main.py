@@ -1,16 +1,76 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
-from typing import Annotated
-from . import crud, models, schemas
-from .database import SessionLocal, engine
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, List, Literal
+from . import crud, export, instrumentation, jobs, metrics, passwords, schemas
+from .database import SessionLocal, AsyncSessionLocal, async_engine, engine, run_crud, warm_async_pool, warm_pool
+from .settings import ANALYTICS_LIMIT, ANALYTICS_LIMIT_MAX, ANALYTICS_TREND_DAYS, ANALYTICS_TREND_MAX_DAYS, DATABASE_ASYNC, JOB_QUEUE, RESUME_BULK_BATCH_SIZE, RESUME_BULK_MAX_LINE_BYTES, RESUME_PAGE_SIZE, RESUME_PAGE_SIZE_MAX
 from fastapi.openapi.utils import get_openapi
 
-# models.Base.metadata.drop_all(bind=engine)
-models.Base.metadata.create_all(bind=engine)
- 
-app = FastAPI()
+# the schema is managed by alembic ("alembic upgrade head" before the server starts), so the
+# import neither connects nor reflects and concurrent workers do not race with a migration
+
+logger = logging.getLogger(__name__)
+
+# the warm-up runs in the background once the server is up: /health/live answers from the start,
+# /health/ready only once the pool connections are open, the OpenAPI schema is rendered and the
+# caches are loaded, so a load balancer sends traffic to warm workers only; it is retried while
+# the database is unreachable
+
+warm_up_retry_seconds = 1.0
+
+async def warm_up(app: FastAPI):
+    def warm_caches():
+        with SessionLocal() as db:
+            # the skills and keywords known at startup are resolved without lookups from the first request
+            crud.warm_dictionary_cache(db=db)
+            crud.warm_search_index(db=db)
+
+    tasks = [run_in_threadpool(warm_pool, engine), run_in_threadpool(app.openapi), run_in_threadpool(warm_caches)]
+    if async_engine != None:
+        tasks.append(warm_async_pool(async_engine))
+    await asyncio.gather(*tasks)
+
+async def warm_up_until_ready(app: FastAPI):
+    while True:
+        try:
+            await warm_up(app)
+            break
+        except Exception:
+            logger.exception("warm-up failed, retrying in %s seconds", warm_up_retry_seconds)
+            await asyncio.sleep(warm_up_retry_seconds)
+    app.state.ready = True
+
+# the pooled connections are closed on shutdown, so a draining worker leaves no broken sessions on the server;
+# every process runs background job workers (source/jobs.py), which share the jobs table
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    warming = asyncio.create_task(warm_up_until_ready(app))
+    if JOB_QUEUE:
+        jobs.start(SessionLocal)
+    yield
+    app.state.ready = False
+    warming.cancel()
+    await jobs.stop()
+    passwords.shutdown()
+    engine.dispose()
+    if async_engine != None:
+        await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
+
+# statements, SQL time and pool wait of every request, per route, in Server-Timing and at /metrics
+app.add_middleware(instrumentation.SQLInstrumentationMiddleware)
 
 # schema will be generated only once, and then the same cached schema will be used for the next requests
 def custom_openapi():
@@ -29,89 +89,343 @@ def custom_openapi():
 
 app.openapi = custom_openapi
 
+# sign up and sign in are rejected while the password hashing pool is saturated,
+# so a burst of them cannot starve the other endpoints
+
+# a write with an If-Match that no longer matches; a write without one that kept losing races
+# with other writes (RESUME_WRITE_ATTEMPTS) can be sent again
+
+@app.exception_handler(crud.PreconditionFailed)
+async def precondition_failed_handler(request: Request, exc: crud.PreconditionFailed):
+    return JSONResponse(status_code=412, content={"detail": "Resume has been modified"})
+
+@app.exception_handler(crud.ResumeWriteConflict)
+async def resume_write_conflict_handler(request: Request, exc: crud.ResumeWriteConflict):
+    return JSONResponse(status_code=409, content={"detail": "Resume is being modified, try again"}, headers={"Retry-After": "1"})
+
+@app.exception_handler(passwords.PasswordHashingBusy)
+async def password_hashing_busy_handler(request: Request, exc: passwords.PasswordHashingBusy):
+    return JSONResponse(status_code=503, content={"detail": "Too many sign in requests, try again later"}, headers={"Retry-After": "1"})
+
 security = HTTPBearer()
 
 # response is a json as defualt
 
-# the dependency will create a new SQLAlchemy SessionLocal that will be used in a single request, 
+# the dependency will create a new SQLAlchemy SessionLocal that will be used in a single request,
 # and then close it once the request is finished;
 # the code following the yield statement is executed after the response has been delivered
 
-def get_db():
+def get_sync_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# DATABASE_ASYNC selects the session type, the endpoints pass it to crud through run_crud
+get_db = get_async_db if DATABASE_ASYNC else get_sync_db
+
+# resume responses come from crud as documents shaped like their schema and are rendered once
+# by pydantic_core; returned as a Response, they skip the validation and encoding FastAPI does
+# for the response_model, which stays declared for the documentation
+def document_response(document: dict, headers: dict | None = None):
+    return Response(content=crud.render_document(document), media_type="application/json", headers=headers)
+
 @app.get("/")
-def home():
+async def home():
     return JSONResponse("it's a homepage")
 
+# liveness: the process serves requests; readiness: the warm-up is done and it is not shutting down
+
+@app.get("/health/live", include_in_schema=False)
+async def get_liveness():
+    return JSONResponse({"status": "live"})
+
+@app.get("/health/ready", include_in_schema=False)
+async def get_readiness():
+    if not app.state.ready:
+        return JSONResponse({"status": "warming up"}, status_code=503)
+    return JSONResponse({"status": "ready"})
+
+# pool, cache and request metrics of this process in the Prometheus text format
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/api/signup", response_model=schemas.UserResponse)
-def sign_up(user: schemas.UserCreate, db: Session = Depends(get_db)): # db is a default argument
-    if crud.find_user_email(db=db, user_email=user.email) != None:
+async def sign_up(user: schemas.UserCreate, db: Session = Depends(get_db)): # db is a default argument
+    if await run_crud(db, crud.find_user_email, user_email=user.email) != None:
         raise HTTPException(status_code=400, detail="The email is already used")
-    
-    return crud.create_user(db=db, user=user)
+
+    hashed_password = await passwords.hash_password_async(user.password)
+    return await run_crud(db, crud.create_user, user=user, hashed_password=hashed_password)
 
 @app.post("/api/signin", response_model=schemas.TokenResponse)
-def sign_in(user: schemas.UserAuth, db: Session = Depends(get_db)):
-    response = crud.authenticate_user(db=db, user=user)
-    if response == None:
+async def sign_in(user: schemas.UserAuth, db: Session = Depends(get_db)):
+    db_user = await run_crud(db, crud.find_user_email, user_email=user.email)
+    if db_user == None:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
-    
-    return crud.create_access_token(token_data=response)
+
+    is_valid, new_hash = await passwords.verify_password_async(user.password, db_user.password)
+    if not is_valid:
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+    # transparently upgrade hashes created with a lower BCRYPT_ROUNDS
+    if new_hash != None:
+        await run_crud(db, crud.update_user_password, user_id=db_user.id, hashed_password=new_hash)
+
+    return crud.create_access_token(token_data=schemas.TokenCreate(email=db_user.email))
 
 @app.post("/api/resumes", response_model=schemas.ResumeResponse)
-def post_resume(resume: schemas.ResumeCreate, db: Session = Depends(get_db)):
-    if crud.find_user_id(db=db, user_id=resume.user_id) == None:
+async def post_resume(resume: schemas.ResumeCreate, db: Session = Depends(get_db)):
+    if await run_crud(db, crud.find_user_id, user_id=resume.user_id) == None:
         raise HTTPException(status_code=404, detail="User is not found")
 
-    return crud.create_resume(db=db, resume=resume)
+    return document_response(await run_crud(db, crud.create_resume, resume=resume))
+
+# the body is split into lines as it arrives, so it is never held in memory as a whole; only the
+# current line is buffered, and a line longer than RESUME_BULK_MAX_LINE_BYTES is skipped up to
+# its end and yielded as None
+async def read_lines(request: Request):
+    line = bytearray()
+    too_long = False
+    async for chunk in request.stream():
+        view = memoryview(chunk)
+        start = 0
+        while start < len(chunk):
+            end = chunk.find(b"\n", start)
+            stop = len(chunk) if end == -1 else end
+            if not too_long:
+                line += view[start:stop]
+                if len(line) > RESUME_BULK_MAX_LINE_BYTES:
+                    too_long = True
+                    line.clear()
+            if end == -1:
+                break
+            yield None if too_long else bytes(line)
+            line.clear()
+            too_long = False
+            start = end + 1
+    if too_long or line != b"":
+        yield None if too_long else bytes(line)
+
+# bulk import: the body is NDJSON, one ResumeCreate per line; every RESUME_BULK_BATCH_SIZE valid
+# records are written in one transaction and the response is NDJSON as well, one result per
+# record in the order of the body ({"line", "status", "id"} or {"line", "status", "detail"}, a
+# 413 for a line longer than RESUME_BULK_MAX_LINE_BYTES).
+# The body is read by the response itself: the results of a batch are sent as soon as it is
+# committed, so a client (or a proxy) waiting for the first bytes does not time out on a large
+# upload. A batch that fails is rolled back and each of its records gets a 500 result, the
+# batches committed before it stay committed
+
+# streams its body without listening for http.disconnect, which would consume the request
+# messages the body iterator reads; a disconnect ends the body iterator with ClientDisconnect
+class DuplexStreamingResponse(StreamingResponse):
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+def ndjson(results: list):
+    results.sort(key=lambda result: result["line"])
+    content = "".join(json.dumps(result) + "\n" for result in results)
+    results.clear()
+    return content
 
-@app.get("/api/resumes/{resume_id}", response_model=schemas.ResumeResponse) 
-def get_resume(resume_id: int, db: Session = Depends(get_db)): 
-    if crud.find_resume_id(db=db, resume_id=resume_id) == None:
+@app.post("/api/resumes:bulk")
+async def post_resumes_bulk(request: Request, db: Session = Depends(get_db)):
+    async def write_batch(batch: list, results: list):
+        try:
+            resume_ids = await run_crud(db, crud.create_resumes, resumes=[resume for _, resume in batch])
+        except Exception:
+            logger.exception("bulk import of lines %s to %s failed", batch[0][0], batch[-1][0])
+            await run_crud(db, lambda db: db.rollback())
+            results.extend({"line": line_number, "status": 500, "detail": "The batch of the record could not be written"} for line_number, _ in batch)
+            return
+
+        for (line_number, _), resume_id in zip(batch, resume_ids):
+            if resume_id == None:
+                results.append({"line": line_number, "status": 404, "detail": "User is not found"})
+            else:
+                results.append({"line": line_number, "status": 201, "id": resume_id})
+
+    async def import_lines():
+        # the invalid lines before a written batch are sent with it, so the results stay in line order
+        results = []
+        batch = []
+        line_number = 0
+        async for line in read_lines(request):
+            line_number += 1
+            if line == None:
+                results.append({"line": line_number, "status": 413, "detail": f"The line is longer than {RESUME_BULK_MAX_LINE_BYTES} bytes"})
+                continue
+            if line.strip() == b"":
+                continue
+            try:
+                batch.append((line_number, schemas.ResumeCreate.model_validate_json(line)))
+            except ValidationError as exc:
+                results.append({"line": line_number, "status": 422, "detail": exc.errors(include_url=False, include_context=False, include_input=False)})
+            if len(batch) == RESUME_BULK_BATCH_SIZE:
+                await write_batch(batch, results)
+                batch = []
+                yield ndjson(results)
+        if batch != []:
+            await write_batch(batch, results)
+        if results != []:
+            yield ndjson(results)
+
+    return DuplexStreamingResponse(import_lines(), media_type="application/x-ndjson")
+
+# many resumes by id in one request, with a fixed number of statements for the resumes that
+# are not cached; the items follow the order of the ids, unknown ids get a 404 item
+
+@app.post("/api/resumes:batchGet", response_model=schemas.ResumeBatchResponse)
+async def batch_get_resumes(batch: schemas.ResumeBatchGet, db: Session = Depends(get_db)):
+    content = await run_crud(db, crud.get_resumes_json, resume_ids=batch.ids)
+    return Response(content=content, media_type="application/json")
+
+@app.get("/api/resumes", response_model=schemas.ResumePage)
+async def get_resumes(
+    limit: Annotated[int, Query(ge=1, le=RESUME_PAGE_SIZE_MAX)] = RESUME_PAGE_SIZE,
+    cursor: str | None = None,
+    user_id: int | None = None,
+    skill: str | None = None,
+    keyword: str | None = None,
+    db: Session = Depends(get_db),
+):
+    try:
+        resume_page = await run_crud(db, crud.get_resumes_page, limit=limit, cursor=cursor, user_id=user_id, skill=skill, keyword=keyword)
+    except crud.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return document_response(resume_page)
+
+# full-text search over the title and description (all words must match), with the filters and
+# the order of GET /api/resumes and the most used skills and keywords among the newest
+# RESUME_SEARCH_FACET_RESUMES matches;
+# declared before /api/resumes/{resume_id}, which would take "search" for an id
+
+@app.get("/api/resumes/search", response_model=schemas.ResumeSearchPage)
+async def search_resumes(
+    q: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=RESUME_PAGE_SIZE_MAX)] = RESUME_PAGE_SIZE,
+    cursor: str | None = None,
+    user_id: int | None = None,
+    skill: str | None = None,
+    keyword: str | None = None,
+    db: Session = Depends(get_db),
+):
+    try:
+        search_page = await run_crud(db, crud.search_resumes, text=q, limit=limit, cursor=cursor, user_id=user_id, skill=skill, keyword=keyword)
+    except crud.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return document_response(search_page)
+
+# dump of every resume; the export reads through a server side cursor of a sync session,
+# which the streaming response iterates in the threadpool whatever DATABASE_ASYNC is
+
+@app.get("/api/resumes:export")
+async def export_resumes(format: Literal["ndjson", "csv"] = "ndjson", db: Session = Depends(get_sync_db)):
+    return StreamingResponse(export.export_resumes(db=db, format=format), media_type=export.formats[format])
+
+@app.get("/api/resumes/{resume_id}", response_model=schemas.ResumeResponse)
+async def get_resume(resume_id: int, if_none_match: Annotated[str | None, Header()] = None, db: Session = Depends(get_db)):
+    result = await run_crud(db, crud.get_resume_json, resume_id=resume_id, if_none_match=if_none_match)
+    if result == None:
         raise HTTPException(status_code=404, detail="Resume is not found")
-    
-    return crud.get_resume(db=db, resume_id=resume_id)
+
+    # the body comes rendered from the resume cache, so it is returned as is
+    content, etag = result
+    if content == None:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=content, media_type="application/json", headers={"ETag": etag})
 
 @app.put("/api/resumes/{resume_id}", response_model=schemas.ResumeResponse)
-def put_resume(resume_id: int, resume: schemas.ResumeUpdate, db: Session = Depends(get_db)):
-    if crud.find_resume_id(db=db, resume_id=resume_id) == None:
+async def put_resume(resume_id: int, resume: schemas.ResumeUpdate, if_match: Annotated[str | None, Header()] = None, db: Session = Depends(get_db)):
+    result = await run_crud(db, crud.update_resume, resume_id=resume_id, resume=resume, if_match=if_match)
+    if result == None:
         raise HTTPException(status_code=404, detail="Resume is not found")
-    
-    return crud.update_resume(db=db, resume_id=resume_id, resume=resume)
+
+    resume_response, etag = result
+    return document_response(resume_response, headers={"ETag": etag})
 
 @app.patch("/api/resumes/{resume_id}", response_model=schemas.ResumeResponse)
-def patch_resume(resume_id: int, resume: schemas.ResumeUpdate, db: Session = Depends(get_db)):
-    if crud.find_resume_id(db=db, resume_id=resume_id) == None:
+async def patch_resume(resume_id: int, resume: schemas.ResumeUpdate, if_match: Annotated[str | None, Header()] = None, db: Session = Depends(get_db)):
+    result = await run_crud(db, crud.partial_update_resume, resume_id=resume_id, resume=resume, if_match=if_match)
+    if result == None:
         raise HTTPException(status_code=404, detail="Resume is not found")
-    
-    return crud.partial_update_resume(db=db, resume_id=resume_id, resume=resume)
+
+    resume_response, etag = result
+    return document_response(resume_response, headers={"ETag": etag})
+
+# analytics: the most used skills and keywords, and the resumes per day, week, month or year of
+# Resume.date for the most used ones of the [since, until) range; until defaults to now, since
+# to ANALYTICS_TREND_DAYS before it, and longer ranges than ANALYTICS_TREND_MAX_DAYS are rejected
+
+def trend_range(since: datetime | None, until: datetime | None):
+    # dates without an offset are UTC
+    since, until = [date.replace(tzinfo=timezone.utc) if date != None and date.tzinfo == None else date for date in (since, until)]
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=ANALYTICS_TREND_DAYS)
+    if until - since > timedelta(days=ANALYTICS_TREND_MAX_DAYS):
+        raise HTTPException(status_code=422, detail=f"The range from since to until is longer than {ANALYTICS_TREND_MAX_DAYS} days")
+    return since, until
+
+@app.get("/api/analytics/skills", response_model=List[schemas.SkillFacet])
+async def get_top_skills(limit: Annotated[int, Query(ge=1, le=ANALYTICS_LIMIT_MAX)] = ANALYTICS_LIMIT, db: Session = Depends(get_db)):
+    return await run_crud(db, crud.get_top_skills, limit=limit)
+
+@app.get("/api/analytics/keywords", response_model=List[schemas.KeywordFacet])
+async def get_top_keywords(limit: Annotated[int, Query(ge=1, le=ANALYTICS_LIMIT_MAX)] = ANALYTICS_LIMIT, db: Session = Depends(get_db)):
+    return await run_crud(db, crud.get_top_keywords, limit=limit)
+
+@app.get("/api/analytics/skills/trend", response_model=List[schemas.SkillTrend])
+async def get_skill_trend(
+    bucket: Literal["day", "week", "month", "year"] = "month",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: Annotated[int, Query(ge=1, le=ANALYTICS_LIMIT_MAX)] = ANALYTICS_LIMIT,
+    db: Session = Depends(get_db),
+):
+    since, until = trend_range(since=since, until=until)
+    return await run_crud(db, crud.get_skill_trend, bucket=bucket, limit=limit, since=since, until=until)
+
+@app.get("/api/analytics/keywords/trend", response_model=List[schemas.KeywordTrend])
+async def get_keyword_trend(
+    bucket: Literal["day", "week", "month", "year"] = "month",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: Annotated[int, Query(ge=1, le=ANALYTICS_LIMIT_MAX)] = ANALYTICS_LIMIT,
+    db: Session = Depends(get_db),
+):
+    since, until = trend_range(since=since, until=until)
+    return await run_crud(db, crud.get_keyword_trend, bucket=bucket, limit=limit, since=since, until=until)
 
 # https://stackoverflow.com/questions/3297048/403-forbidden-vs-401-unauthorized-http-responses
 
-@app.delete("/api/resumes/{resume_id}", response_model=schemas.ResumeResponse) 
-def delete_resume(resume_id: int, Authorization: Annotated[str, Depends(security)], db: Session = Depends(get_db)): 
-    if not crud.is_token_authorized(db=db, token=Authorization):
+@app.delete("/api/resumes/{resume_id}", response_model=schemas.ResumeResponse)
+async def delete_resume(resume_id: int, Authorization: Annotated[str, Depends(security)], if_match: Annotated[str | None, Header()] = None, db: Session = Depends(get_db)):
+    if not await run_crud(db, crud.is_token_authorized, token=Authorization):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    
-    if crud.find_resume_id(db=db, resume_id=resume_id) == None:
+
+    resume_response = await run_crud(db, crud.delete_resume, resume_id=resume_id, if_match=if_match)
+    if resume_response == None:
         raise HTTPException(status_code=404, detail="Resume is not found")
-    
-    return crud.delete_resume(db=db, resume_id=resume_id)
-    
+
+    return document_response(resume_response)
+
 # rout to delete user for testing only for testing
 
-@app.delete("/api/users/{user_id}", include_in_schema=False) 
-def delete_resume(user_id: int, Authorization: Annotated[str, Depends(security)], db: Session = Depends(get_db)): 
-    if not crud.is_token_authorized(db=db, token=Authorization):
+@app.delete("/api/users/{user_id}", include_in_schema=False)
+async def delete_user(user_id: int, Authorization: Annotated[str, Depends(security)], db: Session = Depends(get_db)):
+    if not await run_crud(db, crud.is_token_authorized, token=Authorization):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    
-    if crud.find_user_id(db=db, user_id=user_id) == None:
+
+    if await run_crud(db, crud.find_user_id, user_id=user_id) == None:
         raise HTTPException(status_code=404, detail="User is not found")
-    
-    return crud.delete_user(db=db, user_id=user_id)
-    
\ No newline at end of file
+
+    return await run_crud(db, crud.delete_user, user_id=user_id)
+
@@ -0,0 +1,106 @@
+import threading
+from bisect import bisect_left
+
+# a minimal metrics registry rendered in the Prometheus text format at GET /metrics;
+# values are kept per process
+
+registry = []
+
+def format_labels(labelnames: tuple, labelvalues: tuple, extra: dict | None = None):
+    pairs = list(zip(labelnames, labelvalues)) + list((extra or {}).items())
+    if pairs == []:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labelvalues, value) for labelvalues, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labelvalues, value in self.samples():
+            lines.append(f"{name}{format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labelvalues, value: float = 1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + value
+
+    def get(self, *labelvalues):
+        with self.lock:
+            return self.values.get(labelvalues, 0)
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labelvalues, value: float = 1):
+        self.inc(*labelvalues, value=-value)
+
+    def set(self, *labelvalues, value: float):
+        with self.lock:
+            self.values[labelvalues] = value
+
+# a gauge whose values are read from the callbacks when the metrics are rendered
+class CallbackGauge(Metric):
+    type = "gauge"
+
+    def add(self, *labelvalues, callback):
+        with self.lock:
+            self.values[labelvalues] = callback
+
+    def samples(self):
+        with self.lock:
+            callbacks = list(self.values.items())
+        return [(self.name, labelvalues, callback()) for labelvalues, callback in callbacks]
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labelvalues, value: float):
+        with self.lock:
+            counts, total = self.values.get(labelvalues, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[labelvalues] = (counts, total + value)
+
+    def get(self, *labelvalues):
+        with self.lock:
+            counts, total = self.values.get(labelvalues, ([0] * (len(self.buckets) + 1), 0.0))
+            return sum(counts), total
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            values = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self.values.items()]
+
+        for labelvalues, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labelvalues, {'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labelvalues)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,6 @@
 import datetime
 from typing import List
-from sqlalchemy import ForeignKey, DateTime
+from sqlalchemy import DDL, JSON, ForeignKey, DateTime, Index, UniqueConstraint, event
 from sqlalchemy.orm import DeclarativeBase, Mapped
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship, mapped_column
@@ -26,17 +26,39 @@ class Resume(Base):
     date: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     title: Mapped[str]
     description: Mapped[str]
+    # bumped by every write to the resume or its children, the ETag of the resume is built from it
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
 
     # as child
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
 
-    # as parent
-    educations: Mapped[List["Education"]] = relationship()
-    conferences: Mapped[List["Conference"]] = relationship()
+    # as parent (children removed from a collection are deleted on flush)
+    educations: Mapped[List["Education"]] = relationship(cascade="all, delete-orphan")
+    conferences: Mapped[List["Conference"]] = relationship(cascade="all, delete-orphan")
 
     # associations 
-    skills: Mapped[List["ResumeSkillAssociation"]] = relationship()
-    keywords: Mapped[List["ResumeKeywordAssociation"]] = relationship()
+    skills: Mapped[List["ResumeSkillAssociation"]] = relationship(cascade="all, delete-orphan")
+    keywords: Mapped[List["ResumeKeywordAssociation"]] = relationship(cascade="all, delete-orphan")
+
+    # fetch the server generated date with RETURNING on insert instead of a refresh;
+    # updates and deletes check the version read by the session (WHERE version = ...), so a
+    # concurrent write makes the flush fail instead of being silently overwritten
+    __mapper_args__ = {"eager_defaults": True, "version_id_col": version, "version_id_generator": False}
+
+    # keyset pagination of GET /api/resumes
+    __table_args__ = (Index("ix_resumes_date_id", "date", "id"),)
+
+# full-text search on PostgreSQL: a generated tsvector column, kept up to date by the server
+# on every insert and update, with a GIN index; the column is not mapped, crud refers to it
+# by name, other databases search with the in-process index of search.py
+resume_search_vector = "to_tsvector('english', title || ' ' || description)"
+
+event.listen(Resume.__table__, "after_create", DDL(
+    f"ALTER TABLE resumes ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({resume_search_vector}) STORED"
+).execute_if(dialect="postgresql"))
+event.listen(Resume.__table__, "after_create", DDL(
+    "CREATE INDEX ix_resumes_search_vector ON resumes USING gin (search_vector)"
+).execute_if(dialect="postgresql"))
 
 class Education(Base):
     __tablename__ = "educations"
@@ -44,7 +66,7 @@ class Education(Base):
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     institution: Mapped[str]
     degree: Mapped[str]
-    resume_id: Mapped["Resume"] = mapped_column(ForeignKey("resumes.id"))
+    resume_id: Mapped["Resume"] = mapped_column(ForeignKey("resumes.id"), index=True)
 
 class Conference(Base):
     __tablename__ = "conferences"
@@ -52,7 +74,7 @@ class Conference(Base):
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     name: Mapped[str]
     year: Mapped[int]
-    resume_id: Mapped["Resume"] = mapped_column(ForeignKey("resumes.id"))
+    resume_id: Mapped["Resume"] = mapped_column(ForeignKey("resumes.id"), index=True)
 
 class Skill(Base):
     __tablename__ = "skills"
@@ -60,12 +82,22 @@ class Skill(Base):
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     type: Mapped[str]
     name: Mapped[str]
+    # resumes using the skill, kept by the writes that add or remove associations; the index
+    # gives the most used skills in order
+    refcount: Mapped[int] = mapped_column(default=0, server_default="0")
+
+    # skills are shared between resumes and upserted by (type, name)
+    __table_args__ = (
+        UniqueConstraint("type", "name", name="uq_skills_type_name"),
+        Index("ix_skills_refcount", "refcount", "id"),
+    )
 
 class ResumeSkillAssociation(Base):
     __tablename__ = "resume_skill_associations"
 
     resume_id: Mapped[int] = mapped_column(ForeignKey("resumes.id"), primary_key=True)
-    skill_id: Mapped[int] = mapped_column(ForeignKey("skills.id"), primary_key=True)
+    # the primary key index leads with resume_id, lookups by skill need their own index
+    skill_id: Mapped[int] = mapped_column(ForeignKey("skills.id"), primary_key=True, index=True)
 
     skills: Mapped["Skill"] = relationship()
 
@@ -74,11 +106,48 @@ class Keyword(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     name: Mapped[str]
+    refcount: Mapped[int] = mapped_column(default=0, server_default="0")
+
+    __table_args__ = (
+        UniqueConstraint("name", name="uq_keywords_name"),
+        Index("ix_keywords_refcount", "refcount", "id"),
+    )
 
 class ResumeKeywordAssociation(Base):
     __tablename__ = "resume_keyword_associations"
 
     resume_id: Mapped[int] = mapped_column(ForeignKey("resumes.id"), primary_key=True)
-    keyword_id: Mapped[int] = mapped_column(ForeignKey("keywords.id"), primary_key=True)
-
-    keyword: Mapped["Keyword"] = relationship()
\ No newline at end of file
+    keyword_id: Mapped[int] = mapped_column(ForeignKey("keywords.id"), primary_key=True, index=True)
+
+    keyword: Mapped["Keyword"] = relationship()
+
+# materialized document of a resume (RESUME_SNAPSHOTS), written with the resume and rendered at
+# its version; json rather than jsonb keeps the keys in the order of the response
+class ResumeSnapshot(Base):
+    __tablename__ = "resume_snapshots"
+
+    resume_id: Mapped[int] = mapped_column(ForeignKey("resumes.id", ondelete="CASCADE"), primary_key=True)
+    version: Mapped[int]
+    document: Mapped[dict] = mapped_column(JSON)
+
+# deferred work of the background queue (source/jobs.py); a row is deleted in the transaction
+# that does its work, so the table holds what is still to be done and the jobs that failed
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str]
+    payload: Mapped[dict] = mapped_column(JSON)
+    # a job is enqueued once per key while it is in the table
+    idempotency_key: Mapped[str | None] = mapped_column(unique=True)
+    # "pending", "running" or "failed"
+    status: Mapped[str] = mapped_column(default="pending", server_default="pending")
+    attempts: Mapped[int] = mapped_column(default=0, server_default="0")
+    # a pending job is not claimed before it (retry backoff), a running one is claimed again
+    # after it (lease of a worker that died)
+    run_after: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    last_error: Mapped[str | None]
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+    )
@@ -0,0 +1,96 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from passlib.context import CryptContext
+from . import metrics
+from .settings import BCRYPT_ROUNDS, PASSWORD_HASHING_WORKERS, PASSWORD_HASHING_MAX_PENDING
+
+# bcrypt takes hundreds of milliseconds of CPU per call, so it runs in a bounded process pool:
+# request handlers only await the result, and when too many jobs are queued the request
+# is rejected instead of starving the other endpoints
+
+# min_rounds makes needs_update() report hashes created with a lower cost
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS)
+
+hashing_pending = metrics.Gauge("password_hashing_pending", "Password hashing jobs queued or running")
+hashing_rejected = metrics.Counter("password_hashing_rejected_total", "Password hashing jobs rejected because the pool was saturated")
+
+class PasswordHashingBusy(Exception):
+    pass
+
+def hash_password(password: str):
+    return pwd_context.hash(password)
+
+# returns whether the password is valid and, if the stored hash is outdated, a new hash of it
+def verify_password(plain_password: str, hashed_password: str):
+    if not pwd_context.verify(plain_password, hashed_password):
+        return False, None
+    if pwd_context.needs_update(hashed_password):
+        return True, pwd_context.hash(plain_password)
+
+    return True, None
+
+executor = None
+pending = 0
+
+def get_executor():
+    global executor
+    if executor == None:
+        # spawned workers do not inherit the server's sockets and event loop
+        executor = ProcessPoolExecutor(max_workers=PASSWORD_HASHING_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return executor
+
+# a pool whose process died (e.g. killed for its memory) fails every job, it is replaced by the
+# first job that notices it
+def replace_broken_executor(broken: ProcessPoolExecutor):
+    global executor
+    if executor is broken:
+        executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+# the pool is only marked broken once its manager thread notices the dead process, and a job
+# submitted meanwhile races the teardown: it can be lost, spawn a process nothing joins, or fail
+# with an OSError from a queue just closed, so the processes are checked before submitting
+def submit(pool: ProcessPoolExecutor, function, *args):
+    if not all(process.is_alive() for process in list(pool._processes.values())):
+        raise BrokenProcessPool("A process of the pool died")
+    try:
+        return asyncio.get_running_loop().run_in_executor(pool, function, *args)
+    except OSError as error:
+        raise BrokenProcessPool("The pool was broken while the job was submitted") from error
+
+def shutdown():
+    global executor
+    if executor != None:
+        executor.shutdown(cancel_futures=True)
+        executor = None
+
+# pending is only changed on the event loop, so it needs no lock
+async def run_in_pool(function, *args):
+    global pending
+    if pending >= PASSWORD_HASHING_MAX_PENDING:
+        hashing_rejected.inc()
+        raise PasswordHashingBusy()
+
+    pending += 1
+    hashing_pending.inc()
+    try:
+        # a job that finds the pool broken is retried once, in a new pool
+        for attempt in range(2):
+            pool = get_executor()
+            try:
+                return await submit(pool, function, *args)
+            except BrokenProcessPool:
+                replace_broken_executor(pool)
+                if attempt == 1:
+                    raise
+    finally:
+        pending -= 1
+        hashing_pending.dec()
+
+async def hash_password_async(password: str):
+    return await run_in_pool(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    return await run_in_pool(verify_password, plain_password, hashed_password)
@@ -1,6 +1,7 @@
 import datetime
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List
+from .settings import RESUME_BATCH_GET_MAX
 
 class Base(BaseModel):
     # read the data even if it is not a dict, but an ORM model
@@ -63,6 +64,7 @@ class UserResponse(Base):
     email: str
     first_name: str
     last_name: str
+    resume_ids: List[int] = []
 
     model_config = {
         "json_schema_extra": {
@@ -72,6 +74,7 @@ class UserResponse(Base):
                     "email": "cool_email@gmail.com",
                     "first_name": "Ryan",
                     "last_name": "Gosling",
+                    "resume_ids": [28],
                 }
             ]
         }
@@ -260,4 +263,53 @@ class ResumeResponse(Base):
                 }
             ]
         }
-    }    
\ No newline at end of file
+    }
+
+class ResumePage(Base):
+    items: List[ResumeResponse] = []
+    # pass as the cursor parameter to get the next page, null on the last page
+    next_cursor: str | None = None
+
+class SkillFacet(Base):
+    type: str
+    name: str
+    count: int
+
+class KeywordFacet(Base):
+    name: str
+    count: int
+
+# resumes per skill or keyword in the period of Resume.date starting on bucket
+class SkillTrend(SkillFacet):
+    bucket: datetime.date
+
+class KeywordTrend(KeywordFacet):
+    bucket: datetime.date
+
+# a page of the matching resumes and the most used skills and keywords among all matches
+class ResumeSearchPage(ResumePage):
+    skills: List[SkillFacet] = []
+    keywords: List[KeywordFacet] = []
+
+class ResumeBatchGet(Base):
+    ids: List[int] = Field(min_length=1, max_length=RESUME_BATCH_GET_MAX)
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "ids": [3, 1, 2],
+                }
+            ]
+        }
+    }
+
+# status is 200 with the resume or 404 with a null resume
+class ResumeBatchItem(Base):
+    id: int
+    status: int
+    resume: ResumeResponse | None = None
+
+# one item per requested id, in the order of the request
+class ResumeBatchResponse(Base):
+    items: List[ResumeBatchItem] = []
@@ -0,0 +1,64 @@
+import re
+import threading
+
+# full-text search of resumes by title and description. PostgreSQL matches with the
+# search_vector column of models.py; other databases (SQLite in the tests) use this
+# in-process inverted index, which is loaded from the database on the first search and
+# kept in step by the crud writes of the process
+
+token_pattern = re.compile(r"\w+")
+
+def tokenize(text: str):
+    return set(token_pattern.findall(text.lower()))
+
+class InvertedIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # token -> ids of the resumes that contain it, and id -> tokens of the resume
+        self.postings = {}
+        self.tokens = {}
+        self.loaded = False
+
+    def load(self, documents):
+        with self.lock:
+            self.postings.clear()
+            self.tokens.clear()
+            for document_id, text in documents:
+                self._add(document_id, text)
+            self.loaded = True
+
+    def _add(self, document_id: int, text: str):
+        tokens = tokenize(text)
+        self.tokens[document_id] = tokens
+        for token in tokens:
+            self.postings.setdefault(token, set()).add(document_id)
+
+    def _remove(self, document_id: int):
+        for token in self.tokens.pop(document_id, ()):
+            postings = self.postings[token]
+            postings.discard(document_id)
+            if postings == set():
+                del self.postings[token]
+
+    def add(self, document_id: int, text: str):
+        with self.lock:
+            self._remove(document_id)
+            self._add(document_id, text)
+
+    def remove(self, document_id: int):
+        with self.lock:
+            self._remove(document_id)
+
+    # ids of the documents that contain every word of the query
+    def search(self, query: str):
+        tokens = tokenize(query)
+        if tokens == set():
+            return set()
+
+        with self.lock:
+            postings = sorted((self.postings.get(token, set()) for token in tokens), key=len)
+            return set.intersection(*postings)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.tokens)
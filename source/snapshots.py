@@ -0,0 +1,78 @@
+import argparse
+import sys
+import pydantic_core
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from . import crud, models
+from .database import SessionLocal
+from .settings import RESUME_EXPORT_CHUNK_SIZE
+
+# maintenance of the materialized documents of RESUME_SNAPSHOTS, runnable as
+#   python -m source.snapshots rebuild   renders every resume from the tables into resume_snapshots
+#   python -m source.snapshots check     compares every snapshot with the tables, exits with 1 on a difference
+# both go through the resumes in chunks of ids, one transaction per chunk for the rebuild
+
+def iter_resume_id_chunks(db: Session, chunk_size: int):
+    last_id = 0
+    while True:
+        resume_ids = list(db.scalars(select(models.Resume.id).where(models.Resume.id > last_id).order_by(models.Resume.id).limit(chunk_size)))
+        if resume_ids == []:
+            return
+        yield resume_ids
+        last_id = resume_ids[-1]
+
+def rebuild_snapshots(db: Session, chunk_size: int = RESUME_EXPORT_CHUNK_SIZE):
+    rebuilt = 0
+    for resume_ids in iter_resume_id_chunks(db=db, chunk_size=chunk_size):
+        crud.upsert_snapshots(db=db, documents=crud.find_resume_documents(db=db, resume_ids=resume_ids))
+        db.commit()
+        rebuilt += len(resume_ids)
+
+    # snapshots of deleted resumes, where the foreign key does not cascade
+    db.execute(delete(models.ResumeSnapshot).where(models.ResumeSnapshot.resume_id.not_in(select(models.Resume.id))))
+    db.commit()
+
+    return rebuilt
+
+# returns the ids of the resumes without a snapshot, with a snapshot of another version or with
+# a snapshot of their version that differs from the tables, and of snapshots without a resume
+def check_snapshots(db: Session, chunk_size: int = RESUME_EXPORT_CHUNK_SIZE):
+    problems = {"missing": [], "stale": [], "different": [], "orphaned": []}
+    for resume_ids in iter_resume_id_chunks(db=db, chunk_size=chunk_size):
+        documents = crud.find_resume_documents(db=db, resume_ids=resume_ids)
+        snapshots = {
+            snapshot.resume_id: snapshot
+            for snapshot in db.execute(select(models.ResumeSnapshot).where(models.ResumeSnapshot.resume_id.in_(resume_ids))).scalars()
+        }
+        for resume_id, (document, version) in documents.items():
+            snapshot = snapshots.get(resume_id)
+            if snapshot == None:
+                problems["missing"].append(resume_id)
+            elif snapshot.version != version:
+                problems["stale"].append(resume_id)
+            elif snapshot.document != pydantic_core.to_jsonable_python(document):
+                problems["different"].append(resume_id)
+        db.expunge_all()
+
+    problems["orphaned"] = list(db.scalars(select(models.ResumeSnapshot.resume_id).where(models.ResumeSnapshot.resume_id.not_in(select(models.Resume.id)))))
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or check the materialized resume documents")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--chunk-size", type=int, default=RESUME_EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == "rebuild":
+            print(f"rebuilt {rebuild_snapshots(db=db, chunk_size=args.chunk_size)} snapshots")
+            return
+
+        problems = check_snapshots(db=db, chunk_size=args.chunk_size)
+    for problem, resume_ids in problems.items():
+        print(f"{problem}: {len(resume_ids)}" + (f" (ids {', '.join(map(str, resume_ids[:20]))})" if resume_ids != [] else ""))
+    if any(resume_ids != [] for resume_ids in problems.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,17 @@
+import asyncio
+import csv
+import io
+import json
+import threading
+import time
 from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from .database import engine
 from .main import app
-from . import schemas
+from . import crud, main, models, schemas
+
+# the application leaves the schema to alembic
+models.Base.metadata.create_all(bind=engine)
 
 client = TestClient(app)
 
@@ -29,6 +40,18 @@ def test_home():
     assert response.status_code == 200
     assert response.json() == "it's a homepage"
 
+def test_ready_after_warm_up():
+    with TestClient(app) as lifespan_client:
+        assert lifespan_client.get("/health/live").status_code == 200
+        deadline = time.monotonic() + 10
+        while lifespan_client.get("/health/ready").status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert lifespan_client.get("/health/ready").json() == {"status": "ready"}
+        assert app.openapi_schema != None
+
+    assert client.get("/health/ready").status_code == 503
+
 def test_sign_up():
     response = client.post(
         "/api/signup",
@@ -141,6 +164,187 @@ def test_patch_resume():
 
     assert response.status_code == 200
 
+def test_get_resumes():
+    response = client.get("/api/resumes", params={"user_id": db_user_id, "limit": 1})
+
+    assert response.status_code == 200
+    assert [resume["id"] for resume in response.json()["items"]] == [db_resume_id]
+    assert response.json()["next_cursor"] == None
+
+def test_search_resumes():
+    response = client.get("/api/resumes/search", params={"q": resume_upd.title, "user_id": db_user_id})
+
+    assert response.status_code == 200
+    assert [resume["id"] for resume in response.json()["items"]] == [db_resume_id]
+    assert sorted(facet["name"] for facet in response.json()["keywords"]) == sorted(keyword.name for keyword in resume_part_upd.keywords)
+
+def test_batch_get_resumes():
+    response = client.post("/api/resumes:batchGet", json={"ids": [db_resume_id, -1, db_resume_id]})
+
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [(item["id"], item["status"]) for item in items] == [(db_resume_id, 200), (-1, 404), (db_resume_id, 200)]
+    assert items[0]["resume"] == client.get(f"/api/resumes/{db_resume_id}").json()
+    assert items[1]["resume"] == None
+
+    assert client.post("/api/resumes:batchGet", json={"ids": []}).status_code == 422
+
+def test_analytics():
+    top = client.get("/api/analytics/skills", params={"limit": 5})
+    trend = client.get("/api/analytics/keywords/trend", params={"bucket": "week"})
+
+    assert top.status_code == 200
+    assert len(top.json()) <= 5
+    assert all(skill["count"] > 0 for skill in top.json())
+    assert trend.status_code == 200
+    assert client.get("/api/analytics/skills/trend", params={"bucket": "hour"}).status_code == 422
+    # the range is bounded, so a trend never counts every association
+    assert client.get("/api/analytics/skills/trend", params={"since": "2020-01-01T00:00:00", "until": "2026-01-01T00:00:00"}).status_code == 422
+    assert client.get("/api/analytics/skills/trend", params={"since": "2025-06-01T00:00:00Z", "until": "2026-01-01T00:00:00Z"}).status_code == 200
+
+def test_get_resume_not_modified():
+    response = client.get(f"/api/resumes/{db_resume_id}")
+    etag = response.headers["ETag"]
+
+    assert response.status_code == 200
+
+    response = client.get(f"/api/resumes/{db_resume_id}", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+def test_patch_resume_with_stale_etag():
+    response = client.patch(
+        f"/api/resumes/{db_resume_id}",
+        headers={"If-Match": '"0.0"'},
+        json={"title": "Lost update"}
+    )
+
+    assert response.status_code == 412
+
+def test_concurrent_puts_without_if_match(monkeypatch):
+    resume_id = client.post("/api/resumes", json=resume.model_dump()).json()["id"]
+
+    # both requests read the resume before either writes it, the one that writes second finds
+    # it changed and makes its write again
+    barrier = threading.Barrier(2)
+    check_if_match = crud.check_if_match
+    waited = set()
+    def read_together(resume, if_match):
+        if threading.get_ident() not in waited:
+            waited.add(threading.get_ident())
+            barrier.wait(timeout=10)
+        check_if_match(resume=resume, if_match=if_match)
+    monkeypatch.setattr(crud, "check_if_match", read_together)
+
+    responses = {}
+    def put(title: str):
+        responses[title] = client.put(f"/api/resumes/{resume_id}", json={"title": title})
+    threads = [threading.Thread(target=put, args=(title,)) for title in ["First", "Second"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [response.status_code for response in responses.values()] == [200, 200]
+    assert sorted(response.headers["ETag"] for response in responses.values()) == [f'"{resume_id}.2"', f'"{resume_id}.3"']
+    last = max(responses.values(), key=lambda response: response.headers["ETag"])
+    assert client.get(f"/api/resumes/{resume_id}").json()["title"] == last.json()["title"]
+
+def test_post_resumes_bulk():
+    lines = [
+        resume.model_dump_json(),
+        "",
+        '{"title": "No user"}',
+        resume.model_copy(update={"user_id": -1}).model_dump_json(),
+    ]
+    response = client.post("/api/resumes:bulk", content="\n".join(lines).encode())
+    results = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [(result["line"], result["status"]) for result in results] == [(1, 201), (3, 422), (4, 404)]
+    for skill in client.get(f"/api/resumes/{results[0]['id']}").json()["skills"]:
+        assert schemas.Skill(type=skill["type"], name=skill["name"]) in resume.skills
+
+def test_post_resumes_bulk_rejects_long_lines(monkeypatch):
+    record = resume.model_dump_json().encode()
+    monkeypatch.setattr(main, "RESUME_BULK_MAX_LINE_BYTES", len(record))
+    body = b"\n".join([record, record + b" " * 100, record, b"x" * 10 * len(record)])
+
+    # sent in small chunks, the long lines span several of them
+    def chunks():
+        for start in range(0, len(body), 7):
+            yield body[start:start + 7]
+    response = client.post("/api/resumes:bulk", content=chunks())
+    results = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert [(result["line"], result["status"]) for result in results] == [(1, 201), (2, 413), (3, 201), (4, 413)]
+
+def test_post_resumes_bulk_reports_failed_batch(monkeypatch):
+    monkeypatch.setattr(main, "RESUME_BULK_BATCH_SIZE", 2)
+    create_resumes = crud.create_resumes
+    batches = []
+    def fail_second_batch(db, resumes):
+        batches.append(len(resumes))
+        if len(batches) == 2:
+            raise OperationalError("INSERT INTO resumes", {}, Exception("server closed the connection"))
+        return create_resumes(db=db, resumes=resumes)
+    monkeypatch.setattr(crud, "create_resumes", fail_second_batch)
+
+    lines = [resume.model_dump_json()] * 5
+    response = client.post("/api/resumes:bulk", content="\n".join(lines).encode())
+    results = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert [(result["line"], result["status"]) for result in results] == [(1, 201), (2, 201), (3, 500), (4, 500), (5, 201)]
+    assert client.get(f"/api/resumes/{results[4]['id']}").status_code == 200
+
+def test_post_resumes_bulk_streams_results_while_reading(monkeypatch):
+    monkeypatch.setattr(main, "RESUME_BULK_BATCH_SIZE", 1)
+    chunks = [resume.model_dump_json().encode() + b"\n" for _ in range(3)]
+    sent_before_last_chunk = []
+    messages = []
+
+    async def receive():
+        if chunks == []:
+            return {"type": "http.disconnect"}
+        if len(chunks) == 1:
+            sent_before_last_chunk.extend(message for message in messages if message.get("body"))
+        return {"type": "http.request", "body": chunks.pop(0), "more_body": chunks != []}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/api/resumes:bulk", "raw_path": b"/api/resumes:bulk", "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/x-ndjson")], "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+    }
+    asyncio.run(app(scope, receive, send))
+
+    # the results of the first batches went out before the body was read
+    assert len(sent_before_last_chunk) == 2
+    body = b"".join(message.get("body", b"") for message in messages if message["type"] == "http.response.body")
+    assert [json.loads(line)["status"] for line in body.splitlines()] == [201, 201, 201]
+
+def test_export_resumes():
+    response = client.get("/api/resumes:export")
+    exported = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert client.get(f"/api/resumes/{db_resume_id}").json() in exported
+
+    response = client.get("/api/resumes:export", params={"format": "csv"})
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+
+    assert response.headers["content-type"].startswith("text/csv")
+    assert len(rows) == len(exported)
+    assert [json.loads(row["skills"]) for row in rows] == [resume["skills"] for resume in exported]
+
 def test_delete_resume_without_auth():
     response = client.delete(
         f"/api/resumes/{db_resume_id}/",
@@ -0,0 +1,68 @@
+import importlib
+import time
+from . import settings
+from .cache import LRUCacheBackend, ResponseCache, TTLCache, cache_evictions, cache_requests
+
+# tests
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10)
+    cache.set("live", 1, expires_at=time.time() + 60)
+    cache.set("expired", 2, expires_at=time.time() - 1)
+
+    assert cache.get("live") == 1
+    assert cache.get("expired") == None
+    assert len(cache) == 1
+
+def test_lru_backend_evicts_least_recently_used():
+    cache = ResponseCache("test_lru", LRUCacheBackend(name="test_lru", maxsize=2, ttl=60))
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+    cache.get("a")
+    cache.set("c", b"3")
+
+    assert cache.get("b") == None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+    assert cache_evictions.get("test_lru") == 1
+    assert cache_requests.get("test_lru", "hit") == 3
+    assert cache_requests.get("test_lru", "miss") == 1
+
+def test_fill_needs_the_last_lease_since_the_delete():
+    cache = ResponseCache("test_lease", LRUCacheBackend(name="test_lease", maxsize=10, ttl=60))
+
+    # a write deletes the key between the lease and the fill
+    lease = cache.lease("a")
+    cache.invalidate("a")
+    cache.fill("a", b"old", lease)
+    assert cache.get("a") == None
+
+    # a later reader took the key over
+    first = cache.lease("a")
+    second = cache.lease("a")
+    cache.fill("a", b"first", first)
+    assert cache.get("a") == None
+    cache.fill("a", b"second", second)
+    assert cache.get("a") == b"second"
+
+    # a lease fills once
+    cache.invalidate("a")
+    cache.fill("a", b"again", second)
+    assert cache.get("a") == None
+
+def test_per_process_caches_are_off_with_several_workers(monkeypatch):
+    # a write or a user deletion would reach the caches of its own worker only
+    monkeypatch.setenv("RESUME_CACHE_BACKEND", "memory")
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    try:
+        importlib.reload(settings)
+        assert settings.RESUME_CACHE_BACKEND == "none"
+        assert settings.TOKEN_CACHE_SIZE == 0
+
+        monkeypatch.setenv("WEB_CONCURRENCY", "1")
+        importlib.reload(settings)
+        assert settings.RESUME_CACHE_BACKEND == "memory"
+        assert settings.TOKEN_CACHE_SIZE > 0
+    finally:
+        monkeypatch.undo()
+        importlib.reload(settings)
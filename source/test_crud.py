@@ -0,0 +1,868 @@
+import datetime
+import os
+import threading
+import pytest
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.pool import StaticPool
+from . import crud, jobs, models, schemas, snapshots
+from .cache import CacheBackend, ResponseCache, TTLCache, create_response_cache
+from .search import InvertedIndex
+
+# the crud functions are tested against an in-memory database, so no server is needed
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# counts statements as the application issues them; a batched insert is one statement,
+# which the dialect sends as multi-row INSERT ... VALUES where it supports it
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+        self.commits = 0
+
+    def __call__(self, conn, clauseelement, multiparams, params, execution_options):
+        self.count += 1
+
+    def commit(self, conn):
+        self.commits += 1
+
+@pytest.fixture
+def db(monkeypatch):
+    # every test starts with a new database, so cached responses must not outlive it
+    monkeypatch.setattr(crud, "resume_cache", create_response_cache("resume", backend="memory", maxsize=100, ttl=60, url=""))
+    monkeypatch.setattr(crud, "search_index", InvertedIndex())
+    monkeypatch.setattr(crud, "skill_cache", TTLCache(maxsize=100))
+    monkeypatch.setattr(crud, "keyword_cache", TTLCache(maxsize=100))
+    # the statement budgets are those of the normalized reads, the snapshot tests turn it on
+    monkeypatch.setattr(crud, "RESUME_SNAPSHOTS", False)
+    # the orphan cleanup is deferred, the tests run the jobs with jobs.run_due_jobs
+    monkeypatch.setattr(crud, "JOB_QUEUE", True)
+    models.Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def count_statements():
+    counter = StatementCounter()
+    event.listen(engine, "before_execute", counter)
+    event.listen(engine, "commit", counter.commit)
+    yield counter
+    event.remove(engine, "before_execute", counter)
+    event.remove(engine, "commit", counter.commit)
+
+def create_user(db, email="crud_user@example.com"):
+    db_user = models.User(email=email, password="not a hash", first_name="Willy", last_name="Wonka")
+    db.add(db_user)
+    db.commit()
+
+    return db_user
+
+def make_resume(user_id: int, children: int):
+    return schemas.ResumeCreate(
+        user_id=user_id,
+        title="Just a resume",
+        description="Resume of a cool developer",
+        educations=[schemas.Education(institution=f"University {i}", degree="Master") for i in range(children)],
+        conferences=[schemas.Conference(name=f"Conference {i}", year=2000 + i) for i in range(children)],
+        skills=[schemas.Skill(type="Programming language", name=f"Language {i}") for i in range(children)],
+        keywords=[schemas.Keyword(name=f"Keyword {i}") for i in range(children)],
+    )
+
+# tests
+
+@pytest.mark.parametrize("children", [0, 1, 30])
+def test_get_resume_statement_budget(db, count_statements, children):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=children))["id"]
+    db.expunge_all()
+
+    count_statements.count = 0
+    resume = crud.get_resume(db=db, resume_id=resume_id)
+
+    # one statement for the resume and one per child collection
+    assert count_statements.count == 5
+    assert len(resume["educations"]) == children
+    assert len(resume["conferences"]) == children
+    assert len(resume["skills"]) == children
+    assert len(resume["keywords"]) == children
+
+def test_get_resume_not_found(db):
+    assert crud.get_resume(db=db, resume_id=1) == None
+
+def test_get_resume_matches_created_resume(db):
+    user = create_user(db)
+    resume = make_resume(user_id=user.id, children=3)
+    resume_id = crud.create_resume(db=db, resume=resume)["id"]
+    db.expunge_all()
+
+    response = crud.get_resume(db=db, resume_id=resume_id)
+
+    assert response["title"] == resume.title
+    assert [schemas.Education(institution=e["institution"], degree=e["degree"]) for e in response["educations"]] == resume.educations
+    assert [schemas.Conference(name=c["name"], year=c["year"]) for c in response["conferences"]] == resume.conferences
+    assert sorted(s["name"] for s in response["skills"]) == sorted(s.name for s in resume.skills)
+    assert sorted(k["name"] for k in response["keywords"]) == sorted(k.name for k in resume.keywords)
+
+@pytest.mark.parametrize("children", [1, 30])
+def test_create_resume_commits_once(db, count_statements, children):
+    user = create_user(db)
+    resume = make_resume(user_id=user.id, children=children)
+
+    count_statements.count = 0
+    count_statements.commits = 0
+    response = crud.create_resume(db=db, resume=resume)
+
+    # a lookup and an upsert for skills and keywords, their refcounts, the resume and one batched
+    # insert per child table
+    assert count_statements.count == 11
+    assert count_statements.commits == 1
+    assert response["date"] != None
+    assert all(education["id"] != None for education in response["educations"])
+    assert len(response["skills"]) == children
+
+def test_create_resume_reuses_existing_skills(db):
+    user = create_user(db)
+    first = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))
+    second = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=3))
+
+    assert [skill["id"] for skill in second["skills"][:2]] == [skill["id"] for skill in first["skills"]]
+    assert db.query(models.Skill).count() == 3
+
+def test_known_skills_need_no_lookups(db, count_statements):
+    user = create_user(db)
+    crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=3))
+    crud.skill_cache.clear()
+    crud.keyword_cache.clear()
+    crud.warm_dictionary_cache(db=db)
+    resume = make_resume(user_id=user.id, children=3)
+
+    count_statements.count = 0
+    response = crud.create_resume(db=db, resume=resume)
+
+    # the refcounts, the resume and one batched insert per child table, no skill or keyword lookup
+    assert count_statements.count == 7
+    assert sorted(skill["name"] for skill in response["skills"]) == sorted(skill.name for skill in resume.skills)
+    assert db.query(models.Skill).count() == 3
+
+def test_orphan_cleanup_invalidates_dictionary(db):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))["id"]
+    assert crud.skill_cache.get(("Programming language", "Language 0")) != None
+
+    crud.delete_resume(db=db, resume_id=resume_id)
+    jobs.run_due_jobs(db=db)
+
+    assert len(crud.skill_cache) == 0
+    assert len(crud.keyword_cache) == 0
+
+def test_stale_dictionary_entry_is_retried(db):
+    # another process removed the skill after this one cached its id
+    db.execute(text("PRAGMA foreign_keys = ON"))
+    user = create_user(db)
+    crud.skill_cache.set(("Programming language", "Language 0"), 1000, expires_at=float("inf"))
+
+    try:
+        response = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))
+    finally:
+        db.execute(text("PRAGMA foreign_keys = OFF"))
+
+    assert response["skills"][0]["id"] != 1000
+    assert crud.skill_cache.get(("Programming language", "Language 0")) == response["skills"][0]["id"]
+
+def test_new_skills_and_keywords_are_inserted_in_key_order(db):
+    # whatever the hash order of the set, so concurrent inserts lock the unique keys in one order
+    names = [f"Name {i}" for i in range(20, 0, -1)]
+    db_skills = crud.upsert_skills(db=db, skills=[schemas.Skill(type="Tool", name=name) for name in names])
+    db_keywords = crud.upsert_keywords(db=db, keywords=[schemas.Keyword(name=name) for name in names])
+
+    assert [skill.id for _, skill in sorted(db_skills.items())] == sorted(skill.id for skill in db_skills.values())
+    assert [keyword.id for _, keyword in sorted(db_keywords.items())] == sorted(keyword.id for keyword in db_keywords.values())
+
+def test_upsert_skills_rereads_rows_inserted_concurrently(db, monkeypatch):
+    existing = models.Skill(type="Programming language", name="Python")
+    db.add(existing)
+    db.commit()
+
+    # the first lookup misses the row, as if another request inserted it right after
+    find_skills = crud.find_skills
+    lookups = []
+    def find_skills_late(db, skills):
+        lookups.append(skills)
+        return {} if len(lookups) == 1 else find_skills(db=db, skills=skills)
+    monkeypatch.setattr(crud, "find_skills", find_skills_late)
+
+    skills = [schemas.Skill(type="Programming language", name="Python"), schemas.Skill(type="Programming language", name="Go")]
+    db_skills = crud.upsert_skills(db=db, skills=skills)
+
+    assert db_skills[("Programming language", "Python")].id == existing.id
+    assert db_skills[("Programming language", "Go")].id != None
+    assert len(lookups) == 2
+    assert db.query(models.Skill).count() == 2
+
+def test_copy_values_are_escaped():
+    assert crud.copy_value(None) == "\\N"
+    assert crud.copy_value(12) == "12"
+    assert crud.copy_value("tab\there\nnew line\r\\N") == "tab\\there\\nnew line\\r\\\\N"
+    assert crud.copy_value(datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)) == "2026-01-02T03:04:05+00:00"
+
+# COPY needs PostgreSQL over psycopg2, set TEST_DATABASE_URL to run it
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL", "").startswith("postgresql"), reason="COPY needs PostgreSQL")
+def test_create_resumes_with_copy(monkeypatch):
+    copy_engine = create_engine(os.environ["TEST_DATABASE_URL"])
+    monkeypatch.setattr(crud, "skill_cache", TTLCache(maxsize=100))
+    monkeypatch.setattr(crud, "keyword_cache", TTLCache(maxsize=100))
+    monkeypatch.setattr(crud, "search_index", InvertedIndex())
+    monkeypatch.setattr(crud, "RESUME_SNAPSHOTS", True)
+    monkeypatch.setattr(crud, "RESUME_BULK_COPY", True)
+    models.Base.metadata.create_all(bind=copy_engine)
+    try:
+        with sessionmaker(autocommit=False, autoflush=False, bind=copy_engine)() as db:
+            user_id = create_user(db).id
+            tricky = make_resume(user_id=user_id, children=2).model_copy(update={"title": "tab\tnew line\n back\\slash \\N"})
+            resume_ids = crud.create_resumes(db=db, resumes=[tricky, make_resume(user_id=user_id, children=3), make_resume(user_id=-1, children=1)])
+
+            assert resume_ids[2] == None
+            assert crud.get_resume(db=db, resume_id=resume_ids[0])["title"] == tricky.title
+            assert len(crud.get_resume(db=db, resume_id=resume_ids[1])["educations"]) == 3
+            assert_refcounts_match_associations(db)
+            # the snapshots were rendered from the objects, they match what the tables hold
+            assert snapshots.check_snapshots(db=db) == {"missing": [], "stale": [], "different": [], "orphaned": []}
+    finally:
+        models.Base.metadata.drop_all(bind=copy_engine)
+        copy_engine.dispose()
+
+@pytest.mark.parametrize("batch_size", [1, 50])
+def test_create_resumes_writes_batch_at_once(db, count_statements, batch_size):
+    user = create_user(db)
+    resumes = [make_resume(user_id=user.id, children=3) for _ in range(batch_size)]
+    resumes.append(make_resume(user_id=user.id + 1, children=3))
+
+    count_statements.commits = 0
+    resume_ids = crud.create_resumes(db=db, resumes=resumes)
+
+    assert count_statements.commits == 1
+    assert len(set(resume_ids[:-1])) == batch_size and resume_ids[-1] == None
+    # the skills and keywords are shared by the whole batch
+    assert db.query(models.Skill).count() == 3
+    assert db.query(models.ResumeSkillAssociation).count() == 3 * batch_size
+    assert len(crud.get_resume(db=db, resume_id=resume_ids[0])["educations"]) == 3
+
+def test_update_resume_replaces_children(db, count_statements):
+    user = create_user(db)
+    created = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))
+    resume_id = created["id"]
+    kept_skill_id = next(skill["id"] for skill in created["skills"] if skill["name"] == "Language 1")
+    update = schemas.ResumeUpdate(
+        title="Updated resume",
+        educations=[schemas.Education(institution="Berkeley University", degree="PhD")],
+        skills=[schemas.Skill(type="Programming language", name="Language 1")],
+    )
+
+    count_statements.commits = 0
+    response, etag = crud.update_resume(db=db, resume_id=resume_id, resume=update)
+
+    assert count_statements.commits == 1
+    jobs.run_due_jobs(db=db)
+    assert response["title"] == "Updated resume"
+    assert [education["institution"] for education in response["educations"]] == ["Berkeley University"]
+    assert response["conferences"] == []
+    assert db.query(models.Education).count() == 1
+    # skills and keywords that are no longer used by any resume are removed, a skill
+    # that stays on the resume keeps its row
+    assert [(skill.id, skill.name) for skill in db.query(models.Skill)] == [(kept_skill_id, "Language 1")]
+    assert db.query(models.Keyword).count() == 0
+
+# counts the statements that write rows
+class WriteCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith("SELECT"):
+            self.statements.append(statement.split()[0].upper())
+
+def test_identical_update_writes_nothing(db):
+    user = create_user(db)
+    resume = make_resume(user_id=user.id, children=3)
+    created = crud.create_resume(db=db, resume=resume)
+    update = schemas.ResumeUpdate(**resume.model_dump(exclude={"user_id"}))
+
+    writes = WriteCounter()
+    event.listen(engine, "before_cursor_execute", writes)
+    try:
+        response, etag = crud.update_resume(db=db, resume_id=created["id"], resume=update)
+    finally:
+        event.remove(engine, "before_cursor_execute", writes)
+
+    assert writes.statements == []
+    assert etag == crud.resume_etag(created["id"], 1)
+    assert [education["id"] for education in response["educations"]] == [education["id"] for education in created["educations"]]
+
+def test_update_writes_only_changed_rows(db):
+    user = create_user(db)
+    resume = make_resume(user_id=user.id, children=3)
+    created = crud.create_resume(db=db, resume=resume)
+    update = schemas.ResumeUpdate(**resume.model_dump(exclude={"user_id"}))
+    update.educations[1] = schemas.Education(institution="Berkeley University", degree="PhD")
+    update.skills = update.skills[:2]
+
+    writes = WriteCounter()
+    event.listen(engine, "before_cursor_execute", writes)
+    try:
+        response, etag = crud.update_resume(db=db, resume_id=created["id"], resume=update)
+    finally:
+        event.remove(engine, "before_cursor_execute", writes)
+
+    # the version, one education out and one in, one association out, the refcount of its skill
+    # and the job that removes the orphan skill
+    assert sorted(writes.statements) == ["DELETE", "DELETE", "INSERT", "INSERT", "UPDATE", "UPDATE"]
+    assert etag == crud.resume_etag(created["id"], 2)
+    # the new education goes after the kept ones, in id order
+    assert [education["institution"] for education in response["educations"]] == ["University 0", "University 2", "Berkeley University"]
+    assert response["educations"][0]["id"] == created["educations"][0]["id"]
+    assert [skill["id"] for skill in response["skills"]] == sorted(skill["id"] for skill in created["skills"] if skill["name"] != "Language 2")
+    assert db.query(models.Skill).count() == 3
+    jobs.run_due_jobs(db=db)
+    assert db.query(models.Skill).count() == 2
+
+def test_delete_resume_removes_children(db):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))["id"]
+    other_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+
+    response = crud.delete_resume(db=db, resume_id=resume_id)
+    jobs.run_due_jobs(db=db)
+
+    assert response["id"] == resume_id
+    assert crud.get_resume(db=db, resume_id=resume_id) == None
+    assert len(crud.get_resume(db=db, resume_id=other_id)["skills"]) == 1
+    assert db.query(models.Education).count() == 1
+    assert db.query(models.Skill).count() == 1
+    assert db.query(models.Keyword).count() == 1
+
+@pytest.mark.parametrize("sharing_resumes", [1, 20])
+def test_orphan_cleanup_does_not_depend_on_popularity(db, count_statements, sharing_resumes):
+    user = create_user(db)
+    for _ in range(sharing_resumes):
+        crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=3))
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=3))["id"]
+
+    count_statements.count = 0
+    crud.delete_resume(db=db, resume_id=resume_id)
+
+    # the resume read, a delete per child table and the resume, one refcount UPDATE per shared
+    # table and the cleanup job, however many resumes share the skills
+    assert count_statements.count == 13
+    # the job: its claim, one orphan DELETE per shared table and its own DELETE
+    count_statements.count = 0
+    assert jobs.run_due_jobs(db=db) == 1
+    assert count_statements.count == 5
+    assert db.query(models.Skill).count() == 3
+
+def test_delete_user_removes_orphans(db):
+    user = create_user(db)
+    crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))
+    crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=3))
+
+    crud.delete_user(db=db, user_id=user.id)
+    jobs.run_due_jobs(db=db)
+
+    assert db.query(models.Skill).count() == 0
+    assert db.query(models.Keyword).count() == 0
+
+def test_authorized_token_is_cached_until_user_is_deleted(db, monkeypatch, count_statements):
+    # the cache of a single worker process, it is off with WEB_CONCURRENCY > 1
+    monkeypatch.setattr(crud, "TOKEN_CACHE_SIZE", 100)
+    monkeypatch.setattr(crud, "token_cache", TTLCache(maxsize=100))
+    user = create_user(db, email="token_user@example.com")
+    user_id = user.id
+    access_token = crud.create_access_token(token_data=schemas.TokenCreate(email="token_user@example.com")).access_token
+    token = HTTPAuthorizationCredentials(scheme="Bearer", credentials=access_token)
+
+    assert crud.is_token_authorized(db=db, token=token)
+    count_statements.count = 0
+    assert crud.is_token_authorized(db=db, token=token)
+    assert count_statements.count == 0
+
+    crud.delete_user(db=db, user_id=user_id)
+
+    assert not crud.is_token_authorized(db=db, token=token)
+
+def test_invalid_token_is_not_cached(db):
+    token = HTTPAuthorizationCredentials(scheme="Bearer", credentials="not a token")
+
+    assert not crud.is_token_authorized(db=db, token=token)
+    assert crud.token_cache.get(crud.token_digest("not a token")) == None
+
+# stands in for a shared backend such as redis
+class FakeSharedBackend(CacheBackend):
+    def __init__(self):
+        self.values = {}
+        self.leases = {}
+
+    def get(self, key: str):
+        return self.values.get(key)
+
+    def set(self, key: str, value: bytes):
+        self.values[key] = value
+
+    def delete(self, key: str):
+        self.values.pop(key, None)
+        self.leases.pop(key, None)
+
+    def lease(self, key: str):
+        self.leases[key] = object()
+        return self.leases[key]
+
+    def fill(self, key: str, value: bytes, lease):
+        if self.leases.get(key) == lease:
+            del self.leases[key]
+            self.values[key] = value
+
+def test_resume_json_is_read_through_cache(db, count_statements):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))["id"]
+
+    content, etag = crud.get_resume_json(db=db, resume_id=resume_id)
+    count_statements.count = 0
+
+    assert crud.get_resume_json(db=db, resume_id=resume_id) == (content, etag)
+    assert count_statements.count == 0
+    assert content == crud.render_document(crud.get_resume(db=db, resume_id=resume_id))
+
+@pytest.mark.parametrize("resumes", [1, 20])
+def test_batch_get_statement_budget(db, count_statements, resumes):
+    user = create_user(db)
+    resume_ids = crud.create_resumes(db=db, resumes=[make_resume(user_id=user.id, children=3) for _ in range(resumes)])
+    single = crud.get_resume_json(db=db, resume_id=resume_ids[0])[0]
+    crud.resume_cache.invalidate(crud.resume_cache_key(resume_ids[0]))
+
+    count_statements.count = 0
+    content = crud.get_resumes_json(db=db, resume_ids=list(reversed(resume_ids)) + [0])
+
+    # one statement for the resumes and one per child table, whatever the number of ids
+    assert count_statements.count == 5
+    items = schemas.ResumeBatchResponse.model_validate_json(content).items
+    assert [item.id for item in items] == list(reversed(resume_ids)) + [0]
+    assert [item.status for item in items] == [200] * resumes + [404]
+    assert items[-1].resume == None
+    assert all(len(item.resume.skills) == 3 for item in items[:-1])
+    assert items[-2].resume.model_dump_json().encode() == single
+
+    count_statements.count = 0
+    assert crud.get_resumes_json(db=db, resume_ids=resume_ids[:1]) == b'{"items":[{"id":%d,"status":200,"resume":%s}]}' % (resume_ids[0], single)
+    assert count_statements.count == 0
+
+def test_snapshot_serves_resume_from_one_statement(db, monkeypatch, count_statements):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=3))["id"]
+    assembled = crud.get_resume_json(db=db, resume_id=resume_id)
+    monkeypatch.setattr(crud, "RESUME_SNAPSHOTS", True)
+    snapshots.rebuild_snapshots(db=db)
+    crud.resume_cache.invalidate(crud.resume_cache_key(resume_id))
+
+    count_statements.count = 0
+    assert crud.get_resume_json(db=db, resume_id=resume_id) == assembled
+    assert count_statements.count == 1
+
+def test_snapshots_follow_writes(db, monkeypatch):
+    monkeypatch.setattr(crud, "RESUME_SNAPSHOTS", True)
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))["id"]
+    other_id = crud.create_resumes(db=db, resumes=[make_resume(user_id=user.id, children=1)])[0]
+    crud.partial_update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(skills=[schemas.Skill(type="Tool", name="Docker")]))
+
+    assert snapshots.check_snapshots(db=db) == {"missing": [], "stale": [], "different": [], "orphaned": []}
+    assert crud.find_resume_snapshots(db=db, resume_ids=[resume_id])[resume_id][0]["skills"][0]["name"] == "Docker"
+
+    crud.delete_resume(db=db, resume_id=other_id)
+    assert db.query(models.ResumeSnapshot).count() == 1
+
+def test_stale_snapshot_is_not_served_and_rebuilt(db, monkeypatch):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))["id"]
+    monkeypatch.setattr(crud, "RESUME_SNAPSHOTS", True)
+    snapshots.rebuild_snapshots(db=db)
+    # a write made while the snapshots were turned off
+    monkeypatch.setattr(crud, "RESUME_SNAPSHOTS", False)
+    crud.partial_update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(title="Changed"))
+    monkeypatch.setattr(crud, "RESUME_SNAPSHOTS", True)
+
+    assert crud.find_resume_document(db=db, resume_id=resume_id)[0]["title"] == "Changed"
+    assert snapshots.check_snapshots(db=db)["stale"] == [resume_id]
+    snapshots.rebuild_snapshots(db=db)
+    assert snapshots.check_snapshots(db=db)["stale"] == []
+
+# the JSON FastAPI renders for a validated response_model
+def validated_json(response):
+    validated = schemas.ResumeResponse.model_validate(response)
+    return JSONResponse(content=validated.model_dump(mode="json")).body
+
+@pytest.mark.parametrize("children", [0, 100])
+def test_serialized_response_matches_response_model(db, children):
+    user = create_user(db)
+    tricky = 'Ünïcode "quotes" \\ back\nslash\t\x01 </script> \u2028 😀'
+    resume = make_resume(user_id=user.id, children=children).model_copy(update={"title": tricky, "description": tricky})
+    resume.educations.append(schemas.Education(institution=tricky, degree=tricky))
+    resume_id = crud.create_resume(db=db, resume=resume)["id"]
+    db.expunge_all()
+
+    response = crud.get_resume(db=db, resume_id=resume_id)
+
+    assert crud.render_document(response) == validated_json(response)
+    assert crud.get_resume_json(db=db, resume_id=resume_id)[0] == validated_json(response)
+    assert len(response["educations"]) == children + 1
+
+@pytest.mark.parametrize("snapshots", [False, True])
+def test_write_and_read_render_the_same_body(db, monkeypatch, snapshots):
+    monkeypatch.setattr(crud, "RESUME_SNAPSHOTS", snapshots)
+    user = create_user(db)
+    # existing skills and keywords have lower ids than new ones listed before them
+    crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1).model_copy(update={
+        "skills": [schemas.Skill(type="Tool", name="A")], "keywords": [schemas.Keyword(name="A")],
+    }))
+    resume = make_resume(user_id=user.id, children=0).model_copy(update={
+        "skills": [schemas.Skill(type="Tool", name="Z"), schemas.Skill(type="Tool", name="A")],
+        "keywords": [schemas.Keyword(name="Z"), schemas.Keyword(name="A")],
+    })
+
+    created = crud.create_resume(db=db, resume=resume)
+    assert [skill["name"] for skill in created["skills"]] == ["A", "Z"]
+    assert crud.get_resume_json(db=db, resume_id=created["id"])[0] == crud.render_document(created)
+
+    update = schemas.ResumeUpdate(
+        educations=[schemas.Education(institution="Second", degree="PhD"), schemas.Education(institution="First", degree="Master")],
+        skills=[schemas.Skill(type="Tool", name="Y"), schemas.Skill(type="Tool", name="A")],
+        keywords=resume.keywords,
+    )
+    updated, etag = crud.update_resume(db=db, resume_id=created["id"], resume=update)
+    body, read_etag = crud.get_resume_json(db=db, resume_id=created["id"])
+    assert (body, read_etag) == (crud.render_document(updated), etag)
+    db.expunge_all()
+    assert crud.render_document(crud.get_resume(db=db, resume_id=created["id"])) == body
+
+@pytest.mark.parametrize("write", ["update", "partial_update", "delete"])
+def test_resume_writes_invalidate_cache(db, monkeypatch, write):
+    backend = FakeSharedBackend()
+    monkeypatch.setattr(crud, "resume_cache", ResponseCache("resume", backend))
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))["id"]
+    other_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+    crud.get_resume_json(db=db, resume_id=resume_id)
+    crud.get_resume_json(db=db, resume_id=other_id)
+
+    if write == "update":
+        crud.update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(title="New title"))
+    elif write == "partial_update":
+        crud.partial_update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(title="New title"))
+    else:
+        crud.delete_resume(db=db, resume_id=resume_id)
+
+    assert crud.resume_cache_key(resume_id) not in backend.values
+    assert crud.resume_cache_key(other_id) in backend.values
+
+# a write commits and invalidates the entry between the read of the resume and the fill
+@pytest.mark.parametrize("shared", [False, True])
+@pytest.mark.parametrize("read", ["get", "batch_get"])
+def test_read_concurrent_with_write_is_not_cached(db, monkeypatch, shared, read):
+    if shared:
+        monkeypatch.setattr(crud, "resume_cache", ResponseCache("resume", FakeSharedBackend()))
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+
+    load_resume_documents = crud.load_resume_documents
+    def load_before_write(db, resume_ids):
+        documents = load_resume_documents(db=db, resume_ids=resume_ids)
+        with TestingSessionLocal() as other:
+            crud.partial_update_resume(db=other, resume_id=resume_id, resume=schemas.ResumeUpdate(title="New title"))
+        return documents
+    monkeypatch.setattr(crud, "load_resume_documents", load_before_write)
+    if read == "get":
+        assert crud.get_resume_json(db=db, resume_id=resume_id)[1] == crud.resume_etag(resume_id, 1)
+    else:
+        crud.get_resumes_json(db=db, resume_ids=[resume_id])
+    monkeypatch.setattr(crud, "load_resume_documents", load_resume_documents)
+
+    content, etag = crud.get_resume_json(db=db, resume_id=resume_id)
+    assert etag == crud.resume_etag(resume_id, 2)
+    assert b"New title" in content
+    # the read after the write fills the entry
+    assert crud.resume_cache.get(crud.resume_cache_key(resume_id)) == etag.encode() + b"\n" + content
+
+def test_writes_bump_version_and_etag(db):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+    content, etag = crud.get_resume_json(db=db, resume_id=resume_id)
+
+    assert etag == crud.resume_etag(resume_id, 1)
+    assert crud.get_resume_json(db=db, resume_id=resume_id, if_none_match=etag) == (None, etag)
+
+    _, new_etag = crud.partial_update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(title="New title"), if_match=etag)
+
+    assert new_etag == crud.resume_etag(resume_id, 2)
+    assert crud.get_resume_json(db=db, resume_id=resume_id, if_none_match=etag)[0] != None
+
+def test_stale_if_match_is_rejected(db):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+    stale_etag = crud.resume_etag(resume_id, 1)
+    crud.update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(title="New title"))
+
+    with pytest.raises(crud.PreconditionFailed):
+        crud.update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(title="Lost update"), if_match=stale_etag)
+    with pytest.raises(crud.PreconditionFailed):
+        crud.delete_resume(db=db, resume_id=resume_id, if_match=stale_etag)
+
+    assert crud.get_resume(db=db, resume_id=resume_id)["title"] == "New title"
+
+# another session writes the resume between the read and the flush of the write
+def write_concurrently(monkeypatch, resume_id: int):
+    update_resume_educations = crud.update_resume_educations
+    writes = []
+    def update_after_other_write(resume, educations):
+        if writes == []:
+            with TestingSessionLocal() as other:
+                writes.append(crud.partial_update_resume(db=other, resume_id=resume_id, resume=schemas.ResumeUpdate(title="First")))
+        update_resume_educations(resume=resume, educations=educations)
+    monkeypatch.setattr(crud, "update_resume_educations", update_after_other_write)
+
+def test_concurrent_write_fails_if_match(db, monkeypatch):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+    write_concurrently(monkeypatch, resume_id=resume_id)
+
+    with pytest.raises(crud.PreconditionFailed):
+        crud.update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(title="Second"), if_match=crud.resume_etag(resume_id, 1))
+
+    assert crud.get_resume(db=db, resume_id=resume_id)["title"] == "First"
+
+def test_concurrent_write_without_if_match_is_made_again(db, monkeypatch):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+    write_concurrently(monkeypatch, resume_id=resume_id)
+
+    response, etag = crud.update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(title="Second"))
+
+    assert response["title"] == "Second"
+    assert etag == crud.resume_etag(resume_id, 3)
+    assert crud.get_resume(db=db, resume_id=resume_id)["title"] == "Second"
+
+def test_write_losing_every_race_conflicts(db, monkeypatch):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+    flushes = []
+    def lose_race(db, resume, skill_ids, keyword_ids):
+        flushes.append(resume.id)
+        raise StaleDataError("UPDATE statement on table 'resumes' expected to update 1 row(s); 0 were matched.")
+    monkeypatch.setattr(crud, "flush_resume_update", lose_race)
+
+    with pytest.raises(crud.ResumeWriteConflict):
+        crud.update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(title="Second"))
+
+    assert len(flushes) == crud.RESUME_WRITE_ATTEMPTS
+
+def create_dated_resumes(db, user_id: int, count: int):
+    resume_ids = []
+    for i in range(count):
+        resume = make_resume(user_id=user_id, children=1)
+        resume.skills = [schemas.Skill(type="Programming language", name="Python" if i % 2 == 0 else "Java")]
+        resume_ids.append(crud.create_resume(db=db, resume=resume)["id"])
+
+    # resumes created in the same second share a date, the id breaks the tie
+    for i, resume_id in enumerate(resume_ids):
+        date = datetime.datetime(2023, 1, 1) + datetime.timedelta(days=i // 2)
+        db.query(models.Resume).filter(models.Resume.id == resume_id).update({models.Resume.date: date})
+    db.commit()
+
+    return resume_ids
+
+def test_resume_pages_follow_keyset_order(db, count_statements):
+    user = create_user(db)
+    resume_ids = create_dated_resumes(db, user_id=user.id, count=7)
+
+    pages = []
+    cursor = None
+    count_statements.count = 0
+    while True:
+        page = crud.get_resumes_page(db=db, limit=3, cursor=cursor)
+        pages.append([resume["id"] for resume in page["items"]])
+        cursor = page["next_cursor"]
+        if cursor == None:
+            break
+
+    assert pages == [resume_ids[::-1][0:3], resume_ids[::-1][3:6], resume_ids[::-1][6:]]
+    # each page is hydrated with the same number of statements
+    assert count_statements.count == 5 * len(pages)
+
+def test_resume_pages_are_filtered(db):
+    user = create_user(db)
+    other_user = create_user(db, email="other_user@example.com")
+    resume_ids = create_dated_resumes(db, user_id=user.id, count=4)
+    create_dated_resumes(db, user_id=other_user.id, count=2)
+
+    page = crud.get_resumes_page(db=db, limit=10, user_id=user.id, skill="Python")
+
+    assert [resume["id"] for resume in page["items"]] == [resume_ids[2], resume_ids[0]]
+    assert page["next_cursor"] == None
+    assert len(crud.get_resumes_page(db=db, limit=10, keyword="Keyword 0")["items"]) == 6
+    assert crud.get_resumes_page(db=db, limit=10, keyword="Unknown")["items"] == []
+
+def test_resume_chunks_load_children_per_chunk(db, count_statements):
+    user = create_user(db)
+    resume_ids = [crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=2))["id"] for _ in range(5)]
+    db.expunge_all()
+
+    count_statements.count = 0
+    chunks = []
+    for chunk in crud.iter_resume_chunks(db=db, chunk_size=2):
+        chunks.append([resume["id"] for resume in chunk])
+        # objects of the previous chunks are not kept by the session
+        assert len(db.identity_map) <= 2 * (1 + 4 * 2 + 2 * 2)
+
+    assert chunks == [resume_ids[0:2], resume_ids[2:4], resume_ids[4:]]
+    # one cursor for the resumes and one statement per child collection and chunk
+    assert count_statements.count == 1 + 4 * 3
+
+def test_invalid_cursor(db):
+    with pytest.raises(crud.InvalidCursor):
+        crud.get_resumes_page(db=db, limit=10, cursor="not a cursor")
+
+def assert_refcounts_match_associations(db):
+    for skill in db.query(models.Skill):
+        assert skill.refcount == db.query(models.ResumeSkillAssociation).filter_by(skill_id=skill.id).count()
+    for keyword in db.query(models.Keyword):
+        assert keyword.refcount == db.query(models.ResumeKeywordAssociation).filter_by(keyword_id=keyword.id).count()
+
+def test_refcounts_follow_writes(db):
+    user_id = create_user(db).id
+    first_id = crud.create_resume(db=db, resume=make_resume(user_id=user_id, children=3))["id"]
+    second_id = crud.create_resumes(db=db, resumes=[make_resume(user_id=user_id, children=2)] * 2)[0]
+    assert_refcounts_match_associations(db)
+
+    crud.update_resume(db=db, resume_id=first_id, resume=schemas.ResumeUpdate(skills=[schemas.Skill(type="Tool", name="Docker")], keywords=[schemas.Keyword(name="Keyword 0")]))
+    crud.partial_update_resume(db=db, resume_id=second_id, resume=schemas.ResumeUpdate(skills=[schemas.Skill(type="Tool", name="Docker")]))
+    assert_refcounts_match_associations(db)
+
+    crud.delete_resume(db=db, resume_id=second_id)
+    assert_refcounts_match_associations(db)
+    crud.delete_user(db=db, user_id=user_id)
+    jobs.run_due_jobs(db=db)
+    assert db.query(models.Skill).count() == 0
+
+# the refcount UPDATEs lock their rows until the commit; writes that list the same skills in
+# opposite orders must not deadlock. TEST_DATABASE_URL runs it against PostgreSQL, on SQLite the
+# writes are serialized by the database lock
+def test_concurrent_writes_sharing_skills(monkeypatch, tmp_path):
+    url = os.getenv("TEST_DATABASE_URL", f"sqlite:///{tmp_path}/concurrent.db")
+    concurrent_engine = create_engine(url, connect_args={"timeout": 30} if url.startswith("sqlite") else {})
+    ConcurrentSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=concurrent_engine)
+    monkeypatch.setattr(crud, "skill_cache", TTLCache(maxsize=100))
+    monkeypatch.setattr(crud, "keyword_cache", TTLCache(maxsize=100))
+    monkeypatch.setattr(crud, "resume_cache", create_response_cache("resume", backend="none", maxsize=0, ttl=0, url=""))
+    monkeypatch.setattr(crud, "search_index", InvertedIndex())
+    models.Base.metadata.create_all(bind=concurrent_engine)
+    try:
+        with ConcurrentSessionLocal() as db:
+            user_id = create_user(db).id
+            crud.create_resume(db=db, resume=make_resume(user_id=user_id, children=10))
+
+        writers = 4
+        barrier = threading.Barrier(writers)
+        errors = []
+        def write(reverse: bool):
+            resume = make_resume(user_id=user_id, children=10)
+            if reverse:
+                resume.skills.reverse()
+                resume.keywords.reverse()
+            try:
+                with ConcurrentSessionLocal() as db:
+                    barrier.wait()
+                    for _ in range(5):
+                        resume_id = crud.create_resume(db=db, resume=resume)["id"]
+                        crud.delete_resume(db=db, resume_id=resume_id)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=write, args=(i % 2 == 1,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        with ConcurrentSessionLocal() as db:
+            assert_refcounts_match_associations(db)
+            assert {skill.refcount for skill in db.query(models.Skill)} == {1}
+    finally:
+        models.Base.metadata.drop_all(bind=concurrent_engine)
+        concurrent_engine.dispose()
+
+def test_top_and_trending_skills_and_keywords(db):
+    user = create_user(db)
+    resume_ids = crud.create_resumes(db=db, resumes=[make_resume(user_id=user.id, children=children) for children in [3, 2, 1]])
+    for resume_id, date in zip(resume_ids, [datetime.datetime(2026, 1, 5), datetime.datetime(2026, 1, 20), datetime.datetime(2026, 2, 2)]):
+        db.query(models.Resume).filter(models.Resume.id == resume_id).update({"date": date})
+    db.commit()
+
+    assert [(skill.name, skill.count) for skill in crud.get_top_skills(db=db, limit=2)] == [("Language 0", 3), ("Language 1", 2)]
+    assert [(keyword.name, keyword.count) for keyword in crud.get_top_keywords(db=db, limit=10)] == [("Keyword 0", 3), ("Keyword 1", 2), ("Keyword 2", 1)]
+
+    trend = crud.get_skill_trend(db=db, bucket="month", limit=2, since=datetime.datetime(2026, 1, 1), until=datetime.datetime(2027, 1, 1))
+    assert [(str(point.bucket), point.name, point.count) for point in trend] == [
+        ("2026-01-01", "Language 0", 2), ("2026-01-01", "Language 1", 2), ("2026-02-01", "Language 0", 1),
+    ]
+    trend = crud.get_keyword_trend(db=db, bucket="week", limit=1, since=datetime.datetime(2026, 1, 10), until=datetime.datetime(2026, 3, 1))
+    assert [(str(point.bucket), point.name, point.count) for point in trend] == [("2026-01-19", "Keyword 0", 1), ("2026-02-02", "Keyword 0", 1)]
+
+def test_search_resumes_with_facets(db):
+    user = create_user(db)
+    python = make_resume(user_id=user.id, children=2).model_copy(update={"title": "Python developer"})
+    go = make_resume(user_id=user.id, children=1).model_copy(update={"title": "Go developer"})
+    python_id = crud.create_resume(db=db, resume=python)["id"]
+    go_id = crud.create_resume(db=db, resume=go)["id"]
+
+    page = crud.search_resumes(db=db, text="developer", limit=10)
+
+    assert [resume["id"] for resume in page["items"]] == [go_id, python_id]
+    assert [(facet["name"], facet["count"]) for facet in page["skills"]] == [("Language 0", 2), ("Language 1", 1)]
+    assert [(facet["name"], facet["count"]) for facet in page["keywords"]] == [("Keyword 0", 2), ("Keyword 1", 1)]
+
+    page = crud.search_resumes(db=db, text="python DEVELOPER", limit=10)
+
+    assert [resume["id"] for resume in page["items"]] == [python_id]
+    assert [facet["count"] for facet in page["skills"]] == [1, 1]
+
+def test_search_facets_count_the_newest_matches(db, monkeypatch):
+    monkeypatch.setattr(crud, "RESUME_SEARCH_FACET_RESUMES", 2)
+    user = create_user(db)
+    create_dated_resumes(db, user_id=user.id, count=4)
+
+    page = crud.search_resumes(db=db, text=None, limit=10)
+
+    # the resumes of the two newest dates use Python and Java once each
+    assert len(page["items"]) == 4
+    assert sorted((facet["name"], facet["count"]) for facet in page["skills"]) == [("Java", 1), ("Python", 1)]
+
+def test_search_index_follows_writes(db):
+    user = create_user(db)
+    resume_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+    assert crud.search_resumes(db=db, text="cool", limit=10)["items"][0]["id"] == resume_id
+
+    crud.partial_update_resume(db=db, resume_id=resume_id, resume=schemas.ResumeUpdate(description="Rust engineer"))
+    other_id = crud.create_resume(db=db, resume=make_resume(user_id=user.id, children=1))["id"]
+
+    assert [resume["id"] for resume in crud.search_resumes(db=db, text="cool", limit=10)["items"]] == [other_id]
+    assert [resume["id"] for resume in crud.search_resumes(db=db, text="rust", limit=10)["items"]] == [resume_id]
+
+    crud.delete_resume(db=db, resume_id=resume_id)
+
+    assert crud.search_resumes(db=db, text="rust", limit=10)["items"] == []
+    assert crud.search_index.search("rust") == set()
@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from . import crud, jobs, models, schemas
+from .cache import TTLCache, create_response_cache
+from .database import run_crud
+from .search import InvertedIndex
+
+# DATABASE_ASYNC=true: the crud functions run through run_crud on the sync session of an
+# AsyncSession (run_sync), here over aiosqlite
+
+@pytest.fixture
+def async_session_factory(monkeypatch, tmp_path):
+    monkeypatch.setattr(crud, "resume_cache", create_response_cache("resume", backend="memory", maxsize=100, ttl=60, url=""))
+    monkeypatch.setattr(crud, "search_index", InvertedIndex())
+    monkeypatch.setattr(crud, "skill_cache", TTLCache(maxsize=100))
+    monkeypatch.setattr(crud, "keyword_cache", TTLCache(maxsize=100))
+    monkeypatch.setattr(crud, "RESUME_SNAPSHOTS", False)
+    monkeypatch.setattr(crud, "JOB_QUEUE", True)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/async.db")
+
+    async def create_schema():
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+    asyncio.run(create_schema())
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+def test_crud_runs_on_async_session(async_session_factory):
+    async def run():
+        async with async_session_factory() as db:
+            user = schemas.UserCreate(email="async_user@example.com", password="not a password", first_name="Willy", last_name="Wonka")
+            user_id = (await run_crud(db, crud.create_user, user=user, hashed_password="not a hash")).id
+            resume = schemas.ResumeCreate(
+                user_id=user_id, title="Async resume", description="Written through run_sync",
+                educations=[schemas.Education(institution="MIT", degree="Master")], conferences=[],
+                skills=[schemas.Skill(type="Tool", name="Docker"), schemas.Skill(type="Tool", name="Git")],
+                keywords=[schemas.Keyword(name="async")],
+            )
+            created = await run_crud(db, crud.create_resume, resume=resume)
+            body, etag = await run_crud(db, crud.get_resume_json, resume_id=created["id"])
+
+            update = schemas.ResumeUpdate(title="Updated", skills=[schemas.Skill(type="Tool", name="Git")])
+            updated, updated_etag = await run_crud(db, crud.partial_update_resume, resume_id=created["id"], resume=update)
+            bulk_ids = await run_crud(db, crud.create_resumes, resumes=[resume, resume])
+            deleted = await run_crud(db, crud.delete_resume, resume_id=created["id"])
+            ran = await run_crud(db, jobs.run_due_jobs)
+            skills = await run_crud(db, lambda db: [skill.name for skill in db.query(models.Skill).order_by(models.Skill.name)])
+            missing = await run_crud(db, crud.get_resume_json, resume_id=created["id"])
+            return created, body, etag, updated, updated_etag, bulk_ids, deleted, ran, skills, missing
+
+    created, body, etag, updated, updated_etag, bulk_ids, deleted, ran, skills, missing = asyncio.run(run())
+
+    assert body == crud.render_document(created)
+    assert etag == crud.resume_etag(created["id"], 1)
+    assert (updated["title"], [skill["name"] for skill in updated["skills"]]) == ("Updated", ["Git"])
+    assert updated_etag == crud.resume_etag(created["id"], 2)
+    assert len(bulk_ids) == 2 and None not in bulk_ids
+    assert deleted["id"] == created["id"]
+    assert ran == 2
+    # the bulk resumes still use both skills
+    assert skills == ["Docker", "Git"]
+    assert missing == None
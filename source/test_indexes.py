@@ -0,0 +1,138 @@
+import datetime
+import os
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from . import crud, jobs, models, schemas
+from .cache import TTLCache
+
+# every lookup the crud functions issue must be answered from an index: the statements are
+# captured as they run and explained again, a full scan of a table fails the test;
+# TEST_DATABASE_URL runs the same checks against PostgreSQL
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "sqlite://")
+
+if TEST_DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+else:
+    engine = create_engine(TEST_DATABASE_URL)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+class StatementRecorder:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "DELETE")):
+            self.statements.append((statement, parameters))
+
+# returns the lines of the plan that read a whole table
+def full_scans(conn, statement: str, parameters):
+    if engine.dialect.name == "sqlite":
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        details = [row[-1] for row in plan]
+        # "SCAN CONSTANT ROW" and the like read the values of the statement, not a table
+        return [detail for detail in details if detail.startswith("SCAN ") and detail.split()[1] in models.Base.metadata.tables and " USING " not in detail]
+
+    # the tables of the test are small, so the planner is told to prefer the indexes it has
+    conn.exec_driver_sql("SET enable_seqscan = off")
+    plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+    return [line for line in str(plan).split(",") if "Seq Scan" in line]
+
+# returns the lines of the plan that read the index
+def index_reads(conn, statement: str, parameters, index: str):
+    if engine.dialect.name == "sqlite":
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        return [row[-1] for row in plan if index in row[-1]]
+
+    plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+    return [line for line in str(plan).split(",") if index in line]
+
+@pytest.fixture
+def db(monkeypatch):
+    # ids cached by other tests belong to other databases
+    monkeypatch.setattr(crud, "skill_cache", TTLCache(maxsize=100))
+    monkeypatch.setattr(crud, "keyword_cache", TTLCache(maxsize=100))
+    models.Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def recorder():
+    recorder = StatementRecorder()
+    event.listen(engine, "before_cursor_execute", recorder)
+    yield recorder
+    event.remove(engine, "before_cursor_execute", recorder)
+
+def seed(db):
+    users = [models.User(email=f"index_user_{i}@example.com", password="not a hash", first_name="Willy", last_name="Wonka") for i in range(3)]
+    db.add_all(users)
+    db.commit()
+
+    resume_ids = []
+    for i in range(6):
+        resume = schemas.ResumeCreate(
+            user_id=users[i % 3].id,
+            title="Just a resume",
+            description="Resume of a cool developer",
+            educations=[schemas.Education(institution="MIT", degree="Master")],
+            conferences=[schemas.Conference(name="PyCon", year=2020)],
+            skills=[schemas.Skill(type="Programming language", name=f"Language {i % 2}")],
+            keywords=[schemas.Keyword(name=f"Keyword {i % 2}")],
+        )
+        resume_ids.append(crud.create_resume(db=db, resume=resume)["id"])
+
+    user = users[0].id, users[0].email
+    db.expunge_all()
+    return user, resume_ids
+
+def test_lookups_use_indexes(db, recorder):
+    (user_id, user_email), resume_ids = seed(db)
+    skill = db.query(models.Skill).first()
+    keyword = db.query(models.Keyword).first()
+    recorder.statements.clear()
+
+    crud.find_user_id(db=db, user_id=user_id)
+    crud.find_user_email(db=db, user_email=user_email)
+    crud.find_user_resume_ids(db=db, user_id=user_id)
+    crud.find_resume_full(db=db, resume_id=resume_ids[0])
+    crud.find_resume_version(db=db, resume_id=resume_ids[0])
+    crud.find_skills(db=db, skills=[schemas.Skill(type=skill.type, name=skill.name)])
+    crud.find_keywords(db=db, keywords=[schemas.Keyword(name=keyword.name)])
+    page = crud.get_resumes_page(db=db, limit=2)
+    crud.get_resumes_page(db=db, limit=2, cursor=page["next_cursor"])
+    crud.get_resumes_page(db=db, limit=2, user_id=user_id)
+    crud.get_resumes_page(db=db, limit=2, skill=skill.name, keyword=keyword.name)
+    crud.search_resumes(db=db, text=None, limit=2, skill=skill.name)
+    crud.get_top_skills(db=db, limit=2)
+    crud.get_top_keywords(db=db, limit=2)
+    until = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+    crud.get_skill_trend(db=db, bucket="week", limit=2, since=until - datetime.timedelta(days=90), until=until)
+    crud.get_keyword_trend(db=db, bucket="month", limit=2, since=until - datetime.timedelta(days=90), until=until)
+    crud.delete_resume(db=db, resume_id=resume_ids[0])
+    jobs.run_due_jobs(db=db)
+    assert len(recorder.statements) > 0
+
+    with engine.connect() as conn:
+        for statement, parameters in recorder.statements:
+            assert full_scans(conn, statement, parameters) == [], statement
+
+def test_search_facets_read_the_newest_matches(db, recorder):
+    seed(db)
+    recorder.statements.clear()
+
+    crud.search_resumes(db=db, text=None, limit=2)
+
+    facets = [(statement, parameters) for statement, parameters in recorder.statements if "count(*)" in statement]
+    assert len(facets) == 2
+    with engine.connect() as conn:
+        for statement, parameters in facets:
+            assert full_scans(conn, statement, parameters) == [], statement
+            # the matches are read from the date index up to RESUME_SEARCH_FACET_RESUMES,
+            # not looked up for every association
+            assert index_reads(conn, statement, parameters, "ix_resumes_date_id") != [], statement
@@ -0,0 +1,147 @@
+import asyncio
+from datetime import timedelta
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from . import jobs, models
+from .settings import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS
+
+# the queue is tested against an in-memory database, the SQLite fallback of the claim
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(jobs, "handlers", {})
+    models.Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(bind=engine)
+
+# a handler whose work is a user row, so a failed attempt has something to roll back
+def register_signup(fail_times: int = 0):
+    calls = []
+
+    @jobs.handler("signup")
+    def signup(db, email: str):
+        calls.append(email)
+        db.add(models.User(email=f"{email}-{len(calls)}", password="not a hash", first_name="Willy", last_name="Wonka"))
+        db.flush()
+        if len(calls) <= fail_times:
+            raise RuntimeError("temporary failure")
+
+    return calls
+
+def test_job_runs_and_is_deleted_with_its_work(db):
+    calls = register_signup()
+    jobs.enqueue(db=db, kind="signup", payload={"email": "jobs@example.com"}, key="signup:1")
+    db.commit()
+
+    assert jobs.run_due_jobs(db=db) == 1
+    assert calls == ["jobs@example.com"]
+    assert db.query(models.User).count() == 1
+    assert db.query(models.Job).count() == 0
+    assert jobs.run_due_jobs(db=db) == 0
+
+def test_job_is_enqueued_once_per_key(db):
+    calls = register_signup()
+    for _ in range(3):
+        jobs.enqueue(db=db, kind="signup", payload={"email": "jobs@example.com"}, key="signup:1")
+    jobs.enqueue(db=db, kind="signup", payload={"email": "other@example.com"})
+    db.commit()
+
+    assert db.query(models.Job).count() == 2
+    jobs.run_due_jobs(db=db)
+    assert sorted(calls) == ["jobs@example.com", "other@example.com"]
+
+def test_rolled_back_write_enqueues_nothing(db):
+    register_signup()
+    jobs.enqueue(db=db, kind="signup", payload={"email": "jobs@example.com"})
+    db.rollback()
+
+    assert db.query(models.Job).count() == 0
+
+def test_failed_job_is_rolled_back_and_retried_with_backoff(db):
+    calls = register_signup(fail_times=1)
+    jobs.enqueue(db=db, kind="signup", payload={"email": "jobs@example.com"})
+    db.commit()
+    now = jobs.utcnow()
+
+    assert jobs.run_due_jobs(db=db, now=now) == 1
+    job = db.query(models.Job).one()
+    assert (job.status, job.attempts) == ("pending", 1)
+    assert "temporary failure" in job.last_error
+    assert db.query(models.User).count() == 0
+
+    # not due before the backoff
+    assert jobs.run_due_jobs(db=db, now=now + timedelta(seconds=1)) == 0
+    assert jobs.run_due_jobs(db=db, now=now + timedelta(seconds=3)) == 1
+    assert len(calls) == 2
+    assert db.query(models.User).count() == 1
+    assert db.query(models.Job).count() == 0
+
+def test_job_is_kept_as_failed_after_the_last_attempt(db):
+    register_signup(fail_times=JOB_MAX_ATTEMPTS)
+    jobs.enqueue(db=db, kind="signup", payload={"email": "jobs@example.com"})
+    db.commit()
+
+    now = jobs.utcnow()
+    for _ in range(JOB_MAX_ATTEMPTS):
+        assert jobs.run_due_jobs(db=db, now=now) == 1
+        now = now + timedelta(seconds=2 ** JOB_MAX_ATTEMPTS)
+
+    job = db.query(models.Job).one()
+    assert (job.status, job.attempts) == ("failed", JOB_MAX_ATTEMPTS)
+    assert jobs.run_due_jobs(db=db, now=now + timedelta(days=1)) == 0
+
+def test_claimed_job_is_claimed_again_after_its_lease(db):
+    register_signup()
+    jobs.enqueue(db=db, kind="signup", payload={"email": "jobs@example.com"})
+    db.commit()
+    now = jobs.utcnow()
+
+    # a worker claims the job and dies
+    assert len(jobs.claim_jobs(db=db, limit=10, now=now)) == 1
+    other = TestingSessionLocal()
+    try:
+        assert jobs.claim_jobs(db=other, limit=10, now=now) == []
+        assert jobs.run_due_jobs(db=other, now=now + timedelta(seconds=JOB_LEASE_SECONDS + 1)) == 1
+    finally:
+        other.close()
+    assert db.query(models.Job).count() == 0
+
+# the workers run in threads, so they get connections of their own to a database in a file,
+# as in the server, rather than the single connection of the in-memory database
+def test_workers_run_committed_jobs(monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, "handlers", {})
+    calls = register_signup()
+    file_engine = create_engine(f"sqlite:///{tmp_path}/jobs.db", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=file_engine)
+    FileSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=file_engine)
+
+    async def run():
+        workers = jobs.JobWorkers(FileSessionLocal, workers=2, poll_seconds=60)
+        workers.start()
+        jobs.workers = workers
+        try:
+            # the commit wakes the idle workers long before their poll
+            with FileSessionLocal() as db:
+                jobs.enqueue(db=db, kind="signup", payload={"email": "jobs@example.com"})
+                db.commit()
+            for _ in range(100):
+                if calls != []:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await jobs.stop()
+
+    try:
+        asyncio.run(run())
+    finally:
+        file_engine.dispose()
+    assert calls == ["jobs@example.com"]
@@ -0,0 +1,72 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from . import instrumentation, metrics, models
+from .database import InstrumentedQueuePool, engine, pool_checkout_seconds, pool_limits, register_pool_metrics
+from .main import app
+
+# the application leaves the schema to alembic
+models.Base.metadata.create_all(bind=engine)
+
+client = TestClient(app)
+
+# tests
+
+def test_render_counter_and_histogram():
+    counter = metrics.Counter("test_requests_total", "Requests", ("route",))
+    histogram = metrics.Histogram("test_latency_seconds", "Latency", buckets=(0.1, 1))
+    counter.inc("/a")
+    counter.inc("/a")
+    histogram.observe(value=0.05)
+    histogram.observe(value=0.5)
+
+    rendered = metrics.render()
+
+    assert 'test_requests_total{route="/a"} 2' in rendered
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in rendered
+    assert 'test_latency_seconds_bucket{le="+Inf"} 2' in rendered
+    assert "test_latency_seconds_count 2" in rendered
+
+def test_pool_checkout_is_measured(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/pool.db", poolclass=InstrumentedQueuePool, pool_size=2)
+    register_pool_metrics(engine.pool, "test")
+    checkouts = pool_checkout_seconds.get("sync")[0]
+
+    with engine.connect() as connection:
+        connection.execute(text("select 1"))
+        assert 'db_pool_checked_out{engine="test"} 1' in metrics.render()
+
+    assert pool_checkout_seconds.get("sync")[0] == checkouts + 1
+    assert 'db_pool_checked_out{engine="test"} 0' in metrics.render()
+
+def test_pool_limits_share_max_connections():
+    assert pool_limits(80, workers=4, engines=1) == (5, 15)
+    assert pool_limits(80, workers=8, engines=2) == (5, 0)
+    assert pool_limits(10, workers=16, engines=1) == (1, 0)
+
+def test_metrics_endpoint():
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert "# TYPE db_pool_checkout_seconds histogram" in response.text
+
+def test_request_sql_is_reported_per_route():
+    statements = instrumentation.request_statements.get("GET", "/api/resumes/{resume_id}")[0]
+
+    response = client.get("/api/resumes/0")
+
+    assert response.status_code == 404
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert "statements" in response.headers["Server-Timing"]
+    assert instrumentation.request_statements.get("GET", "/api/resumes/{resume_id}")[0] == statements + 1
+
+def test_slow_query_is_logged_redacted(monkeypatch, caplog):
+    monkeypatch.setattr(instrumentation, "DATABASE_SLOW_QUERY_SECONDS", 1e-9)
+    engine = create_engine("sqlite://")
+    instrumentation.instrument_engine(engine)
+
+    with engine.connect() as connection:
+        connection.execute(text("select :email"), {"email": "secret@example.com"})
+
+    assert "select ?" in caplog.text
+    assert "<str>" in caplog.text
+    assert "secret@example.com" not in caplog.text
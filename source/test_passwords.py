@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from passlib.context import CryptContext
+from . import passwords
+
+@pytest.fixture
+def pwd_context(monkeypatch):
+    # low costs keep the tests fast
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=5, bcrypt__min_rounds=5)
+    monkeypatch.setattr(passwords, "pwd_context", context)
+    return context
+
+# tests
+
+def test_verify_password(pwd_context):
+    hashed_password = passwords.hash_password("123secretpassword456")
+
+    assert passwords.verify_password("123secretpassword456", hashed_password) == (True, None)
+    assert passwords.verify_password("wrong password", hashed_password) == (False, None)
+
+def test_verify_password_upgrades_outdated_hash(pwd_context):
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("123secretpassword456")
+
+    is_valid, new_hash = passwords.verify_password("123secretpassword456", old_hash)
+
+    assert is_valid
+    assert pwd_context.identify(new_hash) == "bcrypt" and "$05$" in new_hash
+    assert passwords.verify_password("123secretpassword456", new_hash) == (True, None)
+
+def test_saturated_pool_rejects_jobs(monkeypatch):
+    monkeypatch.setattr(passwords, "pending", passwords.PASSWORD_HASHING_MAX_PENDING)
+
+    with pytest.raises(passwords.PasswordHashingBusy):
+        asyncio.run(passwords.hash_password_async("123secretpassword456"))
+
+def test_hash_password_in_process_pool():
+    try:
+        hashed_password = asyncio.run(passwords.hash_password_async("123secretpassword456"))
+    finally:
+        passwords.shutdown()
+
+    assert passwords.verify_password("123secretpassword456", hashed_password)[0]
+    assert passwords.pending == 0
+
+def test_broken_pool_is_replaced():
+    async def hash_after_kill():
+        first = await passwords.hash_password_async("123secretpassword456")
+        # a hashing process killed from outside, as the OOM killer would
+        process = next(iter(passwords.get_executor()._processes.values()))
+        process.kill()
+        process.join()
+        return first, await passwords.hash_password_async("123secretpassword456")
+
+    try:
+        first, second = asyncio.run(hash_after_kill())
+    finally:
+        passwords.shutdown()
+
+    assert passwords.verify_password("123secretpassword456", second)[0]
+    assert passwords.pending == 0
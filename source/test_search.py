@@ -0,0 +1,26 @@
+from .search import InvertedIndex, tokenize
+
+def test_tokenize():
+    assert tokenize("Senior Python/Go developer, python!") == {"senior", "python", "go", "developer"}
+
+def test_search_matches_every_word():
+    index = InvertedIndex()
+    index.load([(1, "Python developer"), (2, "Go developer"), (3, "Python and Go")])
+
+    assert index.search("developer") == {1, 2}
+    assert index.search("PYTHON go") == {3}
+    assert index.search("rust") == set()
+    assert index.search("  ") == set()
+
+def test_index_is_updated_incrementally():
+    index = InvertedIndex()
+    index.load([(1, "Python developer")])
+
+    index.add(2, "Python tester")
+    index.add(1, "Go developer")
+    index.remove(2)
+
+    assert index.search("python") == set()
+    assert index.search("go") == {1}
+    assert len(index) == 1
+    assert "tester" not in index.postings